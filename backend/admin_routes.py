@@ -5,14 +5,39 @@ from datetime import datetime, timedelta
 import uuid
 import logging
 
-from auth import get_current_user
+from auth import get_current_user, principal_cache
 from database import get_database
 from models import User, UserRole, SystemSettings, Withdrawal, WithdrawalStatus, Transaction, TransactionType
+from websocket_manager import chat_manager
+from chat_persistence import chat_writer
+from chat_history import room_history
+from chat_moderation import moderation_index
+from chat_presence import room_presence
+from chat_typing import typing_aggregator
+from rate_limit import rate_limiter, SETTINGS_PREFIX
+from chat_codec import wire_codec
+from chat_replay import room_replay
+from chat_heartbeat import heartbeat_monitor
+from runtime_monitor import runtime_monitor
+from chat_sharding import shard_router
+from tipping import tip_service
+from chat_leaderboard import tip_leaderboard
+from chat_downsampling import chat_downsampler
+from chat_actors import room_actors
+from chat_dedupe import client_message_ids
+from chat_inbox import chat_inbox
+from chat_events import event_streams
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+async def on_user_status_event(event: dict):
+    """Forget cached WebSocket logins of a user whose status an admin changed on any worker"""
+    principal_cache.invalidate_user(event["user_id"])
+
+chat_manager.add_bus_handler("user_status", on_user_status_event)
+
 # Request/Response Models
 class SystemSettingRequest(BaseModel):
     key: str = Field(..., description="Setting key")
@@ -117,6 +142,9 @@ async def create_or_update_setting(
             
             updated_setting = await db.system_settings.find_one({"key": request.key})
             
+            if request.key.startswith(SETTINGS_PREFIX):
+                await rate_limiter.load_settings()
+            
             return SystemSettingResponse(
                 id=updated_setting["_id"],
                 key=updated_setting["key"],
@@ -135,6 +163,9 @@ async def create_or_update_setting(
             
             await db.system_settings.insert_one(new_setting.model_dump(by_alias=True))
             
+            if request.key.startswith(SETTINGS_PREFIX):
+                await rate_limiter.load_settings()
+            
             return SystemSettingResponse(
                 id=new_setting.id,
                 key=new_setting.key,
@@ -168,6 +199,9 @@ async def delete_setting(
                 detail="Setting not found"
             )
         
+        if setting_key.startswith(SETTINGS_PREFIX):
+            await rate_limiter.load_settings()
+        
         return {"success": True, "message": f"Setting '{setting_key}' deleted successfully"}
         
     except HTTPException:
@@ -256,6 +290,42 @@ async def get_platform_stats(admin_user: User = Depends(require_admin)):
             detail="Failed to get platform statistics"
         )
 
+@router.get("/chat/stats")
+async def get_chat_stats(admin_user: User = Depends(require_admin)):
+    """Get real-time chat connection and delivery statistics"""
+    try:
+        return {
+            "success": True,
+            "connections": chat_manager.get_stats(),
+            "persistence": chat_writer.get_stats(),
+            "history": room_history.get_stats(),
+            "moderation": moderation_index.get_stats(),
+            "presence": room_presence.get_stats(),
+            "typing": typing_aggregator.get_stats(),
+            "rate_limits": rate_limiter.get_stats(),
+            "wire": wire_codec.get_stats(),
+            "replay": room_replay.get_stats(),
+            "heartbeat": heartbeat_monitor.get_stats(),
+            "runtime": runtime_monitor.get_stats(),
+            "sharding": shard_router.get_stats(),
+            "tips": tip_service.get_stats(),
+            "leaderboard": tip_leaderboard.get_stats(),
+            "downsampling": chat_downsampler.get_stats(),
+            "actors": room_actors.get_stats(),
+            "event_streams": event_streams.get_stats(),
+            "auth_cache": principal_cache.get_stats(),
+            "dedupe": client_message_ids.get_stats(),
+            "inbox": chat_inbox.get_stats(),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting chat stats: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get chat statistics"
+        )
+
 # User Management Routes
 @router.get("/users", response_model=List[UserManagementResponse])
 async def get_all_users(
@@ -322,6 +392,9 @@ async def update_user_status(
                 detail="User not found"
             )
         
+        # Drop the user's cached logins on every worker
+        await chat_manager.publish({"kind": "user_status", "user_id": user_id, "is_active": is_active})
+        
         status_text = "activated" if is_active else "deactivated"
         return {
             "success": True,
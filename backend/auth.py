@@ -3,7 +3,11 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import hashlib
 import os
+import time
 from database import users_collection
 from models import User, UserRole
 
@@ -15,9 +19,135 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-super-secret-jwt-key-quantumstrip
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
 
+# Authenticated WebSocket principals, kept briefly to absorb reconnect storms
+AUTH_CACHE_SECONDS = float(os.getenv("AUTH_CACHE_SECONDS", 30))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 50000))
+
 # HTTP Bearer for token authentication
 security = HTTPBearer()
 
+class PrincipalCache:
+    """Users authenticated from a token, keyed by the token's SHA-256 digest
+    
+    A network blip reconnects thousands of sockets at once, each with a
+    token that was just checked. Cached entries skip the JWT decode, the
+    users lookup and the User construction. Concurrent misses for the same
+    token share one lookup. An entry lives for at most AUTH_CACHE_SECONDS
+    and never past its token's expiry. Only users that authenticated are
+    cached. Entries of a user are dropped when an admin changes their
+    status.
+    """
+    
+    def __init__(self, ttl: float = AUTH_CACHE_SECONDS, max_size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # token digest -> (user, expires at)
+        self.entries: Dict[str, Tuple[User, float]] = {}
+        # user id -> digests of their cached tokens
+        self.user_tokens: Dict[str, Set[str]] = {}
+        # Lookups in progress, shared by concurrent connects with the same token
+        self._loading: Dict[str, asyncio.Task] = {}
+        # user id -> times the user was invalidated, to spot lookups that raced one
+        self.generations: Dict[str, int] = {}
+        
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.invalidations = 0
+    
+    async def authenticate(self, token: str) -> Optional[User]:
+        """The active user a token belongs to, or None"""
+        digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        cached = self.entries.get(digest)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                self.hits += 1
+                return cached[0]
+            self._drop(digest)
+        
+        loading = self._loading.get(digest)
+        if loading is not None:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+        
+        self.misses += 1
+        loading = asyncio.create_task(self._load(digest, token))
+        self._loading[digest] = loading
+        try:
+            return await asyncio.shield(loading)
+        finally:
+            self._loading.pop(digest, None)
+    
+    async def _load(self, digest: str, token: str) -> Optional[User]:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id = payload.get("sub")
+            generation = self.generations.get(user_id, 0)
+            user_data = await users_collection.find_one({"_id": user_id}) if user_id else None
+            user = User(**user_data) if user_data else None
+        except Exception:
+            user = None
+        if user is None or not user.is_active:
+            self.rejected += 1
+            return None
+        
+        if self.generations.get(user.id, 0) != generation:
+            # Status changed while the lookup ran, so the user read may be stale:
+            # read it again instead of caching it
+            return await self._load(digest, token)
+        
+        ttl = self.ttl
+        if payload.get("exp"):
+            ttl = min(ttl, payload["exp"] - time.time())
+        if ttl > 0:
+            if len(self.entries) >= self.max_size:
+                self._evict()
+            self.entries[digest] = (user, time.monotonic() + ttl)
+            self.user_tokens.setdefault(user.id, set()).add(digest)
+        return user
+    
+    def _drop(self, digest: str):
+        entry = self.entries.pop(digest, None)
+        if entry is None:
+            return
+        tokens = self.user_tokens.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(digest)
+            if not tokens:
+                del self.user_tokens[entry[0].id]
+    
+    def _evict(self):
+        now = time.monotonic()
+        for digest in [digest for digest, entry in self.entries.items() if entry[1] <= now]:
+            self._drop(digest)
+        if len(self.entries) >= self.max_size:
+            self.entries.clear()
+            self.user_tokens.clear()
+    
+    def invalidate_user(self, user_id: str):
+        """Forget every cached token of a user, e.g. after they are deactivated"""
+        for digest in self.user_tokens.pop(user_id, ()):
+            self.entries.pop(digest, None)
+        self.generations[user_id] = self.generations.get(user_id, 0) + 1
+        self.invalidations += 1
+    
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0
+        }
+
+# Global principal cache instance
+principal_cache = PrincipalCache()
+
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
     return pwd_context.hash(password)
@@ -110,17 +240,4 @@ async def get_current_admin(current_user: User = Depends(get_current_user)):
 
 async def get_current_user_websocket(token: str):
     """Get current authenticated user for WebSocket connections"""
-    try:
-        user_id = verify_token(token)
-        
-        user_data = await users_collection.find_one({"_id": user_id})
-        if user_data is None:
-            return None
-        
-        user = User(**user_data)
-        if not user.is_active:
-            return None
-        
-        return user
-    except:
-        return None
\ No newline at end of file
+    return await principal_cache.authenticate(token)
\ No newline at end of file
@@ -0,0 +1,118 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+from collections import deque
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Messages waiting for one room before new ones are refused
+ROOM_INBOX_SIZE = int(os.getenv("CHAT_ROOM_INBOX_SIZE", 1000))
+# How long shutdown waits for rooms to finish what is already queued
+ROOM_DRAIN_SECONDS = float(os.getenv("CHAT_ROOM_DRAIN_SECONDS", 5))
+
+
+class RoomActor:
+    """Inbox of one room and the task working through it"""
+    
+    __slots__ = ("room_id", "inbox", "task")
+    
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.inbox: Deque[Tuple[Callable[..., Awaitable[Any]], tuple, float]] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class RoomActors:
+    """Per-room actors that handle inbound chat messages in arrival order
+
+    A receive loop only parses and validates a frame, then submits its
+    handler to the room's actor and goes back to reading. Each actor runs
+    its room's handlers one at a time, so the room's messages are
+    moderated, persisted and broadcast in the order they arrived, while a
+    slow broadcast or tip no longer holds up the sender's next frame. Like
+    connection writers, an actor's task only exists while its inbox has
+    work, so idle rooms cost nothing.
+    """
+    
+    def __init__(self, inbox_size: int = ROOM_INBOX_SIZE, drain_seconds: float = ROOM_DRAIN_SECONDS):
+        self.inbox_size = inbox_size
+        self.drain_seconds = drain_seconds
+        self.actors: Dict[str, RoomActor] = {}
+        
+        # Metrics
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.max_inbox_depth = 0
+        self.max_wait_ms = 0.0
+        self.total_wait_ms = 0.0
+    
+    def submit(self, room_id: str, handler: Callable[..., Awaitable[Any]], *args) -> bool:
+        """Queue handler(*args) on a room's actor, returning False if the room is too far behind"""
+        actor = self.actors.get(room_id)
+        if actor is None:
+            actor = self.actors[room_id] = RoomActor(room_id)
+        if len(actor.inbox) >= self.inbox_size:
+            self.rejected += 1
+            return False
+        
+        actor.inbox.append((handler, args, time.monotonic()))
+        self.submitted += 1
+        self.max_inbox_depth = max(self.max_inbox_depth, len(actor.inbox))
+        if actor.task is None:
+            actor.task = asyncio.create_task(self._run(actor))
+        return True
+    
+    async def _run(self, actor: RoomActor):
+        try:
+            while actor.inbox:
+                handler, args, queued_at = actor.inbox.popleft()
+                wait_ms = (time.monotonic() - queued_at) * 1000
+                self.total_wait_ms += wait_ms
+                self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+                try:
+                    await handler(*args)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error in room {actor.room_id} handler {handler.__name__}: {e}")
+                self.processed += 1
+        finally:
+            actor.task = None
+            # Inbox drained; the next submit starts a fresh actor
+            if not actor.inbox and self.actors.get(actor.room_id) is actor:
+                del self.actors[actor.room_id]
+    
+    async def stop(self):
+        """Let every room finish its queued messages, up to the drain timeout"""
+        tasks = [actor.task for actor in self.actors.values() if actor.task is not None]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=self.drain_seconds)
+        for task in pending:
+            task.cancel()
+        if pending:
+            left = sum(len(actor.inbox) for actor in self.actors.values())
+            logger.error(f"Discarding {left} queued chat messages in {len(pending)} rooms on shutdown")
+    
+    def get_stats(self) -> dict:
+        depths = [len(actor.inbox) for actor in self.actors.values()]
+        return {
+            "active_rooms": len(depths),
+            "queued": sum(depths),
+            "inbox_depth_max": max(depths, default=0),
+            "inbox_depth_peak": self.max_inbox_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait_ms / self.processed, 2) if self.processed else 0,
+            "max_wait_ms": round(self.max_wait_ms, 2)
+        }
+
+
+# Global room actors instance
+room_actors = RoomActors()
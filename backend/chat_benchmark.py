@@ -0,0 +1,865 @@
+#!/usr/bin/env python3
+"""
+Chat benchmarks
+
+fanout: measures how long it takes a broadcast to reach every connection in
+a room using in-memory fake sockets, so no server or database is needed.
+
+persistence: compares one insert_one per chat message with the batched
+write-behind writer against a local mongod (MONGO_URL), using a scratch
+database that is dropped afterwards.
+
+memory: registers many simulated connections and reports the memory each
+one costs and how long removing them all takes, for the connection registry
+and for the earlier list-and-dict layout.
+
+wire: encodes recorded chat traffic (a JSONL file of outbound events, or a
+synthetic session) as JSON and as MessagePack with and without the per-room
+intern table, reporting bytes and encode time per frame.
+
+batching: sends a busy room's mix of chat, typing and presence events to
+connections with and without micro-batching, and reports the send calls
+(one frame and one write syscall each) and the CPU time they took.
+
+downsampling: drives one busy room at a fixed message rate, with every
+message fanned out and with adaptive digests, and reports the frames
+delivered per message and how many tips and model messages still arrived.
+
+sharding: runs the same room traffic on 1 to N worker processes, either with
+rooms consistently hashed onto one shard each or with a shared bus where
+every worker sees every room event, and reports aggregate delivery
+throughput and speedup. End-to-end runs against real shards started with
+chat_sharding.py use ../chat_load_test.py --url instead.
+
+    python chat_benchmark.py
+    python chat_benchmark.py fanout --sizes 100 1000 10000 --broadcasts 20 --json
+    python chat_benchmark.py persistence --messages 20000 --concurrency 50
+    python chat_benchmark.py memory --connections 50000
+    python chat_benchmark.py wire --recording chat_traffic.jsonl
+    python chat_benchmark.py sharding --shards 1 2 4 8 --rooms 64 --members 200
+    python chat_benchmark.py downsampling --members 1000 --rate 500 --seconds 5
+    python chat_benchmark.py batching --sizes 100 1000 5000 --rate 500
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+from chat_codec import WireCodec, JSON, MSGPACK
+from chat_fanout import ConnectionWriter, fanout_engine, DROPPABLE_EVENT_TYPES
+from chat_persistence import ChatWriteBehind
+from chat_downsampling import ChatDownsampler
+from chat_sharding import HashRing
+from websocket_manager import ConnectionManager
+
+
+class DeliveryTracker:
+    """Signals once every socket in a room has received the current broadcast"""
+    
+    def __init__(self):
+        self.expected = 0
+        self.done = asyncio.Event()
+    
+    def reset(self, expected: int):
+        self.expected = expected
+        self.done.clear()
+    
+    def delivered(self):
+        self.expected -= 1
+        if self.expected <= 0:
+            self.done.set()
+
+
+class FakeWebSocket:
+    """Stands in for a client socket and records when each payload arrived"""
+    
+    def __init__(self, latency: float, tracker: DeliveryTracker):
+        self.latency = latency
+        self.tracker = tracker
+        self.received_at: List[float] = []
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, data: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+        self.received_at.append(time.perf_counter())
+        self.tracker.delivered()
+    
+    async def close(self, code: int = 1000, reason: str = None):
+        pass
+
+
+def make_sockets(count: int, slow_fraction: float, slow_latency: float, tracker: DeliveryTracker) -> List[FakeWebSocket]:
+    """Create a room's worth of sockets where a small share are slow mobile clients"""
+    rng = random.Random(count)
+    return [
+        FakeWebSocket(slow_latency if rng.random() < slow_fraction else 0, tracker)
+        for _ in range(count)
+    ]
+
+
+def populate(manager: ConnectionManager, room_id: str, sockets: List[FakeWebSocket], batch: bool = False):
+    """Register sockets directly so setup does not broadcast join events"""
+    for index, socket in enumerate(sockets):
+        manager.register(socket, room_id, {
+            "user_id": f"bench-user-{index}",
+            "username": f"bench{index}",
+            "role": "viewer"
+        }, batch=batch)
+
+
+async def teardown(manager: ConnectionManager):
+    """Stop every writer task without broadcasting leave events"""
+    for connection in manager.connections.values():
+        connection.writer.close()
+    await manager.stop()
+
+
+async def sequential_broadcast(sockets: List[FakeWebSocket], message: dict):
+    """Original behaviour: serialize per recipient and await each send in turn"""
+    for connection in sockets:
+        await connection.send_text(json.dumps(message))
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_room(size: int, broadcasts: int, slow_fraction: float, slow_latency: float, sequential: bool) -> Dict:
+    manager = ConnectionManager()
+    await manager.start()
+    room_id = f"bench-room-{size}"
+    tracker = DeliveryTracker()
+    sockets = make_sockets(size, slow_fraction, slow_latency, tracker)
+    if not sequential:
+        populate(manager, room_id, sockets)
+    
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for i in range(broadcasts):
+        message = {
+            "type": "chat_message",
+            "message": {
+                "id": f"bench-{i}",
+                "room_id": room_id,
+                "sender_id": "bench-sender",
+                "sender_username": "bench",
+                "sender_role": "viewer",
+                "message_type": "text",
+                "content": "Habari! " * 8,
+                "tip_amount": None,
+                "created_at": "2024-01-01T00:00:00"
+            }
+        }
+        for socket in sockets:
+            socket.received_at.clear()
+        tracker.reset(size)
+        
+        sent_at = time.perf_counter()
+        if sequential:
+            await sequential_broadcast(sockets, message)
+        else:
+            await manager.broadcast_to_room(room_id, message)
+        await tracker.done.wait()
+        
+        latencies.extend((arrived - sent_at) * 1000 for socket in sockets for arrived in socket.received_at)
+    
+    elapsed = time.perf_counter() - started
+    await teardown(manager)
+    return {
+        "room_size": size,
+        "mode": "sequential" if sequential else "fanout",
+        "broadcasts": broadcasts,
+        "deliveries": len(latencies),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "deliveries_per_sec": round(len(latencies) / elapsed, 1)
+    }
+
+
+def make_chat_document(room_id: str, index: int) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "room_id": room_id,
+        "sender_id": f"bench-user-{index % 500}",
+        "sender_username": f"bench{index % 500}",
+        "sender_role": "viewer",
+        "message_type": "text",
+        "content": "Habari! " * 8,
+        "tip_amount": None,
+        "is_deleted": False,
+        "deleted_by": None,
+        "deleted_at": None,
+        "created_at": datetime.utcnow()
+    }
+
+
+async def run_persistence(messages: int, concurrency: int, batch_size: int, flush_interval: float) -> List[Dict]:
+    """Time single inserts against the write-behind writer on a scratch database"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    database = client[f"{os.environ.get('DB_NAME', 'quantumstrip')}_bench"]
+    results = []
+    
+    try:
+        # One insert_one per message, as handle_chat_message used to do
+        await database.bench_chat_messages.drop()
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(messages):
+            queue.put_nowait(make_chat_document("bench-room", index))
+        latencies: List[float] = []
+        
+        async def insert_worker():
+            while not queue.empty():
+                document = queue.get_nowait()
+                started = time.perf_counter()
+                await database.bench_chat_messages.insert_one(document)
+                latencies.append((time.perf_counter() - started) * 1000)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(insert_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        results.append({
+            "mode": "insert_one",
+            "messages": messages,
+            "seconds": round(elapsed, 3),
+            "messages_per_sec": round(messages / elapsed, 1),
+            "p50_handler_ms": round(percentile(latencies, 50), 3),
+            "p99_handler_ms": round(percentile(latencies, 99), 3),
+            "round_trips": messages
+        })
+        
+        # Write-behind: the handler only enqueues, batches are flushed in the background
+        await database.bench_chat_messages.drop()
+        writer = ChatWriteBehind(
+            collection_name="bench_chat_messages",
+            database=database,
+            batch_size=batch_size,
+            flush_interval=flush_interval
+        )
+        await writer.start()
+        latencies = []
+        started = time.perf_counter()
+        for index in range(messages):
+            enqueue_started = time.perf_counter()
+            writer.enqueue(make_chat_document("bench-room", index))
+            latencies.append((time.perf_counter() - enqueue_started) * 1000)
+            if index % batch_size == 0:
+                # Let the flush loop run the way it would between requests
+                await asyncio.sleep(0)
+        await writer.stop()
+        elapsed = time.perf_counter() - started
+        stats = writer.get_stats()
+        results.append({
+            "mode": "write_behind",
+            "messages": messages,
+            "seconds": round(elapsed, 3),
+            "messages_per_sec": round(messages / elapsed, 1),
+            "p50_handler_ms": round(percentile(latencies, 50), 3),
+            "p99_handler_ms": round(percentile(latencies, 99), 3),
+            "round_trips": stats["flushes"],
+            "avg_batch_size": stats["avg_batch_size"],
+            "avg_flush_ms": stats["avg_flush_ms"],
+            "max_flush_ms": stats["max_flush_ms"],
+            "written": stats["written"],
+            "dropped": stats["dropped"],
+            "retried": stats["retried"]
+        })
+    finally:
+        await client.drop_database(database.name)
+        client.close()
+    
+    return results
+
+
+class LegacyRegistry:
+    """The registry layout ConnectionManager used before connection records:
+    a list of sockets per room, a dict of user details per socket, a single
+    socket per user, and a writer task per connection parked on an event"""
+    
+    def __init__(self):
+        self.room_connections: Dict[str, List[FakeWebSocket]] = {}
+        self.connection_users: Dict[FakeWebSocket, dict] = {}
+        self.user_connections: Dict[str, FakeWebSocket] = {}
+        self.connection_writers: Dict[FakeWebSocket, ConnectionWriter] = {}
+        self.writer_tasks: Dict[FakeWebSocket, asyncio.Task] = {}
+    
+    def register(self, websocket: FakeWebSocket, room_id: str, user_info: dict):
+        self.room_connections.setdefault(room_id, []).append(websocket)
+        self.connection_users[websocket] = {
+            "connection_id": uuid.uuid4().hex,
+            "user_id": user_info["user_id"],
+            "username": user_info["username"],
+            "role": user_info["role"],
+            "room_id": room_id
+        }
+        self.user_connections[user_info["user_id"]] = websocket
+        self.connection_writers[websocket] = ConnectionWriter(websocket, fanout_engine, lambda _: None)
+        self.writer_tasks[websocket] = asyncio.create_task(asyncio.Event().wait())
+    
+    def _unregister(self, websocket: FakeWebSocket):
+        user_info = self.connection_users.pop(websocket)
+        room = self.room_connections[user_info["room_id"]]
+        room.remove(websocket)
+        if not room:
+            del self.room_connections[user_info["room_id"]]
+        if self.user_connections.get(user_info["user_id"]) is websocket:
+            del self.user_connections[user_info["user_id"]]
+        self.connection_writers.pop(websocket).close()
+        self.writer_tasks.pop(websocket).cancel()
+
+
+async def run_memory(connections: int, rooms: int) -> List[Dict]:
+    """Measure memory per connection and bulk removal time for both registry layouts"""
+    results = []
+    for layout in ("legacy", "registry"):
+        manager = ConnectionManager() if layout == "registry" else LegacyRegistry()
+        tracker = DeliveryTracker()
+        # Sockets belong to the server framework, so they are created before measuring
+        sockets = [FakeWebSocket(0, tracker) for _ in range(connections)]
+        
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        for index, socket in enumerate(sockets):
+            manager.register(socket, f"bench-room-{index % rooms}", {
+                "user_id": f"bench-user-{index}",
+                "username": f"bench{index}",
+                "role": "viewer"
+            })
+        # Let every writer task start and park on its wakeup event
+        await asyncio.sleep(0)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        removal_order = list(sockets)
+        random.Random(connections).shuffle(removal_order)
+        started = time.perf_counter()
+        for socket in removal_order:
+            manager._unregister(socket)
+        removal_seconds = time.perf_counter() - started
+        await asyncio.sleep(0)
+        
+        results.append({
+            "layout": layout,
+            "connections": connections,
+            "rooms": rooms,
+            "total_mb": round((current - baseline) / 1024 / 1024, 2),
+            "bytes_per_connection": round((current - baseline) / connections),
+            "removal_seconds": round(removal_seconds, 3)
+        })
+    return results
+
+
+def synthetic_traffic(events: int, room_id: str = "bench-room") -> List[dict]:
+    """A chat session shaped like a busy room: mostly text, some tips, presence and typing"""
+    rng = random.Random(events)
+    users = [(str(uuid.uuid4()), f"viewer{index}") for index in range(300)]
+    traffic = []
+    for index in range(events):
+        user_id, username = rng.choice(users)
+        roll = rng.random()
+        if roll < 0.75:
+            tip_amount = rng.choice([10, 20, 50, 100]) if roll < 0.05 else None
+            traffic.append({
+                "type": "chat_message",
+                "message": {
+                    "id": str(uuid.uuid4()),
+                    "room_id": room_id,
+                    "sender_id": user_id,
+                    "sender_username": username,
+                    "sender_role": "viewer",
+                    "message_type": "tip" if tip_amount else "text",
+                    "content": rng.choice(["Habari!", "Uko poa sana", "🔥🔥🔥", "Sasa, niaje?", "Asante sana"]),
+                    "tip_amount": tip_amount,
+                    "created_at": datetime.utcnow().isoformat()
+                }
+            })
+        elif roll < 0.9:
+            typers = rng.sample(users, 3)
+            traffic.append({
+                "type": "typing",
+                "room_id": room_id,
+                "count": rng.randint(3, 12),
+                "users": [{"user_id": typer_id, "username": typer_name} for typer_id, typer_name in typers]
+            })
+        else:
+            joined = rng.sample(users, rng.randint(0, 3))
+            traffic.append({
+                "type": "presence_delta",
+                "room_id": room_id,
+                "count": rng.randint(100, 200),
+                "joined": [{"user_id": joined_id, "username": joined_name, "role": "viewer"} for joined_id, joined_name in joined],
+                "left": [left_id for left_id, _ in rng.sample(users, rng.randint(0, 3))]
+            })
+    return traffic
+
+
+def run_wire(traffic: List[dict], repeat: int) -> List[Dict]:
+    """Bytes and encode time per frame for each wire format"""
+    results = []
+    for mode, wire_format, intern in (("json", JSON, False), ("msgpack", MSGPACK, False), ("msgpack+intern", MSGPACK, True)):
+        codec = WireCodec()
+        total_bytes = 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            codec.rooms.clear()
+            total_bytes = 0
+            for event in traffic:
+                room_id = None
+                if intern and event.get("type") not in DROPPABLE_EVENT_TYPES:
+                    # Same rule as ConnectionManager: droppable events never use the intern table
+                    room_id = event.get("room_id") or event.get("message", {}).get("room_id")
+                total_bytes += len(codec.encode(event, wire_format, room_id))
+        elapsed = time.perf_counter() - started
+        results.append({
+            "format": mode,
+            "frames": len(traffic),
+            "total_kb": round(total_bytes / 1024, 1),
+            "bytes_per_frame": round(total_bytes / len(traffic), 1),
+            "encode_us_per_frame": round(elapsed / (len(traffic) * repeat) * 1_000_000, 2)
+        })
+    return results
+
+
+async def run_shard_worker(mode: str, shard: int, shards: int, rooms: int, members: int, messages: int, ready, start) -> Dict:
+    """One worker process: register its connections, then deliver its share of the traffic"""
+    manager = ConnectionManager()
+    await manager.start()
+    tracker = DeliveryTracker()
+    room_ids = [f"bench-room-{index}" for index in range(rooms)]
+    ring = HashRing([f"shard-{index}" for index in range(shards)])
+    
+    if mode == "sharded":
+        # Whole rooms, and only the rooms this shard owns
+        handled = [room_id for room_id in room_ids if ring.node_for(room_id) == f"shard-{shard}"]
+        local_members = {room_id: members for room_id in handled}
+    else:
+        # Every room's events, delivered to this worker's slice of each room
+        handled = room_ids
+        local_members = {
+            room_id: members // shards + (1 if shard < members % shards else 0) for room_id in room_ids
+        }
+    
+    for room_id, count in local_members.items():
+        sockets = [FakeWebSocket(0, tracker) for _ in range(count)]
+        for index, socket in enumerate(sockets):
+            manager.register(socket, room_id, {
+                "user_id": f"bench-user-{room_id}-{index}",
+                "username": f"bench{index}",
+                "role": "viewer"
+            })
+    expected = sum(local_members.values()) * messages
+    tracker.reset(expected)
+    
+    ready.put(shard)
+    await asyncio.to_thread(start.wait)
+    started = time.perf_counter()
+    for index in range(messages):
+        for room_id in handled:
+            await manager.broadcast_to_room(room_id, {
+                "type": "chat_message",
+                "message": {
+                    "id": f"bench-{index}",
+                    "room_id": room_id,
+                    "sender_id": "bench-sender",
+                    "sender_username": "bench",
+                    "content": "Habari! " * 8
+                }
+            })
+        # Let writers drain between rounds like a live room would
+        await asyncio.sleep(0)
+    if expected:
+        await tracker.done.wait()
+    elapsed = time.perf_counter() - started
+    
+    await teardown(manager)
+    return {
+        "rooms": len(local_members) if mode == "sharded" else rooms,
+        "events": len(handled) * messages,
+        "deliveries": expected,
+        "seconds": elapsed
+    }
+
+
+class CountingWebSocket:
+    """Client socket that counts frames, and those carrying a tip or a model's message"""
+    
+    def __init__(self):
+        self.frames = 0
+        self.priority_frames = 0
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, data: str):
+        self.frames += 1
+        if '"message_type": "tip"' in data or '"sender_role": "model"' in data:
+            self.priority_frames += 1
+    
+    async def close(self, code: int = 1000, reason: str = None):
+        pass
+
+
+async def run_busy_room(adaptive: bool, members: int, rate: int, seconds: float) -> Dict:
+    manager = ConnectionManager()
+    await manager.start()
+    sampler = None
+    if adaptive:
+        sampler = ChatDownsampler(manager=manager)
+        await sampler.start()
+    
+    room_id = "bench-busy-room"
+    sockets = [CountingWebSocket() for _ in range(members)]
+    populate(manager, room_id, sockets)
+    
+    rng = random.Random(members)
+    tick = 0.1
+    sent = 0
+    priority = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        tick_started = time.perf_counter()
+        for _ in range(max(1, int(rate * tick))):
+            roll = rng.random()
+            is_tip = roll < 0.03
+            is_model = 0.03 <= roll < 0.05
+            priority += is_tip or is_model
+            await manager.broadcast_to_room(room_id, {
+                "type": "chat_message",
+                "message": {
+                    "id": f"bench-{sent}",
+                    "room_id": room_id,
+                    "sender_id": "bench-model" if is_model else f"bench-user-{rng.randrange(members)}",
+                    "sender_username": "bench",
+                    "sender_role": "model" if is_model else "viewer",
+                    "message_type": "tip" if is_tip else "text",
+                    "content": "Habari! " * 8,
+                    "tip_amount": 10 if is_tip else None,
+                    "created_at": "2024-01-01T00:00:00"
+                }
+            })
+            sent += 1
+            # Let writers drain like a live room would
+            await asyncio.sleep(0)
+        await asyncio.sleep(max(0, tick - (time.perf_counter() - tick_started)))
+    
+    if sampler:
+        await sampler.stop()
+        await sampler.tick()
+    # Let the writers drain
+    await asyncio.sleep(0.5)
+    await teardown(manager)
+    
+    frames = sum(socket.frames for socket in sockets)
+    return {
+        "mode": "adaptive" if adaptive else "full",
+        "members": members,
+        "messages": sent,
+        "frames": frames,
+        "frames_per_message": round(frames / sent, 1),
+        "priority_frames": sum(socket.priority_frames for socket in sockets),
+        "priority_expected": priority * members,
+        "digests": sampler.digests_sent if sampler else 0
+    }
+
+
+def busy_room_event(room_id: str, index: int) -> dict:
+    """The index-th event of a busy room: mostly chat, with typing and presence updates"""
+    kind = index % 10
+    if kind < 6:
+        return {
+            "type": "chat_message",
+            "message": {
+                "id": f"bench-{index}",
+                "room_id": room_id,
+                "sender_id": f"bench-user-{index % 50}",
+                "sender_username": "bench",
+                "sender_role": "viewer",
+                "message_type": "text",
+                "content": "Habari! " * 8,
+                "tip_amount": None,
+                "created_at": "2024-01-01T00:00:00"
+            }
+        }
+    if kind < 9:
+        return {
+            "type": "typing",
+            "room_id": room_id,
+            "count": 3,
+            "users": [{"user_id": f"bench-user-{index % 7}", "username": "bench"}]
+        }
+    return {
+        "type": "presence_delta",
+        "room_id": room_id,
+        "count": 1000,
+        "joined": [{"user_id": f"bench-user-{index}", "username": "bench", "role": "viewer"}],
+        "left": []
+    }
+
+
+async def run_batching_room(size: int, events: int, rate: int, batch: bool) -> Dict:
+    manager = ConnectionManager()
+    await manager.start()
+    room_id = f"bench-room-{size}"
+    sockets = [CountingWebSocket() for _ in range(size)]
+    populate(manager, room_id, sockets, batch=batch)
+    writers = [connection.writer for connection in manager.connections.values()]
+    
+    tick = 0.01
+    per_tick = max(1, int(rate * tick))
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for first in range(0, events, per_tick):
+        tick_started = time.perf_counter()
+        for index in range(first, min(first + per_tick, events)):
+            await manager.send_to_local_room(room_id, busy_room_event(room_id, index))
+        await asyncio.sleep(max(0, tick - (time.perf_counter() - tick_started)))
+    # Wait for every writer to go idle
+    while any(writer.depth or writer._task is not None for writer in writers):
+        await asyncio.sleep(0.005)
+    cpu_seconds = time.process_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    
+    await teardown(manager)
+    frames = sum(socket.frames for socket in sockets)
+    deliveries = events * size
+    return {
+        "room_size": size,
+        "mode": "batched" if batch else "per-event",
+        "events": events,
+        "send_calls": frames,
+        "events_per_frame": round(deliveries / frames, 1) if frames else None,
+        "cpu_ms": round(cpu_seconds * 1000, 1),
+        "cpu_us_per_delivery": round(cpu_seconds * 1e6 / deliveries, 2),
+        "seconds": round(elapsed, 3)
+    }
+
+
+async def run_batching(sizes: List[int], events: int, rate: int) -> List[Dict]:
+    results = []
+    for size in sizes:
+        baseline = await run_batching_room(size, events, rate, batch=False)
+        batched = await run_batching_room(size, events, rate, batch=True)
+        batched["cpu_saved_pct"] = round(100 * (1 - batched["cpu_ms"] / baseline["cpu_ms"]), 1) if baseline["cpu_ms"] else None
+        results.extend([baseline, batched])
+    return results
+
+
+async def run_downsampling(members: int, rate: int, seconds: float) -> List[Dict]:
+    results = [
+        await run_busy_room(False, members, rate, seconds),
+        await run_busy_room(True, members, rate, seconds)
+    ]
+    for result in results:
+        result["reduction"] = round(results[0]["frames"] / result["frames"], 1) if result["frames"] else None
+    return results
+
+
+def shard_worker(mode: str, shard: int, shards: int, rooms: int, members: int, messages: int, ready, start, results):
+    results.put(asyncio.run(run_shard_worker(mode, shard, shards, rooms, members, messages, ready, start)))
+
+
+def run_sharding(shard_counts: List[int], rooms: int, members: int, messages: int, modes: List[str]) -> List[Dict]:
+    """Aggregate delivery throughput for each worker count, started together in separate processes"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in modes:
+        baseline = None
+        for shards in shard_counts:
+            ready, start, queue = context.Queue(), context.Event(), context.Queue()
+            processes = [
+                context.Process(
+                    target=shard_worker,
+                    args=(mode, shard, shards, rooms, members, messages, ready, start, queue)
+                )
+                for shard in range(shards)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                ready.get()
+            start.set()
+            workers = [queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+            
+            # Workers start together, so the run lasts as long as the slowest one
+            seconds = max(worker["seconds"] for worker in workers)
+            deliveries = sum(worker["deliveries"] for worker in workers)
+            throughput = deliveries / seconds if seconds else 0
+            baseline = baseline or throughput
+            results.append({
+                "mode": mode,
+                "shards": shards,
+                "rooms_per_shard_min": min(worker["rooms"] for worker in workers),
+                "rooms_per_shard_max": max(worker["rooms"] for worker in workers),
+                "events_processed": sum(worker["events"] for worker in workers),
+                "deliveries": deliveries,
+                "seconds": round(seconds, 3),
+                "deliveries_per_sec": round(throughput, 1),
+                "speedup": round(throughput / baseline, 2) if baseline else None
+            })
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat delivery and storage paths")
+    parser.add_argument("scenario", nargs="?", choices=["fanout", "persistence", "memory", "wire", "sharding", "downsampling", "batching"], default="fanout")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Room sizes to test")
+    parser.add_argument("--broadcasts", type=int, default=10, help="Broadcasts per room size")
+    parser.add_argument("--slow-fraction", type=float, default=0.005, help="Share of slow clients in each room")
+    parser.add_argument("--slow-latency", type=float, default=0.05, help="Send latency of slow clients in seconds")
+    parser.add_argument("--send-timeout", type=float, default=fanout_engine.send_timeout, help="Per-send timeout in seconds")
+    parser.add_argument("--compare", action="store_true", help="Also run the old sequential broadcast loop")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages to store in the persistence scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent insert_one handlers")
+    parser.add_argument("--batch-size", type=int, default=500, help="Write-behind batch size")
+    parser.add_argument("--flush-interval", type=float, default=0.25, help="Write-behind flush interval in seconds")
+    parser.add_argument("--connections", type=int, default=50000, help="Simulated connections in the memory scenario")
+    parser.add_argument("--rooms", type=int, default=None, help="Rooms to spread connections over (1 for memory, 64 for sharding)")
+    parser.add_argument("--recording", help="JSONL file of recorded outbound chat events for the wire scenario")
+    parser.add_argument("--events", type=int, default=20000, help="Synthetic events when no recording is given")
+    parser.add_argument("--repeat", type=int, default=5, help="Encoding passes over the traffic")
+    parser.add_argument("--shards", type=int, nargs="+", default=None, help="Worker process counts for the sharding scenario")
+    parser.add_argument("--members", type=int, default=200, help="Connections per room in the sharding scenario")
+    parser.add_argument("--room-messages", type=int, default=20, help="Messages per room in the sharding scenario")
+    parser.add_argument("--modes", nargs="+", choices=["sharded", "shared"], default=["sharded", "shared"])
+    parser.add_argument("--rate", type=int, default=500, help="Events per second in the downsampling and batching scenarios")
+    parser.add_argument("--batch-events", type=int, default=500, help="Events sent to each room in the batching scenario")
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of the downsampling scenario")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    
+    if args.scenario == "batching":
+        results = await run_batching(args.sizes, args.batch_events, args.rate)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'room':>8} {'mode':>10} {'send calls':>11} {'events/frame':>13} {'cpu ms':>9} {'cpu us/delivery':>16} {'cpu saved':>10}")
+        for result in results:
+            print(
+                f"{result['room_size']:>8} {result['mode']:>10} {result['send_calls']:>11} {result['events_per_frame']:>13} "
+                f"{result['cpu_ms']:>9} {result['cpu_us_per_delivery']:>16} {str(result.get('cpu_saved_pct', '')):>10}"
+            )
+        return
+    
+    if args.scenario == "downsampling":
+        results = await run_downsampling(args.members, args.rate, args.seconds)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'mode':>9} {'messages':>9} {'frames':>10} {'frames/msg':>11} {'tips+model':>16} {'digests':>8} {'reduction':>10}")
+        for result in results:
+            print(
+                f"{result['mode']:>9} {result['messages']:>9} {result['frames']:>10} {result['frames_per_message']:>11} "
+                f"{str(result['priority_frames']) + '/' + str(result['priority_expected']):>16} "
+                f"{result['digests']:>8} {result['reduction']:>10}"
+            )
+        return
+    
+    if args.scenario == "sharding":
+        cores = os.cpu_count() or 1
+        shard_counts = args.shards or sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+        results = run_sharding(shard_counts, args.rooms or 64, args.members, args.room_messages, args.modes)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'mode':>8} {'shards':>7} {'rooms/shard':>12} {'events':>8} {'deliveries/s':>13} {'speedup':>8}")
+        for result in results:
+            print(
+                f"{result['mode']:>8} {result['shards']:>7} "
+                f"{str(result['rooms_per_shard_min']) + '-' + str(result['rooms_per_shard_max']):>12} "
+                f"{result['events_processed']:>8} {result['deliveries_per_sec']:>13} {result['speedup']:>8}"
+            )
+        return
+    
+    if args.scenario == "wire":
+        if args.recording:
+            with open(args.recording) as recording:
+                traffic = [json.loads(line) for line in recording if line.strip()]
+        else:
+            traffic = synthetic_traffic(args.events)
+        results = run_wire(traffic, args.repeat)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'format':>15} {'frames':>8} {'total KB':>10} {'bytes/frame':>12} {'encode us':>10}")
+        for result in results:
+            print(
+                f"{result['format']:>15} {result['frames']:>8} {result['total_kb']:>10} "
+                f"{result['bytes_per_frame']:>12} {result['encode_us_per_frame']:>10}"
+            )
+        return
+    
+    if args.scenario == "memory":
+        results = await run_memory(args.connections, args.rooms or 1)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'layout':>9} {'connections':>12} {'total MB':>10} {'bytes/conn':>11} {'remove all s':>13}")
+        for result in results:
+            print(
+                f"{result['layout']:>9} {result['connections']:>12} {result['total_mb']:>10} "
+                f"{result['bytes_per_connection']:>11} {result['removal_seconds']:>13}"
+            )
+        return
+    
+    if args.scenario == "persistence":
+        results = await run_persistence(args.messages, args.concurrency, args.batch_size, args.flush_interval)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        
+        print(f"{'mode':>13} {'msgs/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'round trips':>12}")
+        for result in results:
+            print(
+                f"{result['mode']:>13} {result['messages_per_sec']:>10} {result['p50_handler_ms']:>9} "
+                f"{result['p99_handler_ms']:>9} {result['round_trips']:>12}"
+            )
+        return
+    
+    fanout_engine.send_timeout = args.send_timeout
+    
+    results = []
+    for size in args.sizes:
+        results.append(await run_room(size, args.broadcasts, args.slow_fraction, args.slow_latency, sequential=False))
+        if args.compare:
+            results.append(await run_room(size, args.broadcasts, args.slow_fraction, args.slow_latency, sequential=True))
+    
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    
+    print(f"{'room':>8} {'mode':>11} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10} {'deliveries/s':>14}")
+    for result in results:
+        print(
+            f"{result['room_size']:>8} {result['mode']:>11} {result['p50_ms']:>10} "
+            f"{result['p99_ms']:>10} {result['max_ms']:>10} {result['deliveries_per_sec']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,365 @@
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+CHAT_BUS_BACKEND = os.getenv("CHAT_BUS_BACKEND", "local")
+CHAT_BUS_SOCKET = os.getenv("CHAT_BUS_SOCKET", "/tmp/quantumstrip-chat-bus.sock")
+CHAT_BUS_RECONNECT_SECONDS = float(os.getenv("CHAT_BUS_RECONNECT_SECONDS", 1))
+
+# Frames are a 4-byte big-endian length and a flags byte, followed by a JSON document
+FRAME_HEADER = struct.Struct(">IB")
+# Flag set on room events, so the broker finds the ones to number without decoding every frame
+FRAME_ROOM_EVENT = 0x01
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Broker drops a subscriber whose unsent buffer grows past this
+MAX_SUBSCRIBER_BUFFER = 64 * 1024 * 1024
+
+# Event kinds scoped to one room; with room sharding they never leave the owning shard
+SHARD_LOCAL_KINDS = frozenset({"room", "typing"})
+
+EventHandler = Callable[[dict], Awaitable[None]]
+ConnectedHandler = Callable[[], Awaitable[None]]
+
+
+def encode_frame(event: dict) -> bytes:
+    body = json.dumps(event).encode("utf-8")
+    flags = FRAME_ROOM_EVENT if event.get("kind") == "room" else 0
+    return FRAME_HEADER.pack(len(body), flags) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Read one frame, returning its flags and body"""
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, flags = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Bus frame too large: {length} bytes")
+    return flags, await reader.readexactly(length)
+
+
+class RoomSequencer:
+    """Stamps room events with a per-room sequence number
+
+    Numbers only mean something together with the epoch, which changes
+    whenever the sequencer is replaced (a new broker after failover).
+    """
+    
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.sequences: Dict[str, int] = {}
+    
+    def stamp(self, event: dict) -> bool:
+        """Number a room event in place, returning False for other kinds"""
+        if event.get("kind") != "room":
+            return False
+        seq = self.sequences.get(event["room_id"], 0) + 1
+        self.sequences[event["room_id"]] = seq
+        event["seq"] = seq
+        event["epoch"] = self.epoch
+        return True
+
+
+class RoomEventBus:
+    """Publish/subscribe channel that carries room events between chat workers
+
+    Every published event is handed to the subscriber on every worker,
+    including the one that published it, so all workers see the same order.
+    Room events arrive stamped with a per-room sequence number and epoch.
+    """
+    
+    def __init__(self):
+        self.handler: Optional[EventHandler] = None
+        self.on_connected: Optional[ConnectedHandler] = None
+        self.published = 0
+        self.received = 0
+    
+    @property
+    def connected(self) -> bool:
+        return True
+    
+    async def start(self, worker_id: str, handler: EventHandler, on_connected: Optional[ConnectedHandler] = None):
+        self.handler = handler
+        self.on_connected = on_connected
+    
+    async def stop(self):
+        pass
+    
+    async def publish(self, event: dict) -> bool:
+        """Publish an event, returning False if it could not reach the bus"""
+        raise NotImplementedError
+    
+    def get_stats(self) -> dict:
+        return {
+            "backend": type(self).__name__,
+            "connected": self.connected,
+            "published": self.published,
+            "received": self.received
+        }
+
+
+class InProcessBus(RoomEventBus):
+    """Single-process bus that hands events straight back to the local subscriber"""
+    
+    def __init__(self):
+        super().__init__()
+        self.sequencer = RoomSequencer()
+    
+    async def publish(self, event: dict) -> bool:
+        if self.handler is None:
+            return False
+        self.sequencer.stamp(event)
+        self.published += 1
+        self.received += 1
+        await self.handler(event)
+        return True
+
+
+class UnixSocketBroker:
+    """Relays bus frames between every worker connected to a Unix-domain socket
+
+    Room events are numbered here, so every worker sees the same sequence.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.subscribers: Dict[asyncio.StreamWriter, Optional[str]] = {}
+        self.sequencer = RoomSequencer()
+    
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left behind by a broker that died; we hold the lock so it is safe to remove
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_subscriber, path=self.path)
+        logger.info(f"Chat bus broker listening on {self.path}")
+    
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.subscribers):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+    
+    def _relay(self, frame: bytes):
+        for writer in list(self.subscribers):
+            if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                logger.warning(f"Dropping stalled chat bus subscriber {self.subscribers[writer]}")
+                writer.close()
+                continue
+            writer.write(frame)
+    
+    async def _handle_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.subscribers[writer] = None
+        try:
+            while True:
+                flags, frame = await read_frame(reader)
+                if self.subscribers[writer] is None:
+                    # First frame is the subscriber's hello with its worker id
+                    self.subscribers[writer] = json.loads(frame).get("worker_id")
+                    continue
+                if flags & FRAME_ROOM_EVENT:
+                    event = json.loads(frame)
+                    if self.sequencer.stamp(event):
+                        self._relay(encode_frame(event))
+                        continue
+                self._relay(FRAME_HEADER.pack(len(frame), flags) + frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Chat bus broker error: {e}")
+        finally:
+            worker_id = self.subscribers.pop(writer, None)
+            writer.close()
+            if worker_id and self.server:
+                self._relay(encode_frame({"kind": "peer_down", "origin": worker_id}))
+
+
+class UnixSocketBus(RoomEventBus):
+    """Bus shared by worker processes on one host through a Unix-domain socket broker
+
+    Whichever worker first takes the lock file next to the socket runs the
+    broker inside its own event loop; the others connect to it. If that
+    worker exits, the rest reconnect and one of them takes over.
+    """
+    
+    def __init__(self, path: str = CHAT_BUS_SOCKET, reconnect_seconds: float = CHAT_BUS_RECONNECT_SECONDS):
+        super().__init__()
+        self.path = path
+        self.reconnect_seconds = reconnect_seconds
+        self.worker_id: Optional[str] = None
+        self.broker: Optional[UnixSocketBroker] = None
+        self._lock_file = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self.reconnects = 0
+    
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+    
+    async def start(self, worker_id: str, handler: EventHandler, on_connected: Optional[ConnectedHandler] = None):
+        await super().start(worker_id, handler, on_connected)
+        self.worker_id = worker_id
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self.broker:
+            await self.broker.stop()
+            self.broker = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+    
+    async def publish(self, event: dict) -> bool:
+        if not self.connected:
+            return False
+        self._writer.write(encode_frame(event))
+        self.published += 1
+        return True
+    
+    def _try_become_broker(self) -> bool:
+        """Take the broker lock without blocking; only one process can hold it"""
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+    
+    async def _connect(self):
+        if self.broker is None and self._try_become_broker():
+            self.broker = UnixSocketBroker(self.path)
+            await self.broker.start()
+        
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        writer.write(encode_frame({"kind": "hello", "worker_id": self.worker_id}))
+        return reader, writer
+    
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await self._connect()
+                logger.info(f"Worker {self.worker_id} connected to chat bus at {self.path}")
+                if self.on_connected:
+                    await self.on_connected()
+                
+                while True:
+                    _, frame = await read_frame(reader)
+                    self.received += 1
+                    try:
+                        await self.handler(json.loads(frame))
+                    except Exception as e:
+                        logger.error(f"Error handling chat bus event: {e}")
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError) as e:
+                logger.warning(f"Chat bus connection lost: {e}")
+            except Exception as e:
+                logger.error(f"Chat bus error: {e}")
+            
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+            self.reconnects += 1
+            await asyncio.sleep(self.reconnect_seconds)
+    
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        stats.update({
+            "socket": self.path,
+            "is_broker": self.broker is not None,
+            "reconnects": self.reconnects
+        })
+        return stats
+
+
+class ShardedBus(RoomEventBus):
+    """Bus for a room-sharded deployment (see chat_sharding)
+
+    Every connection to a room lands on the shard that owns it, so room and
+    typing events are dispatched in-process and never reach other shards.
+    A room event published elsewhere, say by a REST request on the front
+    process, is forwarded to the owner over the shared Unix-socket bus.
+    Events for a user's devices, broadcasts to everyone and presence can
+    span shards, so they always go through the shared bus.
+    """
+    
+    def __init__(self, owns: Callable[[str], bool], path: str = CHAT_BUS_SOCKET):
+        super().__init__()
+        self.owns = owns
+        self.local = InProcessBus()
+        self.shared = UnixSocketBus(path)
+        self.forwarded = 0
+    
+    @property
+    def connected(self) -> bool:
+        return self.shared.connected
+    
+    async def start(self, worker_id: str, handler: EventHandler, on_connected: Optional[ConnectedHandler] = None):
+        await super().start(worker_id, handler, on_connected)
+        await self.local.start(worker_id, handler)
+        await self.shared.start(worker_id, self._on_shared_event, on_connected)
+    
+    async def stop(self):
+        await self.shared.stop()
+        await self.local.stop()
+    
+    async def publish(self, event: dict) -> bool:
+        if event.get("kind") in SHARD_LOCAL_KINDS:
+            if self.owns(event["room_id"]):
+                return await self.local.publish(event)
+            self.forwarded += 1
+            return await self.shared.publish({"kind": "shard_forward", "room_id": event["room_id"], "event": event})
+        return await self.shared.publish(event)
+    
+    async def _on_shared_event(self, event: dict):
+        if event.get("kind") == "shard_forward":
+            if self.owns(event["room_id"]):
+                await self.local.publish(event["event"])
+            return
+        await self.handler(event)
+    
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        stats.update({
+            "published": self.local.published + self.shared.published,
+            "received": self.local.received + self.shared.received,
+            "forwarded": self.forwarded,
+            "local": self.local.get_stats(),
+            "shared": self.shared.get_stats()
+        })
+        return stats
+
+
+def create_bus(backend: str = CHAT_BUS_BACKEND) -> RoomEventBus:
+    """Build the bus backend selected by CHAT_BUS_BACKEND"""
+    if backend == "unix":
+        return UnixSocketBus()
+    if backend == "sharded":
+        from chat_sharding import shard_router
+        return ShardedBus(shard_router.owns)
+    if backend != "local":
+        logger.warning(f"Unknown chat bus backend '{backend}', using in-process bus")
+    return InProcessBus()
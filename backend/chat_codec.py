@@ -0,0 +1,299 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json
+import logging
+import os
+
+try:
+    import msgpack
+except ImportError:  # Optional; every client then stays on JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+CHAT_INTERN_TABLE_SIZE = int(os.getenv("CHAT_INTERN_TABLE_SIZE", 4096))
+
+# Wire formats
+JSON = "json"
+MSGPACK = "msgpack"
+# Server-Sent Events: the JSON event in a text/event-stream record
+EVENT_STREAM = "event_stream"
+
+# Subprotocol a client offers in Sec-WebSocket-Protocol to get MessagePack frames
+MSGPACK_SUBPROTOCOL = "quantumstrip.msgpack.v1"
+
+# Short keys used in MessagePack frames, in both directions
+FIELD_CODES = {
+    "type": "t",
+    "message": "m",
+    "messages": "ms",
+    "id": "i",
+    "room_id": "r",
+    "sender_id": "s",
+    "sender_username": "su",
+    "sender_role": "sr",
+    "recipient_id": "ri",
+    "message_type": "mt",
+    "message_id": "mi",
+    "content": "c",
+    "tip_amount": "ta",
+    "created_at": "ca",
+    "timestamp": "ts",
+    "user_id": "u",
+    "username": "un",
+    "role": "ro",
+    "users": "us",
+    "count": "n",
+    "joined": "j",
+    "left": "l",
+    "offset": "o",
+    "limit": "lm",
+    "complete": "cp",
+    "approximate": "ap",
+    "is_typing": "it",
+    "target_user_id": "tu",
+    "action_type": "at",
+    "moderator": "mo",
+    "reason": "rs",
+    "duration_minutes": "dm",
+    "expires_at": "ex",
+    "deleted_by": "db",
+    "code": "co",
+    "table": "tb",
+    "seq": "q",
+    "epoch": "ep",
+    "events": "ev",
+    "tokens": "tk",
+    "session": "se",
+    "day": "dy",
+    "all_time": "al",
+    "since": "sn",
+    "client_msg_id": "ci",
+    "status": "st",
+    "conversation_id": "cv",
+    "unread_count": "uc",
+    "transaction_id": "tx"
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+# Event types sent as small integers
+EVENT_TYPE_CODES = {
+    "chat_message": 1,
+    "history": 2,
+    "private_message": 3,
+    "online_users": 4,
+    "presence_delta": 5,
+    "room_users": 6,
+    "typing": 7,
+    "message_deleted": 8,
+    "moderation_action": 9,
+    "error": 10,
+    "intern": 11,
+    "get_users": 12,
+    "sync": 13,
+    "replay": 14,
+    "reset": 15,
+    "ping": 16,
+    "pong": 17,
+    "leaderboard": 18,
+    "chat_digest": 19,
+    "subscribe": 20,
+    "unsubscribe": 21,
+    "unsubscribed": 22,
+    "ack": 23
+}
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPE_CODES.items()}
+
+# Id fields replaced by an index into the room's intern table
+INTERNED_FIELDS = frozenset({"room_id", "sender_id", "user_id", "target_user_id"})
+# Key of the new intern table entries carried by a room frame
+DEFINITIONS_KEY = "_d"
+
+
+def negotiate_subprotocol(offered: List[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from those a client offered"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def wire_format_for(subprotocol: Optional[str]) -> str:
+    return MSGPACK if subprotocol == MSGPACK_SUBPROTOCOL else JSON
+
+
+def join_frames(payloads: List[Union[str, bytes]]) -> Union[str, bytes]:
+    """Combine already encoded frames into one array frame without decoding them"""
+    if isinstance(payloads[0], str):
+        return "[" + ",".join(payloads) + "]"
+    count = len(payloads)
+    if count < 16:
+        header = bytes((0x90 | count,))
+    elif count < 0x10000:
+        header = b"\xdc" + count.to_bytes(2, "big")
+    else:
+        header = b"\xdd" + count.to_bytes(4, "big")
+    return header + b"".join(payloads)
+
+
+def event_stream_record(message: dict, epoch: Optional[str] = None) -> str:
+    """A Server-Sent Events record for an event
+
+    Sequenced room events get an id of epoch:seq, which the browser sends
+    back as Last-Event-ID when it reconnects.
+    """
+    epoch = message.get("epoch") or epoch
+    if message.get("seq") is not None and epoch:
+        return f"id: {epoch}:{message['seq']}\ndata: {json.dumps(message)}\n\n"
+    return f"data: {json.dumps(message)}\n\n"
+
+
+def parse_event_id(event_id: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+    """(epoch, seq) from a Last-Event-ID, or (None, None) if there is none or it is malformed"""
+    epoch, _, seq = (event_id or "").rpartition(":")
+    if not epoch or not seq.isdigit():
+        return None, None
+    return epoch, int(seq)
+
+
+class InternTable:
+    """Ids seen in one room's frames, numbered in order of first use"""
+    
+    __slots__ = ("indexes", "values")
+    
+    def __init__(self):
+        self.indexes: Dict[str, int] = {}
+        self.values: List[str] = []
+    
+    def ref(self, value: str, definitions: list, limit: int) -> Union[int, str]:
+        index = self.indexes.get(value)
+        if index is not None:
+            return index
+        if len(self.values) >= limit:
+            # Table is full; later ids go out as plain strings
+            return value
+        index = len(self.values)
+        self.indexes[value] = index
+        self.values.append(value)
+        definitions.append(value)
+        return index
+
+
+class WireCodec:
+    """Encodes chat events as JSON text or compact MessagePack frames
+
+    JSON frames are the event dicts as they are. MessagePack frames use the
+    short keys in FIELD_CODES and integer event types. Frames fanned out to
+    a whole room also replace room and user ids with indexes into a per-room
+    intern table. A room frame that adds entries carries them under "_d"
+    as a list, numbered from the end of the table the client already has.
+    A client receives the full table in an "intern" frame when it joins,
+    before any room frame. The table is dropped when the room has no local
+    connections left, and stops growing at CHAT_INTERN_TABLE_SIZE entries.
+    """
+    
+    def __init__(self, intern_table_size: int = CHAT_INTERN_TABLE_SIZE):
+        self.intern_table_size = intern_table_size
+        self.rooms: Dict[str, InternTable] = {}
+        
+        # Metrics
+        self.frames: Dict[str, int] = {JSON: 0, MSGPACK: 0, EVENT_STREAM: 0}
+        self.bytes: Dict[str, int] = {JSON: 0, MSGPACK: 0, EVENT_STREAM: 0}
+    
+    @property
+    def msgpack_available(self) -> bool:
+        return msgpack is not None
+    
+    def encode(
+        self,
+        message: dict,
+        wire_format: str = JSON,
+        room_id: Optional[str] = None,
+        epoch: Optional[str] = None
+    ) -> Union[str, bytes]:
+        """Serialize an event; pass room_id only for frames every room member receives
+
+        epoch is that of the event's seq, for event stream record ids.
+        """
+        if wire_format == MSGPACK:
+            table = self.rooms.setdefault(room_id, InternTable()) if room_id else None
+            definitions: list = []
+            compact = self._compact(message, table, definitions)
+            if definitions:
+                compact[DEFINITIONS_KEY] = definitions
+            payload = msgpack.packb(compact, use_bin_type=True)
+        elif wire_format == EVENT_STREAM:
+            payload = event_stream_record(message, epoch)
+        else:
+            payload = json.dumps(message)
+        
+        self.frames[wire_format] += 1
+        self.bytes[wire_format] += len(payload)
+        return payload
+    
+    def _compact(self, value: Any, table: Optional[InternTable], definitions: list) -> Any:
+        if isinstance(value, dict):
+            compact = {}
+            for key, item in value.items():
+                if key == "type" and item in EVENT_TYPE_CODES:
+                    item = EVENT_TYPE_CODES[item]
+                elif table is not None and key in INTERNED_FIELDS and isinstance(item, str):
+                    item = table.ref(item, definitions, self.intern_table_size)
+                else:
+                    item = self._compact(item, table, definitions)
+                compact[FIELD_CODES.get(key, key)] = item
+            return compact
+        if isinstance(value, list):
+            return [self._compact(item, table, definitions) for item in value]
+        return value
+    
+    def _expand(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            expanded = {}
+            for key, item in value.items():
+                name = FIELD_NAMES.get(key, key)
+                if name == "type" and isinstance(item, int):
+                    item = EVENT_TYPE_NAMES.get(item, item)
+                else:
+                    item = self._expand(item)
+                expanded[name] = item
+            return expanded
+        if isinstance(value, list):
+            return [self._expand(item) for item in value]
+        return value
+    
+    def decode(self, data: Union[str, bytes]) -> dict:
+        """Parse a client frame: text is JSON, binary is MessagePack with short keys"""
+        if isinstance(data, bytes):
+            if msgpack is None:
+                raise ValueError("Binary frames are not supported")
+            try:
+                message = self._expand(msgpack.unpackb(data, raw=False))
+            except Exception as e:
+                raise ValueError(f"Invalid MessagePack frame: {e}")
+        else:
+            message = json.loads(data)
+        
+        if not isinstance(message, dict):
+            raise ValueError("Frame is not an object")
+        return message
+    
+    def intern_snapshot(self, room_id: str) -> bytes:
+        """Frame with a room's whole intern table, for a client joining it"""
+        table = self.rooms.setdefault(room_id, InternTable())
+        return self.encode({"type": "intern", "table": list(table.values)}, MSGPACK)
+    
+    def forget_room(self, room_id: str):
+        self.rooms.pop(room_id, None)
+    
+    def get_stats(self) -> dict:
+        return {
+            "msgpack_available": self.msgpack_available,
+            "frames": dict(self.frames),
+            "bytes": dict(self.bytes),
+            "intern_tables": len(self.rooms),
+            "interned_ids": sum(len(table.values) for table in self.rooms.values())
+        }
+
+
+# Global wire codec instance
+wire_codec = WireCodec()
@@ -0,0 +1,127 @@
+from typing import Dict, Optional
+from collections import OrderedDict
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# How long a client message id is remembered after it was first seen
+CLIENT_MSG_ID_SECONDS = float(os.getenv("CHAT_CLIENT_MSG_ID_SECONDS", 300))
+# Most recent ids remembered per user; older ones are forgotten first
+CLIENT_MSG_IDS_PER_USER = int(os.getenv("CHAT_CLIENT_MSG_IDS_PER_USER", 256))
+CLIENT_MSG_ID_MAX_LENGTH = 64
+
+# Outcome recorded while the first copy of a message is still being handled
+PENDING = {"status": "pending"}
+
+
+def valid_client_msg_id(value) -> bool:
+    return isinstance(value, str) and 0 < len(value) <= CLIENT_MSG_ID_MAX_LENGTH
+
+
+class ClientMessageIds:
+    """Recently seen client message ids per user, with the outcome of each
+
+    Clients on poor links resend a message when they do not see it acked.
+    The first copy claims its id and is handled as usual. Its outcome is
+    then recorded: accepted with the message id, or rejected with a reason.
+    A later copy with the same id is answered with that outcome, or with
+    pending while the first copy is still queued. It is never persisted,
+    broadcast or charged again.
+    """
+    
+    def __init__(self, ttl: float = CLIENT_MSG_ID_SECONDS, per_user: int = CLIENT_MSG_IDS_PER_USER):
+        self.ttl = ttl
+        self.per_user = per_user
+        # user_id -> client message id -> (outcome, expires at), oldest first
+        self.users: Dict[str, "OrderedDict[str, tuple]"] = {}
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.claimed = 0
+        self.duplicates = 0
+        self.duplicates_pending = 0
+    
+    async def start(self):
+        """Start the periodic sweep of expired ids"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def claim(self, user_id: str, client_msg_id: str) -> Optional[dict]:
+        """Claim an id for a new message, or get the outcome recorded for it if already seen"""
+        now = time.monotonic()
+        ids = self.users.get(user_id)
+        if ids is None:
+            ids = self.users[user_id] = OrderedDict()
+        
+        seen = ids.get(client_msg_id)
+        if seen is not None and seen[1] > now:
+            self.duplicates += 1
+            if seen[0] is PENDING:
+                self.duplicates_pending += 1
+            return seen[0]
+        
+        ids[client_msg_id] = (PENDING, now + self.ttl)
+        ids.move_to_end(client_msg_id)
+        if len(ids) > self.per_user:
+            ids.popitem(last=False)
+        self.claimed += 1
+        return None
+    
+    def complete(self, user_id: str, client_msg_id: str, outcome: dict):
+        """Record how the first copy of a message was handled"""
+        ids = self.users.get(user_id)
+        if ids is not None and client_msg_id in ids:
+            ids[client_msg_id] = (outcome, ids[client_msg_id][1])
+    
+    def release(self, user_id: str, client_msg_id: str):
+        """Forget a claimed id whose message was never handled, so a retry goes through"""
+        ids = self.users.get(user_id)
+        if ids is not None:
+            ids.pop(client_msg_id, None)
+    
+    def sweep(self):
+        """Drop expired ids and users with none left"""
+        now = time.monotonic()
+        for user_id in list(self.users):
+            ids = self.users[user_id]
+            while ids:
+                oldest = next(iter(ids.values()))
+                if oldest[1] > now:
+                    break
+                ids.popitem(last=False)
+            if not ids:
+                del self.users[user_id]
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping client message ids: {e}")
+    
+    def get_stats(self) -> dict:
+        return {
+            "users": len(self.users),
+            "ids": sum(len(ids) for ids in self.users.values()),
+            "claimed": self.claimed,
+            "duplicates": self.duplicates,
+            "duplicates_pending": self.duplicates_pending
+        }
+
+
+# Global client message id cache
+client_message_ids = ClientMessageIds()
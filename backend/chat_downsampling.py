@@ -0,0 +1,192 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import time
+
+from websocket_manager import ConnectionManager, chat_manager
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Chat messages per second above which a room switches to digests
+DOWNSAMPLE_RATE = float(os.getenv("CHAT_DOWNSAMPLE_RATE", 50))
+# Rate below which a downsampled room goes back to full delivery
+DOWNSAMPLE_EXIT_RATE = float(os.getenv("CHAT_DOWNSAMPLE_EXIT_RATE", DOWNSAMPLE_RATE / 2))
+DIGEST_INTERVAL_SECONDS = float(os.getenv("CHAT_DIGEST_INTERVAL_SECONDS", 1))
+# Held messages shown in each digest, picked uniformly from the interval
+DIGEST_SAMPLE_SIZE = int(os.getenv("CHAT_DIGEST_SAMPLE_SIZE", 10))
+
+
+def is_ordinary(message: dict) -> bool:
+    """Plain text from a viewer; tips and model or admin messages are never held back"""
+    return message.get("message_type") == "text" and message.get("sender_role") == "viewer"
+
+
+class RoomSample:
+    """Message rate of one room and the messages held back in the current interval"""
+    
+    __slots__ = ("count", "rate", "active", "held", "sample")
+    
+    def __init__(self):
+        self.count = 0
+        self.rate = 0.0
+        self.active = False
+        self.held = 0
+        # (arrival index, message) pairs, a uniform sample of the held messages
+        self.sample: List[Tuple[int, dict]] = []
+
+
+class ChatDownsampler:
+    """Adaptive delivery for rooms chatting faster than anyone can read
+
+    Each worker measures the chat message rate of the rooms it has
+    connections in. Once a room goes over DOWNSAMPLE_RATE, ordinary viewer
+    text messages are no longer fanned out one by one. The sender's own
+    devices still get theirs straight away. Everyone else gets one
+    chat_digest frame per interval, with how many messages were held and a
+    uniform sample of them. Tips and model or admin messages always go out
+    in full. Messages are persisted, kept in history and kept in the replay
+    window as usual. The room goes back to full delivery once its rate
+    drops below DOWNSAMPLE_EXIT_RATE.
+    """
+    
+    def __init__(
+        self,
+        rate: float = DOWNSAMPLE_RATE,
+        exit_rate: float = DOWNSAMPLE_EXIT_RATE,
+        interval: float = DIGEST_INTERVAL_SECONDS,
+        sample_size: int = DIGEST_SAMPLE_SIZE,
+        manager: ConnectionManager = chat_manager
+    ):
+        self.rate = rate
+        self.exit_rate = exit_rate
+        self.interval = interval
+        self.sample_size = sample_size
+        self.manager = manager
+        self.rooms: Dict[str, RoomSample] = {}
+        self._last_tick = time.monotonic()
+        self._random = random.Random()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.held = 0
+        self.digests_sent = 0
+        self.frames_avoided = 0
+        self.activations = 0
+        
+        manager.set_room_sampler(self)
+    
+    async def start(self):
+        """Start the periodic rate measurement and digest flush"""
+        self._last_tick = time.monotonic()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def hold(self, room_id: str, message: dict) -> bool:
+        """Count a room event and decide whether it waits for the room's next digest"""
+        if message.get("type") != "chat_message":
+            return False
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomSample()
+        room.count += 1
+        if not room.active and room.count > self.rate * self.interval:
+            # Over budget before the interval is even up; no need to wait for the tick
+            self._activate(room_id, room, room.count / self.interval)
+        if not room.active or not is_ordinary(message["message"]):
+            return False
+        
+        # Reservoir sampling keeps a uniform sample of however many are held
+        if len(room.sample) < self.sample_size:
+            room.sample.append((room.held, message["message"]))
+        else:
+            slot = self._random.randrange(room.held + 1)
+            if slot < self.sample_size:
+                room.sample[slot] = (room.held, message["message"])
+        room.held += 1
+        self.held += 1
+        self.frames_avoided += len(self.manager.room_connections.get(room_id, ()))
+        return True
+    
+    async def tick(self):
+        """Update room rates, switch modes and send the digests of held messages"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_tick, 1e-6)
+        self._last_tick = now
+        
+        for room_id in list(self.rooms):
+            room = self.rooms[room_id]
+            measured = room.count / elapsed
+            room.count = 0
+            # Smooth over two intervals so one burst does not flip the mode
+            room.rate = (room.rate + measured) / 2
+            
+            if room.held:
+                await self._send_digest(room_id, room)
+            
+            if not room.active and room.rate > self.rate:
+                self._activate(room_id, room, room.rate)
+            elif room.active and room.rate < self.exit_rate:
+                room.active = False
+                logger.info(f"Room {room_id} at {room.rate:.0f} messages/s, back to full delivery")
+            
+            if not room.active and room.rate < 1 and room_id not in self.manager.room_connections:
+                del self.rooms[room_id]
+    
+    def _activate(self, room_id: str, room: RoomSample, rate: float):
+        room.active = True
+        room.rate = max(room.rate, rate)
+        self.activations += 1
+        logger.info(f"Room {room_id} at {rate:.0f} messages/s, switching to chat digests")
+    
+    async def _send_digest(self, room_id: str, room: RoomSample):
+        messages = [message for _, message in sorted(room.sample, key=lambda entry: entry[0])]
+        held = room.held
+        room.held = 0
+        room.sample = []
+        
+        members = len(self.manager.room_connections.get(room_id, ()))
+        if not members:
+            return
+        await self.manager.send_to_local_room(room_id, {
+            "type": "chat_digest",
+            "room_id": room_id,
+            "count": held,
+            "messages": messages
+        })
+        self.digests_sent += 1
+        self.frames_avoided -= members
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Error flushing chat digests: {e}")
+    
+    def get_stats(self) -> dict:
+        return {
+            "rate_threshold": self.rate,
+            "rooms_tracked": len(self.rooms),
+            "rooms_downsampled": sum(1 for room in self.rooms.values() if room.active),
+            "activations": self.activations,
+            "held": self.held,
+            "digests_sent": self.digests_sent,
+            "frames_avoided": self.frames_avoided
+        }
+
+
+# Global chat downsampler instance
+chat_downsampler = ChatDownsampler()
@@ -0,0 +1,118 @@
+from typing import AsyncIterator, Callable, Optional
+import asyncio
+import logging
+import os
+
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from websocket_manager import chat_manager
+from chat_codec import EVENT_STREAM
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Reconnection delay the browser is told to use if the stream drops
+EVENT_STREAM_RETRY_MS = int(os.getenv("CHAT_EVENT_STREAM_RETRY_MS", 3000))
+
+
+class EventStream:
+    """Socket-shaped end of a Server-Sent Events response
+
+    The connection manager registers it like a WebSocket, so the room's
+    writer and fan-out engine feed it records encoded once per event for
+    every stream in the room. A record waits here until the response body
+    takes it. A client that stops reading therefore times the writer out,
+    just like a stalled WebSocket.
+    """
+    
+    __slots__ = ("queue", "closed")
+    
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.closed = False
+    
+    async def accept(self, subprotocol: Optional[str] = None):
+        pass
+    
+    async def send_text(self, payload: str):
+        if self.closed:
+            raise RuntimeError("Event stream closed")
+        await self.queue.put(payload)
+    
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            # The body is not waiting; it sees closed once it takes the queued record
+            pass
+    
+    async def body(self, retry_ms: int) -> AsyncIterator[str]:
+        yield f"retry: {retry_ms}\n\n"
+        while not self.closed:
+            payload = await self.queue.get()
+            if payload is None:
+                break
+            yield payload
+
+
+class EventStreams:
+    """Read-only chat connections over Server-Sent Events
+
+    Most viewers never type. An event stream holds no receive loop and no
+    WebSocket; it is a plain HTTP response that proxies pass through without
+    buffering. It gets the same room events, presence and tips as a
+    WebSocket in the room. A client opens a WebSocket only once its user
+    starts typing.
+
+    Streams are not cacheable by a shared proxy. Each one is opened with
+    the viewer's token, so bans apply and the viewer shows up in the room's
+    presence, and its greeting and replay depend on where that viewer
+    resumes. Proxies only pass the stream through, unbuffered.
+    """
+    
+    def __init__(self, retry_ms: int = EVENT_STREAM_RETRY_MS):
+        self.retry_ms = retry_ms
+        
+        # Metrics
+        self.opened = 0
+        self.active = 0
+    
+    async def open(self, room_id: str, user_info: dict, greeting: Optional[Callable[[], dict]] = None) -> EventStream:
+        """Register a new stream in a room; greeting is queued ahead of any room event"""
+        stream = EventStream()
+        await chat_manager.connect(stream, room_id, user_info, EVENT_STREAM, greeting)
+        self.opened += 1
+        self.active += 1
+        return stream
+    
+    def response(self, stream: EventStream) -> StreamingResponse:
+        """The HTTP response carrying a stream; the connection is removed when it ends"""
+        return StreamingResponse(
+            stream.body(self.retry_ms),
+            media_type="text/event-stream",
+            headers={
+                # Per viewer and live, so never stored by a cache
+                "Cache-Control": "no-cache",
+                # Keep nginx and similar proxies from buffering the stream
+                "X-Accel-Buffering": "no"
+            },
+            background=BackgroundTask(self.close, stream)
+        )
+    
+    async def close(self, stream: EventStream):
+        self.active -= 1
+        stream.closed = True
+        await chat_manager.disconnect(stream)
+    
+    def get_stats(self) -> dict:
+        return {
+            "opened": self.opened,
+            "active": self.active,
+            "retry_ms": self.retry_ms
+        }
+
+
+# Global event streams instance
+event_streams = EventStreams()
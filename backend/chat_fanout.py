@@ -0,0 +1,242 @@
+from fastapi import WebSocket
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
+from collections import deque, defaultdict
+import asyncio
+import json
+import logging
+import os
+import time
+
+from chat_codec import join_frames
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+SEND_TIMEOUT_SECONDS = float(os.getenv("CHAT_SEND_TIMEOUT_SECONDS", 5))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("CHAT_OUTBOUND_QUEUE_SIZE", 256))
+SLOW_CONSUMER_SECONDS = float(os.getenv("CHAT_SLOW_CONSUMER_SECONDS", 10))
+DROPPABLE_EVENT_TYPES = frozenset(
+    event_type.strip()
+    for event_type in os.getenv("CHAT_DROPPABLE_EVENTS", "typing,presence_delta,ping,chat_digest").split(",")
+    if event_type.strip()
+)
+
+# Connections that opt into batching get everything queued within this window as one array frame
+BATCH_WINDOW_SECONDS = float(os.getenv("CHAT_BATCH_WINDOW_MS", 25)) / 1000
+BATCH_MAX_EVENTS = int(os.getenv("CHAT_BATCH_MAX_EVENTS", 128))
+# Array frames kept for reuse by other connections that were sent the same events
+BATCH_CACHE_SIZE = 256
+
+# Close code sent to clients that cannot keep up with their room
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# Close code sent to clients whose socket failed or timed out a send
+SEND_FAILED_CLOSE_CODE = 1011
+
+
+class ConnectionWriter:
+    """Bounded outbound queue and writer task for a single WebSocket connection
+
+    Events whose type is in the droppable set are discarded when the queue is
+    full. Everything else is kept: a queued droppable event is evicted to make
+    room, and failing that the queue is allowed to overflow. A connection that
+    stays full for longer than the slow-consumer threshold, or overflows to
+    twice its size, is reported as a slow consumer so it can be disconnected.
+
+    The writer task only exists while there is something to send, so an idle
+    connection costs no task or coroutine frame. With a batch window, the
+    task waits that long after the first event and then sends everything
+    queued as a single array frame.
+    """
+    
+    __slots__ = (
+        "websocket", "engine", "on_failed", "max_size", "slow_consumer_seconds",
+        "batch_window", "queue", "full_since", "dropped", "closed", "_task"
+    )
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        engine: "FanoutEngine",
+        on_failed: Callable[[WebSocket], None],
+        max_size: int = OUTBOUND_QUEUE_SIZE,
+        slow_consumer_seconds: float = SLOW_CONSUMER_SECONDS,
+        batch_window: float = 0
+    ):
+        self.websocket = websocket
+        self.engine = engine
+        self.on_failed = on_failed
+        self.max_size = max_size
+        self.slow_consumer_seconds = slow_consumer_seconds
+        self.batch_window = batch_window
+        self.queue: Deque[Tuple[Optional[str], Union[str, bytes]]] = deque()
+        self.full_since: Optional[float] = None
+        self.dropped = 0
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+    
+    def close(self):
+        """Stop the writer task and discard anything still queued"""
+        self.closed = True
+        self.queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+    
+    def enqueue(self, payload: Union[str, bytes], event_type: Optional[str] = None) -> bool:
+        """Queue a payload for sending, returning False if this is now a slow consumer"""
+        if self.closed:
+            return True
+        
+        if len(self.queue) >= self.max_size:
+            now = time.monotonic()
+            if self.full_since is None:
+                self.full_since = now
+            
+            if event_type in DROPPABLE_EVENT_TYPES:
+                self._record_drop(event_type)
+            else:
+                # Critical events are never dropped: make room by evicting a
+                # droppable event, and let the queue overflow if there is none
+                self._evict_droppable()
+                self.queue.append((event_type, payload))
+            
+            overflowed = len(self.queue) >= self.max_size * 2
+            stalled = now - self.full_since > self.slow_consumer_seconds
+            if overflowed or stalled:
+                return False
+        else:
+            self.queue.append((event_type, payload))
+        
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return True
+    
+    def _evict_droppable(self) -> bool:
+        """Remove the oldest droppable event from the queue to make room"""
+        for index, (queued_type, _) in enumerate(self.queue):
+            if queued_type in DROPPABLE_EVENT_TYPES:
+                del self.queue[index]
+                self._record_drop(queued_type)
+                return True
+        return False
+    
+    def _record_drop(self, event_type: Optional[str]):
+        self.dropped += 1
+        self.engine.dropped_events[event_type or "unknown"] += 1
+    
+    async def _run(self):
+        try:
+            while self.queue and not self.closed:
+                if self.batch_window:
+                    await asyncio.sleep(self.batch_window)
+                    payload = self.engine.batch([
+                        self.queue.popleft()[1] for _ in range(min(len(self.queue), BATCH_MAX_EVENTS))
+                    ])
+                    if payload is None:
+                        continue
+                else:
+                    _, payload = self.queue.popleft()
+                if self.full_since is not None and len(self.queue) <= self.max_size // 2:
+                    # Only a real drain counts as recovering, not a single send
+                    self.full_since = None
+                
+                if not await self.engine.send(self.websocket, payload):
+                    self.closed = True
+                    self.on_failed(self.websocket)
+                    break
+        except asyncio.CancelledError:
+            return
+        # Queue drained; the next enqueue starts a fresh task
+        self._task = None
+
+
+class FanoutEngine:
+    """Delivers one serialized event to many connections through their outbound queues"""
+    
+    def __init__(self, send_timeout: float = SEND_TIMEOUT_SECONDS):
+        self.send_timeout = send_timeout
+        self.dropped_events: Dict[str, int] = defaultdict(int)
+        self.send_failures = 0
+        self.slow_consumer_disconnects = 0
+        self.batched_frames = 0
+        self.batched_events = 0
+        self.shared_batches = 0
+        # ids of the payloads in an array frame -> (those payloads, the frame)
+        self._batches: Dict[tuple, Tuple[list, Union[str, bytes]]] = {}
+    
+    @staticmethod
+    def encode(message: dict) -> str:
+        """Serialize an event once so every recipient shares the same payload"""
+        return json.dumps(message)
+    
+    async def send(self, websocket: WebSocket, payload: Union[str, bytes]) -> bool:
+        """Send a pre-serialized payload, returning False if the socket is dead or too slow"""
+        try:
+            if isinstance(payload, bytes):
+                await asyncio.wait_for(websocket.send_bytes(payload), timeout=self.send_timeout)
+            else:
+                await asyncio.wait_for(websocket.send_text(payload), timeout=self.send_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Send timed out after {self.send_timeout}s, dropping connection")
+        except Exception as e:
+            logger.error(f"Error sending to connection: {e}")
+        self.send_failures += 1
+        return False
+    
+    def batch(self, payloads: List[Union[str, bytes]]) -> Optional[Union[str, bytes]]:
+        """One frame for a connection's batch; a lone event goes out as it is
+        
+        Connections in a room are sent the same payload objects, so their
+        batches usually match and the array frame is built once for all.
+        """
+        if len(payloads) <= 1:
+            return payloads[0] if payloads else None
+        
+        key = tuple(map(id, payloads))
+        cached = self._batches.get(key)
+        if cached is not None and all(queued is payload for queued, payload in zip(cached[0], payloads)):
+            self.shared_batches += 1
+            frame = cached[1]
+        else:
+            frame = join_frames(payloads)
+            if len(self._batches) >= BATCH_CACHE_SIZE:
+                self._batches.clear()
+            self._batches[key] = (payloads, frame)
+        self.batched_frames += 1
+        self.batched_events += len(payloads)
+        return frame
+    
+    def fan_out(self, writers: Iterable[ConnectionWriter], payload: Union[str, bytes], event_type: Optional[str] = None) -> List[WebSocket]:
+        """Queue a payload on every writer and return the connections that are slow consumers"""
+        slow_consumers = [
+            writer.websocket for writer in writers
+            if not writer.enqueue(payload, event_type)
+        ]
+        self.slow_consumer_disconnects += len(slow_consumers)
+        return slow_consumers
+    
+    def get_stats(self, writers: Iterable[ConnectionWriter]) -> dict:
+        """Queue depth and drop counters for monitoring"""
+        depths = [writer.depth for writer in writers]
+        return {
+            "connections": len(depths),
+            "queue_capacity": OUTBOUND_QUEUE_SIZE,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "connections_with_full_queue": sum(1 for depth in depths if depth >= OUTBOUND_QUEUE_SIZE),
+            "dropped_events": dict(self.dropped_events),
+            "send_failures": self.send_failures,
+            "slow_consumer_disconnects": self.slow_consumer_disconnects,
+            "batched_frames": self.batched_frames,
+            "batched_events": self.batched_events,
+            "shared_batches": self.shared_batches
+        }
+
+
+# Global fan-out engine instance
+fanout_engine = FanoutEngine()
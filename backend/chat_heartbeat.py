@@ -0,0 +1,162 @@
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+from fastapi import WebSocket
+from websocket_manager import chat_manager
+from chat_codec import EVENT_STREAM
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Connections silent for this long are sent a ping
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("CHAT_HEARTBEAT_INTERVAL_SECONDS", 25))
+# Connections silent for this long are considered dead and reaped
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_HEARTBEAT_TIMEOUT_SECONDS", 60))
+# Stale connections removed per batch, yielding to the event loop in between
+REAPER_BATCH_SIZE = int(os.getenv("CHAT_REAPER_BATCH_SIZE", 500))
+
+# Close code sent to connections that stopped answering pings
+HEARTBEAT_CLOSE_CODE = 4012
+CLOSE_TIMEOUT_SECONDS = 1
+
+# Upper bounds in seconds of the connection age histogram buckets
+AGE_BUCKETS = ((60, "<1m"), (300, "<5m"), (900, "<15m"), (3600, "<1h"), (14400, "<4h"))
+AGE_BUCKET_OVERFLOW = ">=4h"
+
+
+def age_histogram(ages: List[float]) -> Dict[str, int]:
+    """Count ages in seconds into the AGE_BUCKETS ranges"""
+    histogram = {label: 0 for _, label in AGE_BUCKETS}
+    histogram[AGE_BUCKET_OVERFLOW] = 0
+    for age in ages:
+        for bound, label in AGE_BUCKETS:
+            if age < bound:
+                histogram[label] += 1
+                break
+        else:
+            histogram[AGE_BUCKET_OVERFLOW] += 1
+    return histogram
+
+
+class HeartbeatMonitor:
+    """Application-level ping/pong that finds and reaps half-open connections
+
+    Every inbound frame marks a connection as alive. Once per interval the
+    monitor pings the connections that have been silent for an interval
+    and removes, in batches, those silent for longer than the timeout. A
+    client answers a ping with a pong, so only a connection whose peer is
+    gone goes silent for that long. Reaped connections leave their room
+    like any other disconnect.
+    """
+    
+    def __init__(
+        self,
+        interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        timeout: float = HEARTBEAT_TIMEOUT_SECONDS,
+        batch_size: int = REAPER_BATCH_SIZE
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.sweeps = 0
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.reaped = 0
+        self.reaped_ages: Dict[str, int] = age_histogram([])
+        self.last_sweep_ms = 0.0
+    
+    async def start(self):
+        """Start the periodic ping and reap sweep"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def on_pong(self):
+        self.pongs_received += 1
+    
+    async def sweep(self):
+        """Ping idle connections and reap the ones past the timeout"""
+        started = time.monotonic()
+        idle = []
+        stale = []
+        for connection in list(chat_manager.connections.values()):
+            silent = started - connection.last_seen
+            # Event stream clients cannot answer; their stream ends when they go away
+            if silent > self.timeout and connection.wire_format != EVENT_STREAM:
+                stale.append(connection)
+            elif silent >= self.interval:
+                idle.append(connection)
+        
+        if idle:
+            await chat_manager.send_to_connections(idle, {"type": "ping", "ts": int(time.time() * 1000)})
+            self.pings_sent += len(idle)
+        
+        for index in range(0, len(stale), self.batch_size):
+            await self._reap(stale[index:index + self.batch_size], started)
+            await asyncio.sleep(0)
+        
+        self.sweeps += 1
+        self.last_sweep_ms = round((time.monotonic() - started) * 1000, 2)
+    
+    async def _reap(self, connections: list, now: float):
+        for label, count in age_histogram([now - connection.connected_at for connection in connections]).items():
+            self.reaped_ages[label] += count
+        self.reaped += len(connections)
+        logger.info(f"Reaping {len(connections)} chat connections that missed their heartbeat")
+        
+        websockets = [connection.websocket for connection in connections]
+        await chat_manager.disconnect_many(websockets)
+        # A half-open socket may never complete the closing handshake
+        await asyncio.gather(*(self._close(websocket) for websocket in websockets))
+    
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=HEARTBEAT_CLOSE_CODE, reason="Heartbeat timeout"),
+                CLOSE_TIMEOUT_SECONDS
+            )
+        except Exception:
+            pass
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error in chat heartbeat sweep: {e}")
+    
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "interval_seconds": self.interval,
+            "timeout_seconds": self.timeout,
+            "sweeps": self.sweeps,
+            "last_sweep_ms": self.last_sweep_ms,
+            "pings_sent": self.pings_sent,
+            "pongs_received": self.pongs_received,
+            "reaped": self.reaped,
+            "reaped_ages": dict(self.reaped_ages),
+            "connection_ages": age_histogram([
+                now - connection.connected_at for connection in chat_manager.connections.values()
+            ])
+        }
+
+
+# Global heartbeat monitor instance
+heartbeat_monitor = HeartbeatMonitor()
@@ -0,0 +1,160 @@
+from typing import Deque, Dict, Set, Union
+from collections import OrderedDict, deque
+import asyncio
+import logging
+import os
+
+from database import get_database
+from chat_persistence import chat_writer
+from chat_codec import wire_codec, JSON
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+CHAT_HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", 50))
+CHAT_HISTORY_MAX_ROOMS = int(os.getenv("CHAT_HISTORY_MAX_ROOMS", 2000))
+
+
+def format_message(document: dict) -> dict:
+    """Shape a stored chat message the way chat_message events carry it"""
+    created_at = document["created_at"]
+    return {
+        "id": document["_id"],
+        "room_id": document["room_id"],
+        "sender_id": document["sender_id"],
+        "sender_username": document["sender_username"],
+        "sender_role": document["sender_role"],
+        "message_type": document["message_type"],
+        "content": document["content"],
+        "tip_amount": document.get("tip_amount"),
+        "created_at": created_at if isinstance(created_at, str) else created_at.isoformat()
+    }
+
+
+class RoomHistory:
+    """Most recent messages of one room plus the serialized history frame per wire format"""
+    
+    def __init__(self, room_id: str, size: int):
+        self.room_id = room_id
+        self.messages: Deque[dict] = deque(maxlen=size)
+        self.loaded = False
+        # Messages deleted while the cold load runs, which its query may still return
+        self.removed: Set[str] = set()
+        self.lock = asyncio.Lock()
+        self._frames: Dict[str, Union[str, bytes]] = {}
+    
+    def append(self, message: dict):
+        self.messages.append(message)
+        self._frames.clear()
+    
+    def remove(self, message_id: str):
+        if not self.loaded:
+            self.removed.add(message_id)
+        for message in self.messages:
+            if message["id"] == message_id:
+                self.messages.remove(message)
+                self._frames.clear()
+                return
+    
+    def frame(self, wire_format: str = JSON) -> Union[str, bytes]:
+        if wire_format not in self._frames:
+            self._frames[wire_format] = wire_codec.encode({
+                "type": "history",
+                "room_id": self.room_id,
+                "messages": list(self.messages)
+            }, wire_format)
+        return self._frames[wire_format]
+
+
+class RoomHistoryCache:
+    """Bounded per-room ring buffers of recent chat messages
+
+    Rooms are filled from MongoDB the first time someone joins them and kept
+    current from the room events every worker receives, so joins are served
+    from memory. The least recently joined rooms are evicted past the limit.
+    """
+    
+    def __init__(self, size: int = CHAT_HISTORY_SIZE, max_rooms: int = CHAT_HISTORY_MAX_ROOMS):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.rooms: "OrderedDict[str, RoomHistory]" = OrderedDict()
+        self.hits = 0
+        self.cold_loads = 0
+    
+    def on_room_event(self, room_id: str, message: dict):
+        """Keep a cached room in step with chat_message and message_deleted events"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            return
+        
+        if message.get("type") == "chat_message":
+            history.append(message["message"])
+        elif message.get("type") == "message_deleted":
+            history.remove(message["message_id"])
+    
+    async def get_frame(self, room_id: str, wire_format: str = JSON) -> Union[str, bytes]:
+        """Serialized history frame for a room, reading MongoDB only on a cold start"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = RoomHistory(room_id, self.size)
+            self.rooms[room_id] = history
+            self._evict()
+        self.rooms.move_to_end(room_id)
+        
+        if history.loaded:
+            self.hits += 1
+            return history.frame(wire_format)
+        
+        async with history.lock:
+            # Joins that arrive during a cold load wait for it instead of querying again
+            if not history.loaded:
+                try:
+                    await self._load(history)
+                    self.cold_loads += 1
+                except Exception as e:
+                    logger.error(f"Error loading chat history for room {room_id}: {e}")
+            else:
+                self.hits += 1
+        return history.frame(wire_format)
+    
+    async def _load(self, history: RoomHistory):
+        db = await get_database()
+        documents = await db.chat_messages.find({
+            "room_id": history.room_id,
+            "is_deleted": False
+        }).sort("created_at", -1).limit(self.size).to_list(length=None)
+        
+        # Messages still in the write-behind buffer, plus any that arrived
+        # as events while the query was running
+        messages: Dict[str, dict] = {}
+        for document in reversed(documents):
+            messages[document["_id"]] = format_message(document)
+        for document in chat_writer.pending_documents(history.room_id):
+            if not document["is_deleted"]:
+                messages.setdefault(document["_id"], format_message(document))
+        for message in history.messages:
+            messages.setdefault(message["id"], message)
+        
+        for message_id in history.removed:
+            messages.pop(message_id, None)
+        
+        history.messages.clear()
+        for message in sorted(messages.values(), key=lambda message: message["created_at"])[-self.size:]:
+            history.append(message)
+        history.removed.clear()
+        history.loaded = True
+    
+    def _evict(self):
+        while len(self.rooms) > self.max_rooms:
+            self.rooms.popitem(last=False)
+    
+    def get_stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "hits": self.hits,
+            "cold_loads": self.cold_loads
+        }
+
+
+# Global room history cache instance
+room_history = RoomHistoryCache()
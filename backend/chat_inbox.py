@@ -0,0 +1,234 @@
+from typing import List, Optional, Set, Tuple
+from datetime import datetime
+from pymongo import ReturnDocument
+import asyncio
+import logging
+import os
+
+from database import get_database
+from models import User, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Characters of the last message kept on a conversation summary
+CONVERSATION_PREVIEW_LENGTH = int(os.getenv("CHAT_CONVERSATION_PREVIEW_LENGTH", 140))
+
+
+class ChatInbox:
+    """Private conversations of each user, with materialized unread counters
+
+    Every private message updates one small summary document per
+    participant in chat_conversations: the other participant, a preview of
+    the last message and that participant's unread count. The recipient's
+    total across conversations is kept in chat_unread. Both counters only
+    move with atomic $inc, so messages arriving while a user marks them
+    read are never lost or counted twice, and a message to a user who is
+    offline still shows up as unread. Listing a user's conversations is a
+    single indexed read of their summaries instead of a history query per
+    conversation.
+
+    A conversation's messages are handled in order on its room actor, so
+    summaries never move back to an older last message. The writes are not
+    one transaction; when one of a recipient's counter writes fails, their
+    total is recounted from the summaries, right away and again on their
+    next inbox read.
+    """
+    
+    def __init__(self, preview_length: int = CONVERSATION_PREVIEW_LENGTH):
+        self.preview_length = preview_length
+        # Users whose total may have drifted from their summaries
+        self.stale: Set[str] = set()
+        
+        # Metrics
+        self.recorded = 0
+        self.failed = 0
+        self.marked_read = 0
+        self.recounts = 0
+    
+    @staticmethod
+    def summary_id(user_id: str, conversation_id: str) -> str:
+        return f"{user_id}:{conversation_id}"
+    
+    async def record_message(self, conversation_id: str, sender: User, recipient_id: str, message: ChatMessage) -> Optional[int]:
+        """Update both participants' summaries for a new private message
+
+        Returns the recipient's total unread count, or None if the inbox
+        could not be updated; the message itself is already stored.
+        """
+        try:
+            db = await get_database()
+            now = datetime.utcnow()
+            last_message = {
+                "last_message_id": message.id,
+                "last_sender_id": sender.id,
+                "last_message_preview": message.content[:self.preview_length],
+                "last_message_at": message.created_at,
+                "updated_at": now
+            }
+            
+            recipient_update = db.chat_conversations.update_one(
+                {"_id": self.summary_id(recipient_id, conversation_id)},
+                {
+                    "$set": dict(last_message, other_username=sender.username),
+                    "$setOnInsert": {
+                        "user_id": recipient_id,
+                        "conversation_id": conversation_id,
+                        "other_user_id": sender.id
+                    },
+                    "$inc": {"unread_count": 1}
+                },
+                upsert=True
+            )
+            sender_update = db.chat_conversations.update_one(
+                {"_id": self.summary_id(sender.id, conversation_id)},
+                {
+                    "$set": last_message,
+                    "$setOnInsert": {
+                        "user_id": sender.id,
+                        "conversation_id": conversation_id,
+                        "other_user_id": recipient_id,
+                        "other_username": None,
+                        "unread_count": 0
+                    }
+                },
+                upsert=True
+            )
+            total_update = db.chat_unread.find_one_and_update(
+                {"_id": recipient_id},
+                {"$inc": {"unread_count": 1}, "$set": {"updated_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            recipient_result, sender_result, total = await asyncio.gather(
+                recipient_update, sender_update, total_update, return_exceptions=True
+            )
+            if isinstance(recipient_result, Exception) or isinstance(total, Exception):
+                # Only one of the two counters may have moved
+                self.failed += 1
+                error = recipient_result if isinstance(recipient_result, Exception) else total
+                logger.error(f"Error counting unread message for {recipient_id} in {conversation_id}: {error}")
+                self.stale.add(recipient_id)
+                return await self.recount(recipient_id)
+            if isinstance(sender_result, Exception):
+                raise sender_result
+            
+            if sender_result.upserted_id is not None:
+                # First message the sender wrote here: name the other side once
+                recipient = await db.users.find_one({"_id": recipient_id}, {"username": 1})
+                if recipient:
+                    await db.chat_conversations.update_one(
+                        {"_id": self.summary_id(sender.id, conversation_id)},
+                        {"$set": {"other_username": recipient["username"]}}
+                    )
+            
+            self.recorded += 1
+            return total["unread_count"]
+        
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error updating inbox for conversation {conversation_id}: {e}")
+            return None
+    
+    async def recount(self, user_id: str) -> Optional[int]:
+        """Reset a user's total to the sum of their summaries' unread counts
+        
+        Only used to repair drift: a message counted while this runs can be
+        overwritten, which the next recount corrects.
+        """
+        try:
+            db = await get_database()
+            totals = await db.chat_conversations.aggregate([
+                {"$match": {"user_id": user_id}},
+                {"$group": {"_id": None, "unread_count": {"$sum": "$unread_count"}}}
+            ]).to_list(length=None)
+            unread_count = totals[0]["unread_count"] if totals else 0
+            await db.chat_unread.update_one(
+                {"_id": user_id},
+                {"$set": {"unread_count": unread_count, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error recounting unread messages for {user_id}: {e}")
+            return None
+        
+        self.stale.discard(user_id)
+        self.recounts += 1
+        return unread_count
+    
+    async def list_conversations(self, user_id: str, limit: int = 50, before: Optional[datetime] = None) -> Tuple[List[dict], int]:
+        """A user's conversation summaries, most recent first, and their total unread count"""
+        if user_id in self.stale:
+            await self.recount(user_id)
+        
+        db = await get_database()
+        query = {"user_id": user_id}
+        if before:
+            query["last_message_at"] = {"$lt": before}
+        
+        conversations, total = await asyncio.gather(
+            db.chat_conversations.find(query).sort("last_message_at", -1).limit(limit).to_list(length=None),
+            db.chat_unread.find_one({"_id": user_id})
+        )
+        return conversations, total["unread_count"] if total else 0
+    
+    async def mark_read(self, user_id: str, conversation_ids: Optional[List[str]] = None) -> Tuple[int, int]:
+        """Mark conversations read, all of them if none are given
+
+        Returns how many conversations had unread messages and the user's
+        remaining total unread count.
+        """
+        db = await get_database()
+        now = datetime.utcnow()
+        query = {"user_id": user_id, "unread_count": {"$gt": 0}}
+        if conversation_ids is not None:
+            query["conversation_id"] = {"$in": conversation_ids}
+        unread = await db.chat_conversations.find(query, {"_id": 1}).to_list(length=None)
+        
+        # Each summary is zeroed atomically and gives back exactly the count
+        # it held, so a message landing meanwhile stays unread in both counters
+        cleared = await asyncio.gather(*(
+            db.chat_conversations.find_one_and_update(
+                {"_id": summary["_id"], "unread_count": {"$gt": 0}},
+                {"$set": {"unread_count": 0, "read_at": now}},
+                projection={"unread_count": 1}
+            )
+            for summary in unread
+        ))
+        cleared = [summary for summary in cleared if summary]
+        read_count = sum(summary["unread_count"] for summary in cleared)
+        
+        if read_count:
+            try:
+                total = await db.chat_unread.find_one_and_update(
+                    {"_id": user_id},
+                    {"$inc": {"unread_count": -read_count}, "$set": {"updated_at": now}},
+                    return_document=ReturnDocument.AFTER
+                )
+            except Exception as e:
+                # The summaries are already cleared, so the total must follow them
+                logger.error(f"Error updating unread total for {user_id}: {e}")
+                self.stale.add(user_id)
+                total = None
+        else:
+            total = await db.chat_unread.find_one({"_id": user_id})
+        
+        self.marked_read += len(cleared)
+        if user_id in self.stale:
+            unread_count = await self.recount(user_id)
+            if unread_count is not None:
+                return len(cleared), unread_count
+        return len(cleared), total["unread_count"] if total else 0
+    
+    def get_stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "failed": self.failed,
+            "marked_read": self.marked_read,
+            "recounts": self.recounts,
+            "stale_users": len(self.stale)
+        }
+
+
+# Global inbox instance
+chat_inbox = ChatInbox()
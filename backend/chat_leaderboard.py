@@ -0,0 +1,263 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, date
+import asyncio
+import heapq
+import logging
+import os
+
+from database import get_database
+from websocket_manager import chat_manager
+from tipping import tip_service
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+LEADERBOARD_FLUSH_SECONDS = float(os.getenv("CHAT_LEADERBOARD_FLUSH_SECONDS", 2))
+LEADERBOARD_SIZE = int(os.getenv("CHAT_LEADERBOARD_SIZE", 10))
+
+WINDOWS = ("session", "day", "all_time")
+
+
+class RoomBoard:
+    """Tokens tipped per user in one room, for each window"""
+    
+    __slots__ = ("session", "day", "all_time", "day_key", "usernames")
+    
+    def __init__(self, day_key: date):
+        self.session: Dict[str, int] = {}
+        self.day: Dict[str, int] = {}
+        self.all_time: Dict[str, int] = {}
+        self.day_key = day_key
+        self.usernames: Dict[str, str] = {}
+    
+    def roll_day(self, today: date) -> bool:
+        """Start a new day window if the date changed, returning True if it did"""
+        if self.day_key == today:
+            return False
+        self.day = {}
+        self.day_key = today
+        return True
+    
+    def top(self, window: str, limit: int) -> List[dict]:
+        totals = getattr(self, window)
+        return [
+            {"user_id": user_id, "username": self.usernames.get(user_id, ""), "tokens": tokens}
+            for user_id, tokens in heapq.nlargest(limit, totals.items(), key=lambda entry: entry[1])
+        ]
+
+
+class TipLeaderboard:
+    """Live top tippers per room for the current show, today and all time
+
+    Every completed tip is shared with all workers over the bus, and each
+    worker adds it to its in-memory totals for the room. At most once per
+    flush interval, a worker sends its own connections in a room one
+    leaderboard frame with the top tippers of each window, and only if it
+    changed. The session window starts over when the model goes live, and
+    the day window at midnight UTC. On startup the totals are rebuilt from
+    transactions with a single aggregation.
+    """
+    
+    def __init__(self, flush_interval: float = LEADERBOARD_FLUSH_SECONDS, size: int = LEADERBOARD_SIZE):
+        self.flush_interval = flush_interval
+        self.size = size
+        self.rooms: Dict[str, RoomBoard] = {}
+        # room_id -> last frame sent, to skip unchanged frames
+        self._last_sent: Dict[str, dict] = {}
+        self._dirty = set()
+        self._task: Optional[asyncio.Task] = None
+        # Bus events seen while a rebuild is running, replayed onto its boards
+        self._rebuild_events: Optional[List[Tuple[Callable[[dict], None], dict]]] = None
+        
+        # Metrics
+        self.tips_applied = 0
+        self.frames_sent = 0
+        self.rebuilt_entries = 0
+        self.last_rebuild_ms = 0.0
+        
+        tip_service.add_listener(self.on_tip)
+        chat_manager.add_bus_handler("tip", self._on_tip_event)
+        chat_manager.add_bus_handler("leaderboard_session", self._on_session_event)
+    
+    async def start(self):
+        """Rebuild the totals from the ledger, then start the periodic push"""
+        try:
+            await self.rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding tip leaderboards: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def _board(self, room_id: str) -> RoomBoard:
+        today = datetime.utcnow().date()
+        board = self.rooms.get(room_id)
+        if board is None:
+            board = self.rooms[room_id] = RoomBoard(today)
+        else:
+            board.roll_day(today)
+        return board
+    
+    async def on_tip(self, tip: dict):
+        """Share a tip completed on this worker with every worker"""
+        await chat_manager.publish({
+            "kind": "tip",
+            "room_id": tip["model_id"],
+            "user_id": tip["user_id"],
+            "username": tip["username"],
+            "tokens": tip["tokens"]
+        })
+    
+    async def _on_tip_event(self, event: dict):
+        self._apply(self._apply_tip, event)
+    
+    def _apply(self, apply: Callable[[dict], None], event: dict):
+        if self._rebuild_events is not None:
+            self._rebuild_events.append((apply, event))
+        apply(event)
+    
+    def _apply_tip(self, event: dict):
+        board = self._board(event["room_id"])
+        user_id = event["user_id"]
+        tokens = event["tokens"]
+        board.session[user_id] = board.session.get(user_id, 0) + tokens
+        board.day[user_id] = board.day.get(user_id, 0) + tokens
+        board.all_time[user_id] = board.all_time.get(user_id, 0) + tokens
+        board.usernames[user_id] = event["username"]
+        self.tips_applied += 1
+        self._dirty.add(event["room_id"])
+    
+    async def start_session(self, room_id: str):
+        """Start a new session window for a room on every worker, when its model goes live"""
+        await chat_manager.publish({"kind": "leaderboard_session", "room_id": room_id})
+    
+    async def _on_session_event(self, event: dict):
+        self._apply(self._apply_session, event)
+    
+    def _apply_session(self, event: dict):
+        board = self.rooms.get(event["room_id"])
+        if board is not None and board.session:
+            board.session = {}
+            self._dirty.add(event["room_id"])
+    
+    def snapshot(self, room_id: str, limit: Optional[int] = None) -> dict:
+        """Top tippers of a room in each window"""
+        limit = limit or self.size
+        board = self.rooms.get(room_id)
+        if board is not None:
+            board.roll_day(datetime.utcnow().date())
+        leaderboard = {"type": "leaderboard", "room_id": room_id}
+        for window in WINDOWS:
+            leaderboard[window] = board.top(window, limit) if board is not None else []
+        return leaderboard
+    
+    async def rebuild(self):
+        """Replace the in-memory totals with those computed from the transactions ledger
+
+        The aggregation counts tips created before it started. Tips and
+        session starts that arrive on the bus while it runs are applied to
+        the live boards as usual and replayed onto the rebuilt ones, so none
+        are lost in the swap.
+        """
+        started = datetime.utcnow()
+        day_start = datetime(started.year, started.month, started.day)
+        db = await get_database()
+        # Starting from model profiles gives each tip its room's session start
+        # and joins transactions through the model_id index
+        pipeline = [
+            {"$project": {"session_start": {"$cond": [{"$eq": ["$is_live", True]}, "$last_online", None]}}},
+            {"$lookup": {"from": "transactions", "localField": "_id", "foreignField": "model_id", "as": "tip"}},
+            {"$unwind": "$tip"},
+            {"$match": {"tip.transaction_type": "tip", "tip.status": "completed", "tip.created_at": {"$lt": started}}},
+            {"$group": {
+                "_id": {"room_id": "$_id", "user_id": "$tip.user_id"},
+                "all_time": {"$sum": "$tip.tokens"},
+                "day": {"$sum": {"$cond": [{"$gte": ["$tip.created_at", day_start]}, "$tip.tokens", 0]}},
+                "session": {"$sum": {"$cond": [
+                    {"$and": [
+                        {"$ne": ["$session_start", None]},
+                        {"$gte": ["$tip.created_at", "$session_start"]}
+                    ]},
+                    "$tip.tokens",
+                    0
+                ]}}
+            }},
+            {"$lookup": {"from": "users", "localField": "_id.user_id", "foreignField": "_id", "as": "user"}},
+            {"$project": {
+                "all_time": 1,
+                "day": 1,
+                "session": 1,
+                "username": {"$arrayElemAt": ["$user.username", 0]}
+            }}
+        ]
+        
+        rooms: Dict[str, RoomBoard] = {}
+        entries = 0
+        self._rebuild_events = []
+        try:
+            async for entry in db.model_profiles.aggregate(pipeline, allowDiskUse=True):
+                room_id = entry["_id"]["room_id"]
+                user_id = entry["_id"]["user_id"]
+                board = rooms.get(room_id)
+                if board is None:
+                    board = rooms[room_id] = RoomBoard(day_start.date())
+                for window in WINDOWS:
+                    if entry[window]:
+                        getattr(board, window)[user_id] = entry[window]
+                board.usernames[user_id] = entry.get("username") or ""
+                entries += 1
+        finally:
+            events, self._rebuild_events = self._rebuild_events, None
+        
+        self.rooms = rooms
+        for apply, event in events:
+            apply(event)
+        self._dirty.update(rooms)
+        self.rebuilt_entries = entries
+        self.last_rebuild_ms = round((datetime.utcnow() - started).total_seconds() * 1000, 2)
+        logger.info(f"Rebuilt tip leaderboards for {len(rooms)} rooms from {entries} tipper totals")
+    
+    async def flush(self):
+        """Send a leaderboard frame to each local room whose top tippers changed"""
+        dirty, self._dirty = self._dirty, set()
+        for room_id in dirty:
+            if room_id not in chat_manager.room_connections:
+                # Nobody here to show it to; a joining client asks over REST
+                self._last_sent.pop(room_id, None)
+                continue
+            leaderboard = self.snapshot(room_id)
+            if self._last_sent.get(room_id) == leaderboard:
+                continue
+            self._last_sent[room_id] = leaderboard
+            await chat_manager.send_to_local_room(room_id, leaderboard)
+            self.frames_sent += 1
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error pushing tip leaderboards: {e}")
+    
+    def get_stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "tippers": sum(len(board.all_time) for board in self.rooms.values()),
+            "tips_applied": self.tips_applied,
+            "frames_sent": self.frames_sent,
+            "rebuilt_entries": self.rebuilt_entries,
+            "last_rebuild_ms": self.last_rebuild_ms
+        }
+
+
+# Global tip leaderboard instance
+tip_leaderboard = TipLeaderboard()
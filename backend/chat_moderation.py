@@ -0,0 +1,164 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import heapq
+import logging
+import os
+
+from database import get_database
+from websocket_manager import chat_manager
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+MODERATION_SWEEP_SECONDS = float(os.getenv("CHAT_MODERATION_SWEEP_SECONDS", 1))
+
+# Actions that stop a user's messages from reaching the room
+SILENCING_ACTIONS = ("mute", "ban")
+
+# Close codes sent to sockets removed by a moderator
+KICK_CLOSE_CODE = 4010
+BAN_CLOSE_CODE = 4011
+
+
+class ModerationIndex:
+    """In-memory index of active mutes and bans per room
+
+    Checks are a dictionary lookup. Expiries sit in a min-heap that a
+    background sweep drains; an entry is also treated as gone as soon as its
+    expiry passes, so a check never depends on the sweep having run. The
+    index is loaded from chat_moderation_actions at startup and kept in step
+    across workers by the moderation_action events broadcast to each room.
+    """
+    
+    def __init__(self, sweep_seconds: float = MODERATION_SWEEP_SECONDS):
+        self.sweep_seconds = sweep_seconds
+        # action_type -> room_id -> user_id -> expiry (None means permanent)
+        self.actions: Dict[str, Dict[str, Dict[str, Optional[datetime]]]] = {
+            action_type: {} for action_type in SILENCING_ACTIONS
+        }
+        self._expiries: List[Tuple[datetime, str, str, str]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+    
+    async def load(self):
+        """Rebuild the index from the moderation actions still in force"""
+        db = await get_database()
+        current_time = datetime.utcnow()
+        active_actions = await db.chat_moderation_actions.find({
+            "action_type": {"$in": list(SILENCING_ACTIONS)},
+            "$or": [
+                {"expires_at": None},
+                {"expires_at": {"$gt": current_time}}
+            ]
+        }).to_list(length=None)
+        
+        for action in active_actions:
+            self.apply(action["action_type"], action["room_id"], action["target_user_id"], action.get("expires_at"))
+        logger.info(f"Loaded {len(active_actions)} active chat moderation actions")
+    
+    async def start(self):
+        """Load active actions and start the expiry sweep"""
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Error loading chat moderation actions: {e}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def apply(self, action_type: str, room_id: str, user_id: str, expires_at: Optional[datetime]):
+        """Record a mute or ban, keeping whichever of old and new lasts longer
+
+        Applying the same action twice is a no-op, so the worker that took
+        it can record it before its own broadcast comes back on the bus.
+        """
+        if action_type not in self.actions:
+            return
+        
+        room_actions = self.actions[action_type].setdefault(room_id, {})
+        if user_id in room_actions:
+            current = room_actions[user_id]
+            if current is None or (expires_at is not None and expires_at <= current):
+                return
+        
+        room_actions[user_id] = expires_at
+        if expires_at is not None:
+            heapq.heappush(self._expiries, (expires_at, action_type, room_id, user_id))
+    
+    def _is_active(self, action_type: str, room_id: str, user_id: str) -> bool:
+        room_actions = self.actions[action_type].get(room_id)
+        if not room_actions or user_id not in room_actions:
+            return False
+        
+        expires_at = room_actions[user_id]
+        if expires_at is not None and expires_at <= datetime.utcnow():
+            self._remove(action_type, room_id, user_id)
+            return False
+        return True
+    
+    def is_silenced(self, room_id: str, user_id: str) -> bool:
+        """Check whether a user is muted or banned in a room"""
+        return any(self._is_active(action_type, room_id, user_id) for action_type in SILENCING_ACTIONS)
+    
+    def is_banned(self, room_id: str, user_id: str) -> bool:
+        return self._is_active("ban", room_id, user_id)
+    
+    def _remove(self, action_type: str, room_id: str, user_id: str):
+        room_actions = self.actions[action_type].get(room_id)
+        if room_actions is None:
+            return
+        room_actions.pop(user_id, None)
+        if not room_actions:
+            del self.actions[action_type][room_id]
+        self.expired += 1
+    
+    def sweep(self):
+        """Drop every action whose expiry has passed"""
+        current_time = datetime.utcnow()
+        while self._expiries and self._expiries[0][0] <= current_time:
+            expires_at, action_type, room_id, user_id = heapq.heappop(self._expiries)
+            # Skip heap entries superseded by a longer action for the same user
+            if self.actions[action_type].get(room_id, {}).get(user_id, False) == expires_at:
+                self._remove(action_type, room_id, user_id)
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            self.sweep()
+    
+    async def on_room_event(self, room_id: str, message: dict):
+        """Apply moderation actions broadcast on any worker and remove kicked or banned sockets"""
+        if message.get("type") != "moderation_action":
+            return
+        
+        action_type = message.get("action_type")
+        target_user_id = message.get("target_user_id")
+        expires_at = message.get("expires_at")
+        self.apply(action_type, room_id, target_user_id, datetime.fromisoformat(expires_at) if expires_at else None)
+        
+        if action_type == "kick":
+            await chat_manager.close_user_connections(room_id, target_user_id, KICK_CLOSE_CODE, "Removed from chat by a moderator")
+        elif action_type == "ban":
+            await chat_manager.close_user_connections(room_id, target_user_id, BAN_CLOSE_CODE, "Banned from this chat")
+    
+    def get_stats(self) -> dict:
+        stats = {
+            action_type: sum(len(users) for users in rooms.values())
+            for action_type, rooms in self.actions.items()
+        }
+        stats["pending_expiries"] = len(self._expiries)
+        stats["expired"] = self.expired
+        return stats
+
+
+# Global moderation index instance
+moderation_index = ModerationIndex()
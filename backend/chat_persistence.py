@@ -0,0 +1,257 @@
+from typing import Any, Dict, List, Optional
+from collections import deque
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+import os
+import time
+
+from database import get_database
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+CHAT_FLUSH_BATCH_SIZE = int(os.getenv("CHAT_FLUSH_BATCH_SIZE", 500))
+CHAT_FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_FLUSH_INTERVAL_SECONDS", 0.25))
+CHAT_BUFFER_LIMIT = int(os.getenv("CHAT_BUFFER_LIMIT", 50000))
+CHAT_FLUSH_MAX_RETRIES = int(os.getenv("CHAT_FLUSH_MAX_RETRIES", 3))
+
+# MongoDB duplicate key error; the document was already written by an earlier attempt
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ChatWriteBehind:
+    """Buffers chat messages and writes them to MongoDB in batches
+
+    Messages are broadcast before they are stored. The buffer is flushed with
+    insert_many(ordered=False) once it holds a batch worth of documents or
+    the flush interval passes, whichever comes first, and drained on shutdown.
+    """
+    
+    def __init__(
+        self,
+        collection_name: str = "chat_messages",
+        database: Any = None,
+        batch_size: int = CHAT_FLUSH_BATCH_SIZE,
+        flush_interval: float = CHAT_FLUSH_INTERVAL_SECONDS,
+        buffer_limit: int = CHAT_BUFFER_LIMIT,
+        max_retries: int = CHAT_FLUSH_MAX_RETRIES
+    ):
+        self.collection_name = collection_name
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_limit = buffer_limit
+        self.max_retries = max_retries
+        
+        # Documents waiting to be written, with how many attempts each has had
+        self.buffer: deque = deque()
+        # Documents being written right now, so readers can still find them
+        self.in_flight: Dict[str, dict] = {}
+        # $set fields for in-flight documents, applied once their insert has landed
+        self.late_updates: Dict[str, Dict[str, Any]] = {}
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    async def start(self):
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flush loop and write out everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        while self.buffer:
+            if not await self.flush():
+                break
+        if self.buffer:
+            logger.error(f"Discarding {len(self.buffer)} unwritten chat messages on shutdown")
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+            self.late_updates.clear()
+    
+    def enqueue(self, document: dict):
+        """Buffer a chat message document for the next batch"""
+        if len(self.buffer) >= self.buffer_limit:
+            # Database is not keeping up; shed the oldest message rather than grow without bound
+            document, _ = self.buffer.popleft()
+            self.late_updates.pop(document["_id"], None)
+            self.dropped += 1
+            logger.warning("Chat write buffer full, dropping oldest message")
+        
+        self.buffer.append([document, 0])
+        self.enqueued += 1
+        if len(self.buffer) >= self.batch_size:
+            self._batch_ready.set()
+    
+    def pending_documents(self, room_id: Optional[str] = None) -> List[dict]:
+        """Documents accepted but not yet confirmed written, oldest first"""
+        documents = list(self.in_flight.values()) + [document for document, _ in self.buffer]
+        if room_id is not None:
+            documents = [document for document in documents if document["room_id"] == room_id]
+        return documents
+    
+    def find_pending(self, message_id: str) -> Optional[dict]:
+        """Look up a message that may not have reached the database yet"""
+        if message_id in self.in_flight:
+            return self.in_flight[message_id]
+        for document, _ in self.buffer:
+            if document["_id"] == message_id:
+                return document
+        return None
+    
+    def update_pending(self, message_id: str, fields: Dict[str, Any]) -> bool:
+        """Apply a $set-style update to a buffered message, returning True if it was found
+
+        A message whose insert is already running may have been encoded
+        before this change, and an update_one issued now can reach the
+        database before the insert does. Its fields are therefore also set
+        again once the insert has landed.
+        """
+        document = self.find_pending(message_id)
+        if document is None:
+            return False
+        document.update(fields)
+        if message_id in self.in_flight:
+            self.late_updates.setdefault(message_id, {}).update(fields)
+        return True
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            
+            if self.buffer:
+                try:
+                    if not await self.flush():
+                        # Database unreachable; back off before trying again
+                        await asyncio.sleep(self.flush_interval * 4)
+                except Exception as e:
+                    logger.error(f"Error flushing chat messages: {e}")
+    
+    async def flush(self) -> bool:
+        """Write one batch, returning False if the database could not be reached"""
+        async with self._flush_lock:
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            if not batch:
+                return True
+            
+            documents = [document for document, _ in batch]
+            for document in documents:
+                self.in_flight[document["_id"]] = document
+            
+            started = time.perf_counter()
+            failed_indexes: List[int] = []
+            reachable = True
+            try:
+                db = self.database if self.database is not None else await get_database()
+                await db[self.collection_name].insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                # With ordered=False every other document was still attempted
+                failed_indexes = [
+                    error["index"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                ]
+                if e.details.get("writeConcernErrors"):
+                    failed_indexes = list(range(len(batch)))
+            except Exception as e:
+                logger.error(f"Chat message batch write failed: {e}")
+                failed_indexes = list(range(len(batch)))
+                reachable = False
+            finally:
+                for document in documents:
+                    self.in_flight.pop(document["_id"], None)
+            
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_batch_size = len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            self.written += len(batch) - len(failed_indexes)
+            
+            if self.late_updates and reachable:
+                await self._apply_late_updates(db, documents, failed_indexes)
+            
+            # Put failed documents back at the front, in their original order.
+            # An outage is retried until the buffer limit sheds messages; a
+            # document the server rejected only gets a few more attempts.
+            for index in reversed(failed_indexes):
+                document, attempts = batch[index]
+                if reachable:
+                    attempts += 1
+                    if attempts >= self.max_retries:
+                        self.failed += 1
+                        self.late_updates.pop(document["_id"], None)
+                        logger.error(f"Giving up on chat message {document['_id']} after {attempts} attempts")
+                        continue
+                self.retried += 1
+                self.buffer.appendleft([document, attempts])
+            
+            return reachable
+    
+    async def _apply_late_updates(self, db: Any, documents: List[dict], failed_indexes: List[int]):
+        """Set fields changed during the insert on the documents it wrote
+
+        Documents going back into the buffer keep their updates until the
+        insert that finally writes them.
+        """
+        failed = set(failed_indexes)
+        for index, document in enumerate(documents):
+            if index in failed:
+                continue
+            fields = self.late_updates.pop(document["_id"], None)
+            if fields is None:
+                continue
+            try:
+                await db[self.collection_name].update_one({"_id": document["_id"]}, {"$set": fields})
+            except Exception as e:
+                logger.error(f"Error updating chat message {document['_id']} after its insert: {e}")
+    
+    def get_stats(self) -> dict:
+        """Flush latency, batch size and write outcome counters"""
+        return {
+            "buffered": len(self.buffer),
+            "in_flight": len(self.in_flight),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": round(self.written / self.flushes, 1) if self.flushes else 0,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0
+        }
+
+
+# Global chat write-behind instance
+chat_writer = ChatWriteBehind()
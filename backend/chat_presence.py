@@ -0,0 +1,179 @@
+from typing import Dict, List, Optional
+from itertools import islice
+import asyncio
+import logging
+import os
+
+from websocket_manager import chat_manager
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+PRESENCE_FLUSH_SECONDS = float(os.getenv("CHAT_PRESENCE_FLUSH_SECONDS", 1))
+# Rooms with more members than this only get a member count, never names
+PRESENCE_FULL_LIST_MAX = int(os.getenv("CHAT_PRESENCE_FULL_LIST_MAX", 200))
+PRESENCE_PAGE_SIZE = int(os.getenv("CHAT_PRESENCE_PAGE_SIZE", 100))
+PRESENCE_PAGE_MAX = 500
+
+
+class RoomPresence:
+    """Room membership and coalesced presence updates
+
+    Membership is tracked per user from the connection registry, local and
+    mirrored from other workers, so a user with several tabs is one member.
+    Joins and leaves are collected per room and sent as a single
+    presence_delta frame every flush interval. A user who joins and leaves
+    within one interval is never announced. Each worker delivers the frames
+    for its own connections, since it sees every worker's presence changes.
+    """
+    
+    def __init__(self, flush_interval: float = PRESENCE_FLUSH_SECONDS, full_list_max: int = PRESENCE_FULL_LIST_MAX):
+        self.flush_interval = flush_interval
+        self.full_list_max = full_list_max
+        # room_id -> user_id -> [connection count, user details], in join order
+        self.members: Dict[str, Dict[str, list]] = {}
+        # room_id -> user_id -> (was a member at the last flush, user details)
+        self.changes: Dict[str, Dict[str, tuple]] = {}
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.flushes = 0
+        self.frames_sent = 0
+        self.changes_coalesced = 0
+    
+    async def start(self):
+        """Start the periodic flush of presence deltas"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def on_presence_change(self, op: str, user: dict):
+        """Record a connection joining or leaving a room on any worker"""
+        room_id = user["room_id"]
+        user_id = user["user_id"]
+        room = self.members.setdefault(room_id, {})
+        was_member = user_id in room
+        
+        if op == "join":
+            if was_member:
+                room[user_id][0] += 1
+                return
+            room[user_id] = [1, user]
+        else:
+            if not was_member:
+                return
+            room[user_id][0] -= 1
+            if room[user_id][0] > 0:
+                return
+            del room[user_id]
+            if not room:
+                del self.members[room_id]
+        
+        room_changes = self.changes.setdefault(room_id, {})
+        if user_id in room_changes:
+            self.changes_coalesced += 1
+        else:
+            room_changes[user_id] = (was_member, user)
+    
+    def count(self, room_id: str) -> int:
+        """Number of distinct users in a room"""
+        return len(self.members.get(room_id, {}))
+    
+    def get_members(self, room_id: str, offset: int = 0, limit: int = PRESENCE_PAGE_SIZE) -> List[dict]:
+        """One page of a room's members in join order"""
+        limit = max(0, min(limit, PRESENCE_PAGE_MAX))
+        room = self.members.get(room_id, {})
+        return [
+            self._public(user)
+            for _, user in islice(room.values(), max(0, offset), max(0, offset) + limit)
+        ]
+    
+    def snapshot(self, room_id: str) -> dict:
+        """Presence frame for a client that has just joined a room"""
+        count = self.count(room_id)
+        users = self.get_members(room_id, 0, PRESENCE_PAGE_SIZE) if count <= self.full_list_max else []
+        return {
+            "type": "online_users",
+            "room_id": room_id,
+            "count": count,
+            "users": users,
+            "complete": len(users) == count
+        }
+    
+    @staticmethod
+    def _public(user: dict) -> dict:
+        return {
+            "user_id": user["user_id"],
+            "username": user["username"],
+            "role": user["role"]
+        }
+    
+    def _build_delta(self, room_id: str, room_changes: Dict[str, tuple]) -> Optional[dict]:
+        count = self.count(room_id)
+        delta = {
+            "type": "presence_delta",
+            "room_id": room_id,
+            "count": count
+        }
+        if count > self.full_list_max:
+            # Large rooms only learn the new size; names are fetched page by page
+            delta["approximate"] = True
+            return delta
+        
+        room = self.members.get(room_id, {})
+        joined = []
+        left = []
+        for user_id, (was_member, user) in room_changes.items():
+            is_member = user_id in room
+            if is_member and not was_member:
+                joined.append(self._public(user))
+            elif was_member and not is_member:
+                left.append(user_id)
+        
+        if not joined and not left:
+            return None
+        delta["joined"] = joined
+        delta["left"] = left
+        return delta
+    
+    async def flush(self):
+        """Send one presence_delta frame to each changed room with local connections"""
+        changes, self.changes = self.changes, {}
+        self.flushes += 1
+        for room_id, room_changes in changes.items():
+            if room_id not in chat_manager.room_connections:
+                continue
+            delta = self._build_delta(room_id, room_changes)
+            if delta:
+                await chat_manager.send_to_local_room(room_id, delta)
+                self.frames_sent += 1
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing presence deltas: {e}")
+    
+    def get_stats(self) -> dict:
+        return {
+            "rooms": len(self.members),
+            "members": sum(len(room) for room in self.members.values()),
+            "pending_rooms": len(self.changes),
+            "flushes": self.flushes,
+            "frames_sent": self.frames_sent,
+            "changes_coalesced": self.changes_coalesced
+        }
+
+
+# Global room presence instance
+room_presence = RoomPresence()
@@ -0,0 +1,109 @@
+from typing import Deque, Optional
+from collections import OrderedDict, deque
+import logging
+import os
+
+from websocket_manager import chat_manager
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+CHAT_REPLAY_WINDOW = int(os.getenv("CHAT_REPLAY_WINDOW", 512))
+CHAT_REPLAY_MAX_ROOMS = int(os.getenv("CHAT_REPLAY_MAX_ROOMS", 2000))
+
+
+class RoomReplay:
+    """Replay windows that let a reconnecting client resume a room's stream
+
+    Room events carry a per-room sequence number from the event bus. A
+    client that reconnects with the last sequence number it saw, and the
+    epoch it was issued with, gets the events it missed in a single
+    "replay" frame instead of the full history. When the gap is older than
+    the window, or the numbering has restarted, it gets a "reset" frame and
+    starts over from the history frame. Fresh joins get a "sync" frame
+    telling them where the stream currently stands.
+    """
+    
+    def __init__(self, window: int = CHAT_REPLAY_WINDOW, max_rooms: int = CHAT_REPLAY_MAX_ROOMS):
+        self.window = window
+        self.max_rooms = max_rooms
+        self.epoch: Optional[str] = None
+        # room_id -> most recent events, least recently used rooms evicted first;
+        # the last event holds the room's latest seq
+        self.rooms: "OrderedDict[str, Deque[dict]]" = OrderedDict()
+        
+        # Metrics
+        self.resumed = 0
+        self.events_replayed = 0
+        self.resets = 0
+    
+    def on_room_event(self, room_id: str, message: dict):
+        """Remember a sequenced room event for clients that reconnect later"""
+        if "seq" not in message:
+            return
+        
+        if self.epoch != chat_manager.bus_epoch:
+            # The numbering restarted; nothing buffered can be resumed any more
+            self.epoch = chat_manager.bus_epoch
+            self.rooms.clear()
+        
+        events = self.rooms.get(room_id)
+        if events is None:
+            events = deque(maxlen=self.window)
+            self.rooms[room_id] = events
+            self._evict()
+        events.append(message)
+    
+    def greeting(self, room_id: str, since: Optional[int] = None, epoch: Optional[str] = None) -> dict:
+        """First frame for a connection: where the stream stands, or what it missed"""
+        events = self.rooms.get(room_id)
+        if events is not None:
+            self.rooms.move_to_end(room_id)
+        last_seq = events[-1]["seq"] if events else 0
+        frame = {
+            "type": "sync",
+            "room_id": room_id,
+            "epoch": self.epoch,
+            "seq": last_seq
+        }
+        if since is None:
+            return frame
+        
+        if epoch != self.epoch or not events:
+            # Without a window, an evicted room cannot show that nothing was missed
+            resumable = False
+        elif since == last_seq:
+            # Nothing was missed
+            frame["events"] = []
+            resumable = True
+        else:
+            resumable = events[0]["seq"] - 1 <= since < last_seq
+            if resumable:
+                frame["events"] = [event for event in events if event["seq"] > since]
+                self.events_replayed += len(frame["events"])
+        
+        if resumable:
+            frame["type"] = "replay"
+            self.resumed += 1
+        else:
+            frame["type"] = "reset"
+            self.resets += 1
+        return frame
+    
+    def _evict(self):
+        while len(self.rooms) > self.max_rooms:
+            self.rooms.popitem(last=False)
+    
+    def get_stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "buffered_events": sum(len(events) for events in self.rooms.values()),
+            "epoch": self.epoch,
+            "resumed": self.resumed,
+            "events_replayed": self.events_replayed,
+            "resets": self.resets
+        }
+
+
+# Global room replay instance
+room_replay = RoomReplay()
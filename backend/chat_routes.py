@@ -1,6 +1,7 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, status, Query
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header, Request, status, Query
+from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Awaitable, Callable, Optional, List, Dict, Any
 from datetime import datetime, timedelta
 import uuid
 import json
@@ -10,11 +11,43 @@ from auth import get_current_user, get_current_user_websocket
 from database import get_database
 from models import User, UserRole, ChatMessage, ChatRoom, ChatModerationAction, MessageType
 from websocket_manager import chat_manager
+from chat_persistence import chat_writer
+from chat_history import room_history
+from chat_replay import room_replay
+from chat_moderation import moderation_index, BAN_CLOSE_CODE
+from chat_presence import room_presence, PRESENCE_PAGE_SIZE
+from chat_typing import typing_aggregator
+from chat_heartbeat import heartbeat_monitor
+from chat_sharding import shard_router
+from tipping import tip_service, TipError
+from chat_leaderboard import tip_leaderboard
+from chat_actors import room_actors
+from rate_limit import rate_limiter
+from chat_codec import wire_codec, negotiate_subprotocol, wire_format_for, parse_event_id, EVENT_STREAM
+from chat_events import event_streams
+from chat_dedupe import client_message_ids, valid_client_msg_id
+from chat_inbox import chat_inbox
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Client messages that can carry a client_msg_id and are acked
+ACKED_MESSAGE_TYPES = frozenset({"chat_message", "private_message"})
+# Conversations one mark-read request may name
+MAX_MARK_READ_CONVERSATIONS = 100
+# Largest page of room members one request may ask for
+MAX_PRESENCE_PAGE_SIZE = 500
+
+# Keep cached room history in step with every worker's room events
+chat_manager.add_room_listener(room_history.on_room_event)
+# Buffer sequenced room events for clients that reconnect
+chat_manager.add_room_listener(room_replay.on_room_event)
+# Apply mutes, bans and kicks issued on any worker
+chat_manager.add_room_listener(moderation_index.on_room_event)
+# Track room membership for coalesced presence updates
+chat_manager.add_presence_listener(room_presence.on_presence_change)
+
 # Request/Response Models
 class SendMessageRequest(BaseModel):
     room_id: str
@@ -55,14 +88,45 @@ class ChatRoomResponse(BaseModel):
     online_users_count: int
     created_at: datetime
 
+class ConversationResponse(BaseModel):
+    conversation_id: str
+    other_user_id: str
+    other_username: Optional[str] = None
+    last_message_id: str
+    last_sender_id: str
+    last_message_preview: str
+    last_message_at: datetime
+    unread_count: int
+
+class InboxResponse(BaseModel):
+    unread_count: int
+    conversations: List[ConversationResponse]
+
+class MarkReadRequest(BaseModel):
+    # None marks every conversation read
+    conversation_ids: Optional[List[str]] = None
+
 # WebSocket Chat Endpoint
 @router.websocket("/ws/chat/{room_id}")
 async def websocket_chat_endpoint(
     websocket: WebSocket,
     room_id: str,
-    token: str = Query(...)
+    token: str = Query(...),
+    since: Optional[int] = Query(None),
+    epoch: Optional[str] = Query(None),
+    batch: bool = Query(False)
 ):
-    """WebSocket endpoint for real-time chat"""
+    """WebSocket endpoint for real-time chat
+
+    A reconnecting client passes the last seq and the epoch it saw to get
+    only the room events it missed. A client that passes batch=1 receives
+    its events bundled into array frames, one every CHAT_BATCH_WINDOW_MS.
+    """
+    if not shard_router.owns(room_id):
+        # Another chat shard serves this room; it authenticates the client itself
+        await shard_router.proxy(websocket, room_id)
+        return
+    
     try:
         # Authenticate user
         user = await get_current_user_websocket(token)
@@ -70,104 +134,366 @@ async def websocket_chat_endpoint(
             await websocket.close(code=4003, reason="Authentication failed")
             return
         
+        if moderation_index.is_banned(room_id, user.id):
+            await websocket.close(code=BAN_CLOSE_CODE, reason="Banned from this chat")
+            return
+        
         user_info = {
             "user_id": user.id,
             "username": user.username,
             "role": user.role
         }
         
-        # Connect to chat manager
-        await chat_manager.connect(websocket, room_id, user_info)
+        # JSON text frames unless the client asks for MessagePack
+        wire_format = wire_format_for(negotiate_subprotocol(websocket.scope.get("subprotocols", [])))
+        
+        # Connect to chat manager; the greeting is queued before any live room event
+        greeting = {}
+        
+        def build_greeting() -> dict:
+            greeting.update(room_replay.greeting(room_id, since, epoch))
+            return greeting
+        
+        await chat_manager.connect(websocket, room_id, user_info, wire_format, build_greeting, batch)
         
         # Get database
         db = await get_database()
         
-        # Send recent chat history
-        recent_messages = await db.chat_messages.find({
-            "room_id": room_id,
-            "is_deleted": False
-        }).sort("created_at", -1).limit(50).to_list(length=None)
+        await send_room_state(websocket, room_id, wire_format, greeting)
         
-        # Send messages in chronological order
-        for message in reversed(recent_messages):
-            await chat_manager.send_personal_message({
-                "type": "chat_message",
-                "message": {
-                    "id": message["_id"],
-                    "room_id": message["room_id"],
-                    "sender_id": message["sender_id"],
-                    "sender_username": message["sender_username"],
-                    "sender_role": message["sender_role"],
-                    "message_type": message["message_type"],
-                    "content": message["content"],
-                    "tip_amount": message.get("tip_amount"),
-                    "created_at": message["created_at"].isoformat()
-                }
-            }, websocket)
+        async def on_message(message_data: dict):
+            await dispatch_client_message(websocket, db, user, room_id, message_data)
         
-        # Send current online users
-        online_users = chat_manager.get_room_users(room_id)
-        await chat_manager.send_personal_message({
-            "type": "online_users",
-            "users": online_users
-        }, websocket)
+        await receive_client_messages(websocket, user, on_message)
+    
+    except Exception as e:
+        logger.error(f"WebSocket connection error: {e}")
+    finally:
+        await chat_manager.disconnect(websocket)
+
+# Multiplexed WebSocket Endpoint
+@router.websocket("/ws")
+async def websocket_multiplexed_endpoint(
+    websocket: WebSocket,
+    token: str = Query(...),
+    batch: bool = Query(False)
+):
+    """One WebSocket for any number of rooms plus private messages
+
+    The client sends {"type": "subscribe", "room_id", "since", "epoch"} to
+    join a room. It then gets the room's sync (or replay) frame, history,
+    presence and leaderboard, followed by its live events.
+    {"type": "unsubscribe", "room_id"} leaves it again. Room messages sent
+    by the client carry the room_id they are for. Private messages arrive
+    whether or not any room is subscribed.
+    """
+    try:
+        user = await get_current_user_websocket(token)
+        if not user:
+            await websocket.close(code=4003, reason="Authentication failed")
+            return
         
-        # Listen for messages
-        while True:
-            try:
-                data = await websocket.receive_text()
-                message_data = json.loads(data)
-                
-                # Handle different message types
-                if message_data["type"] == "chat_message":
-                    await handle_chat_message(db, user, room_id, message_data)
-                elif message_data["type"] == "private_message":
-                    await handle_private_message(db, user, message_data)
-                elif message_data["type"] == "typing":
-                    await handle_typing_indicator(room_id, user, message_data)
-                elif message_data["type"] == "moderation_action":
-                    await handle_moderation_action(db, user, room_id, message_data)
-                    
-            except WebSocketDisconnect:
-                break
-            except json.JSONDecodeError:
+        user_info = {
+            "user_id": user.id,
+            "username": user.username,
+            "role": user.role
+        }
+        wire_format = wire_format_for(negotiate_subprotocol(websocket.scope.get("subprotocols", [])))
+        await chat_manager.connect(websocket, None, user_info, wire_format, batch=batch)
+        
+        db = await get_database()
+        connection = chat_manager.connections[websocket]
+        
+        async def on_message(message_data: dict):
+            message_type = message_data["type"]
+            if message_type == "private_message":
+                await dispatch_client_message(websocket, db, user, None, message_data)
+                return
+            
+            room_id = message_data.get("room_id")
+            if not room_id or not isinstance(room_id, str):
                 await chat_manager.send_personal_message({
                     "type": "error",
-                    "message": "Invalid JSON format"
+                    "code": "room_required",
+                    "message": "Messages on this connection need a room_id"
                 }, websocket)
-            except Exception as e:
-                logger.error(f"Error processing WebSocket message: {e}")
+                return
+            
+            if message_type == "subscribe":
+                await subscribe_room(websocket, user, room_id, wire_format, message_data)
+            elif message_type == "unsubscribe":
+                await chat_manager.unsubscribe(websocket, room_id)
+                await chat_manager.send_personal_message({"type": "unsubscribed", "room_id": room_id}, websocket)
+            elif room_id not in connection.rooms:
                 await chat_manager.send_personal_message({
                     "type": "error",
-                    "message": "Error processing message"
+                    "code": "not_subscribed",
+                    "room_id": room_id,
+                    "message": "Subscribe to the room first"
                 }, websocket)
-                
+            else:
+                await dispatch_client_message(websocket, db, user, room_id, message_data)
+        
+        await receive_client_messages(websocket, user, on_message)
+    
     except Exception as e:
-        logger.error(f"WebSocket connection error: {e}")
+        logger.error(f"Multiplexed WebSocket connection error: {e}")
     finally:
         await chat_manager.disconnect(websocket)
 
-async def handle_chat_message(db: Any, user: User, room_id: str, message_data: dict):
-    """Handle incoming chat message"""
+# Server-Sent Events Endpoint
+@router.get("/rooms/{room_id}/events")
+async def room_event_stream(
+    room_id: str,
+    request: Request,
+    token: str = Query(...),
+    since: Optional[int] = Query(None),
+    epoch: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None)
+):
+    """Read-only stream of a room's chat, presence and tip events
+
+    Frames are the same JSON events a WebSocket client gets, as Server-Sent
+    Events. When the browser reconnects it sends the id of the last event
+    it saw as Last-Event-ID, and gets only the events it missed if they are
+    still in the replay window. since and epoch do the same on a first
+    connection.
+    """
+    if not shard_router.owns(room_id):
+        # EventSource follows redirects, so the client lands on the owning shard
+        shard_url = shard_router.describe(room_id)["shard_url"]
+        return RedirectResponse(f"{shard_url}{request.url.path}?{request.url.query}", status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    
+    user = await get_current_user_websocket(token)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed"
+        )
+    if moderation_index.is_banned(room_id, user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Banned from this chat"
+        )
+    
+    if last_event_id:
+        epoch, since = parse_event_id(last_event_id)
+    
+    greeting = {}
+    
+    def build_greeting() -> dict:
+        greeting.update(room_replay.greeting(room_id, since, epoch))
+        return greeting
+    
+    stream = await event_streams.open(room_id, {
+        "user_id": user.id,
+        "username": user.username,
+        "role": user.role
+    }, build_greeting)
+    try:
+        await send_room_state(stream, room_id, EVENT_STREAM, greeting)
+    except Exception as e:
+        logger.error(f"Error opening event stream for room {room_id}: {e}")
+        await event_streams.close(stream)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to open event stream"
+        )
+    return event_streams.response(stream)
+
+async def subscribe_room(websocket: WebSocket, user: User, room_id: str, wire_format: str, message_data: dict):
+    """Add a multiplexed connection to a room and send it the room's current state"""
+    refusal = None
+    since = message_data.get("since")
+    epoch = message_data.get("epoch")
+    if since is not None and (not isinstance(since, int) or isinstance(since, bool)):
+        refusal = {"code": "invalid_resume", "message": "since must be an integer"}
+    elif epoch is not None and not isinstance(epoch, str):
+        refusal = {"code": "invalid_resume", "message": "epoch must be a string"}
+    elif not shard_router.owns(room_id):
+        # Room traffic stays on the owning shard; the client opens a connection there
+        refusal = dict(shard_router.describe(room_id), code="wrong_shard", message="This room is served by another chat shard")
+    elif moderation_index.is_banned(room_id, user.id):
+        refusal = {"code": "banned", "message": "Banned from this chat"}
+    elif room_id in chat_manager.connections[websocket].rooms:
+        refusal = {"code": "already_subscribed", "message": "Already subscribed to this room"}
+    if refusal is None:
+        greeting = {}
+        
+        def build_greeting() -> dict:
+            greeting.update(room_replay.greeting(room_id, since, epoch))
+            return greeting
+        
+        if await chat_manager.subscribe(websocket, room_id, build_greeting):
+            await send_room_state(websocket, room_id, wire_format, greeting)
+            return
+        refusal = {"code": "too_many_rooms", "message": f"At most {chat_manager.max_subscriptions} rooms per connection"}
+    
+    await chat_manager.send_personal_message(dict(refusal, type="error", room_id=room_id), websocket)
+
+async def send_room_state(websocket: WebSocket, room_id: str, wire_format: str, greeting: dict):
+    """Send a client that just joined a room its history, members and top tippers"""
+    # Send recent chat history as a single frame, unless the missed events were replayed
+    if greeting.get("type") != "replay":
+        history_frame = await room_history.get_frame(room_id, wire_format)
+        await chat_manager.send_personal_payload(history_frame, websocket, "history")
+    
+    # Send current online users (only the count for large rooms)
+    await chat_manager.send_personal_message(room_presence.snapshot(room_id), websocket)
+    
+    # Send the room's top tippers; later changes arrive as throttled leaderboard frames
+    if room_id in tip_leaderboard.rooms:
+        await chat_manager.send_personal_message(tip_leaderboard.snapshot(room_id), websocket)
+
+async def receive_client_messages(websocket: WebSocket, user: User, on_message: Callable[[dict], Awaitable[None]]):
+    """Read frames from a client until it disconnects, passing each message to on_message"""
+    while True:
+        try:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            chat_manager.touch(websocket)
+            message_data = wire_codec.decode(frame["text"] if frame.get("text") is not None else frame["bytes"])
+            if message_data.get("type") == "pong":
+                heartbeat_monitor.on_pong()
+                continue
+            
+            if not rate_limiter.allow("ws_frame", user.id):
+                # Flooding client; drop the frame without replying
+                continue
+            await on_message(message_data)
+        
+        except WebSocketDisconnect:
+            break
+        except ValueError:
+            await chat_manager.send_personal_message({
+                "type": "error",
+                "message": "Invalid message format"
+            }, websocket)
+        except Exception as e:
+            logger.error(f"Error processing WebSocket message: {e}")
+            await chat_manager.send_personal_message({
+                "type": "error",
+                "message": "Error processing message"
+            }, websocket)
+
+async def dispatch_client_message(websocket: WebSocket, db: Any, user: User, room_id: Optional[str], message_data: dict):
+    """Dedupe and rate limit a client message, then hand it to its handler"""
+    message_type = message_data["type"]
+    if message_type == "private_message":
+        recipient_id = message_data.get("recipient_id")
+        if not recipient_id or not isinstance(recipient_id, str):
+            return
+    
+    # Messages sent with a client message id are acked with their outcome;
+    # a resent copy only gets that ack again
+    client_msg_id = message_data.get("client_msg_id")
+    if message_type not in ACKED_MESSAGE_TYPES or not valid_client_msg_id(client_msg_id):
+        client_msg_id = None
+    else:
+        seen = client_message_ids.claim(user.id, client_msg_id)
+        if seen is not None:
+            await send_ack(websocket, client_msg_id, seen)
+            return
+    
+    if not check_message_rate(user, room_id, message_data):
+        if client_msg_id:
+            client_message_ids.release(user.id, client_msg_id)
+            await send_ack(websocket, client_msg_id, {"status": "rejected", "reason": "rate_limited"})
+            return
+        await chat_manager.send_personal_message({
+            "type": "error",
+            "code": "rate_limited",
+            "message": "You are sending messages too quickly"
+        }, websocket)
+        return
+    
+    # Room work goes to the room's actor, which handles it in arrival
+    # order; the receive loop goes straight back to reading the next frame
+    accepted = True
+    if message_type == "chat_message":
+        accepted = submit_message(room_id, websocket, user, client_msg_id, handle_chat_message, db, user, room_id, message_data)
+    elif message_type == "private_message":
+        # Keyed by conversation so each one keeps its order
+        accepted = submit_message(
+            private_conversation_id(user.id, recipient_id), websocket, user, client_msg_id,
+            handle_private_message, db, user, message_data
+        )
+    elif message_type == "typing":
+        accepted = room_actors.submit(room_id, handle_typing_indicator, room_id, user, message_data)
+    elif message_type == "moderation_action":
+        accepted = room_actors.submit(room_id, handle_moderation_action, db, user, room_id, message_data)
+    elif message_type == "get_users":
+        # Only reads local state and answers this connection
+        await handle_users_request(websocket, room_id, message_data)
+    
+    if not accepted:
+        if client_msg_id:
+            client_message_ids.release(user.id, client_msg_id)
+            await send_ack(websocket, client_msg_id, {"status": "rejected", "reason": "room_busy"})
+            return
+        await chat_manager.send_personal_message({
+            "type": "error",
+            "code": "room_busy",
+            "message": "This room is too busy right now, please try again"
+        }, websocket)
+
+def submit_message(
+    actor_key: str,
+    websocket: WebSocket,
+    user: User,
+    client_msg_id: Optional[str],
+    handler: Callable[..., Awaitable[dict]],
+    *args
+) -> bool:
+    """Queue a message handler on an actor, acking the outcome if the client gave a message id"""
+    if client_msg_id is None:
+        return room_actors.submit(actor_key, handler, *args)
+    return room_actors.submit(actor_key, handle_acknowledged, websocket, user, client_msg_id, handler, *args)
+
+async def handle_acknowledged(websocket: WebSocket, user: User, client_msg_id: str, handler: Callable[..., Awaitable[dict]], *args):
+    """Run a message handler, then record its outcome for resent copies and ack it"""
+    outcome = await handler(*args)
+    if outcome["status"] == "failed":
+        # Nothing was stored, so a resend should be handled afresh
+        client_message_ids.release(user.id, client_msg_id)
+    else:
+        client_message_ids.complete(user.id, client_msg_id, outcome)
+    await send_ack(websocket, client_msg_id, outcome)
+
+async def send_ack(websocket: WebSocket, client_msg_id: str, outcome: dict):
+    await chat_manager.send_personal_message(dict(outcome, type="ack", client_msg_id=client_msg_id), websocket)
+
+def private_conversation_id(user_id: str, other_user_id: str) -> str:
+    """Room ID of the private conversation between two users, the same from either side"""
+    first, second = sorted([user_id, other_user_id])
+    return f"private_{first}_{second}"
+
+def check_message_rate(user: User, room_id: Optional[str], message_data: dict) -> bool:
+    """Apply the per-user and per-room limits for messages that fan out or cost a write"""
+    message_type = message_data.get("type")
+    if message_type == "chat_message":
+        if not rate_limiter.allow("chat_message", user.id):
+            return False
+        if message_data.get("tip_amount") and not rate_limiter.allow("tip", user.id):
+            return False
+        # Models and admins keep talking in busy rooms
+        return user.role != UserRole.VIEWER or rate_limiter.allow("chat_room", room_id)
+    if message_type == "private_message":
+        return rate_limiter.allow("private_message", user.id)
+    return True
+
+async def handle_chat_message(db: Any, user: User, room_id: str, message_data: dict) -> dict:
+    """Handle incoming chat message, returning its outcome for the sender's ack"""
+    transaction_id = None
     try:
         content = message_data.get("content", "").strip()
         if not content:
-            return
+            return {"status": "rejected", "reason": "empty"}
         
         # Check if user is banned or muted
-        current_time = datetime.utcnow()
-        moderation_check = await db.chat_moderation_actions.find_one({
-            "room_id": room_id,
-            "target_user_id": user.id,
-            "action_type": {"$in": ["mute", "ban"]},
-            "$or": [
-                {"expires_at": None},
-                {"expires_at": {"$gt": current_time}}
-            ]
-        })
-        
-        if moderation_check:
-            return  # User is muted/banned
+        if moderation_index.is_silenced(room_id, user.id):
+            return {"status": "rejected", "reason": "muted"}
         
         # Process tip messages
         tip_amount = None
@@ -177,13 +503,13 @@ async def handle_chat_message(db: Any, user: User, room_id: str, message_data: d
             tip_amount = int(message_data["tip_amount"])
             message_type = MessageType.TIP
             
-            # Verify user has enough tokens
-            viewer_profile = await db.viewer_profiles.find_one({"user_id": user.id})
-            if not viewer_profile or viewer_profile.get("token_balance", 0) < tip_amount:
-                return  # Insufficient tokens
-            
-            # Process tip transaction (similar to existing tip logic)
-            await process_tip_transaction(db, user.id, room_id, tip_amount, content)
+            # Public rooms are keyed by the model's profile id
+            try:
+                tip = await tip_service.tip(user.id, user.username, room_id, tip_amount, content, source="chat")
+            except TipError as e:
+                # Insufficient tokens or not a model's room
+                return {"status": "rejected", "reason": "tip_refused", "message": str(e)}
+            transaction_id = tip.transaction_id
         
         # Create chat message
         chat_message = ChatMessage(
@@ -196,9 +522,6 @@ async def handle_chat_message(db: Any, user: User, room_id: str, message_data: d
             tip_amount=tip_amount
         )
         
-        # Save to database
-        await db.chat_messages.insert_one(chat_message.model_dump(by_alias=True))
-        
         # Broadcast to room
         await chat_manager.broadcast_to_room(room_id, {
             "type": "chat_message",
@@ -215,23 +538,36 @@ async def handle_chat_message(db: Any, user: User, room_id: str, message_data: d
             }
         })
         
+        # Save to database in the next batch
+        chat_writer.enqueue(chat_message.model_dump(by_alias=True))
+        
         logger.info(f"Chat message from {user.username} in room {room_id}")
+        outcome = {"status": "accepted", "message_id": chat_message.id}
+        if transaction_id is not None:
+            outcome["transaction_id"] = transaction_id
+        return outcome
         
     except Exception as e:
         logger.error(f"Error handling chat message: {e}")
+        if transaction_id is not None:
+            # The tip is charged, so a resend must only be acked, never charged again
+            return {"status": "accepted", "transaction_id": transaction_id}
+        return {"status": "failed"}
 
-async def handle_private_message(db: Any, user: User, message_data: dict):
-    """Handle private message between users"""
+async def handle_private_message(db: Any, user: User, message_data: dict) -> dict:
+    """Handle private message between users, returning its outcome for the sender's ack"""
     try:
         recipient_id = message_data.get("recipient_id")
         content = message_data.get("content", "").strip()
         
         if not recipient_id or not content:
-            return
+            return {"status": "rejected", "reason": "empty"}
+        if recipient_id == user.id:
+            return {"status": "rejected", "reason": "self"}
         
         # Create private room ID (consistent for both users)
         room_participants = sorted([user.id, recipient_id])
-        private_room_id = f"private_{room_participants[0]}_{room_participants[1]}"
+        private_room_id = private_conversation_id(user.id, recipient_id)
         
         # Create/get private room
         private_room = await db.chat_rooms.find_one({"_id": private_room_id})
@@ -257,9 +593,13 @@ async def handle_private_message(db: Any, user: User, message_data: dict):
         # Save to database
         await db.chat_messages.insert_one(private_message.model_dump(by_alias=True))
         
+        # Count it as unread whether or not the recipient is online
+        unread_count = await chat_inbox.record_message(private_room_id, user, recipient_id, private_message)
+        
         # Send to recipient if online
         message_payload = {
             "type": "private_message",
+            "conversation_id": private_room_id,
             "message": {
                 "id": private_message.id,
                 "sender_id": user.id,
@@ -268,29 +608,54 @@ async def handle_private_message(db: Any, user: User, message_data: dict):
                 "created_at": private_message.created_at.isoformat()
             }
         }
+        if unread_count is not None:
+            message_payload["unread_count"] = unread_count
         
         await chat_manager.send_private_message(recipient_id, message_payload)
         
         logger.info(f"Private message from {user.username} to {recipient_id}")
+        return {"status": "accepted", "message_id": private_message.id}
         
     except Exception as e:
         logger.error(f"Error handling private message: {e}")
+        return {"status": "failed"}
 
 async def handle_typing_indicator(room_id: str, user: User, message_data: dict):
-    """Handle typing indicator"""
+    """Handle typing indicator; rooms receive aggregated, throttled typing frames"""
     try:
-        is_typing = message_data.get("is_typing", False)
-        
-        await chat_manager.broadcast_to_room(room_id, {
-            "type": "typing",
-            "user_id": user.id,
-            "username": user.username,
-            "is_typing": is_typing
-        })
+        is_typing = bool(message_data.get("is_typing", False))
+        await typing_aggregator.update(room_id, user.id, user.username, is_typing)
         
     except Exception as e:
         logger.error(f"Error handling typing indicator: {e}")
 
+async def handle_users_request(websocket: WebSocket, room_id: str, message_data: dict):
+    """Send one page of the room's member list"""
+    offset = message_data.get("offset", 0)
+    limit = message_data.get("limit", PRESENCE_PAGE_SIZE)
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        refusal = "offset must be a non-negative integer"
+    elif not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_PRESENCE_PAGE_SIZE:
+        refusal = f"limit must be an integer from 1 to {MAX_PRESENCE_PAGE_SIZE}"
+    else:
+        refusal = None
+    if refusal:
+        await chat_manager.send_personal_message({
+            "type": "error",
+            "code": "invalid_page",
+            "room_id": room_id,
+            "message": refusal
+        }, websocket)
+        return
+    
+    await chat_manager.send_personal_message({
+        "type": "room_users",
+        "room_id": room_id,
+        "offset": offset,
+        "users": room_presence.get_members(room_id, offset, limit),
+        "count": room_presence.count(room_id)
+    }, websocket)
+
 async def handle_moderation_action(db: Any, user: User, room_id: str, message_data: dict):
     """Handle chat moderation actions"""
     try:
@@ -334,33 +699,37 @@ async def handle_moderation_action(db: Any, user: User, room_id: str, message_da
         
         # Handle specific actions
         if action_type == "delete_message" and message_id:
-            await db.chat_messages.update_one(
-                {"_id": message_id},
-                {
-                    "$set": {
-                        "is_deleted": True,
-                        "deleted_by": user.id,
-                        "deleted_at": datetime.utcnow()
-                    }
-                }
-            )
+            deletion = {
+                "is_deleted": True,
+                "deleted_by": user.id,
+                "deleted_at": datetime.utcnow()
+            }
+            chat_writer.update_pending(message_id, deletion)
+            await db.chat_messages.update_one({"_id": message_id}, {"$set": deletion})
             
             # Broadcast message deletion
             await chat_manager.broadcast_to_room(room_id, {
                 "type": "message_deleted",
+                "room_id": room_id,
                 "message_id": message_id,
                 "deleted_by": user.username
             })
         
         elif action_type in ["mute", "ban", "kick"]:
+            # Silence the user on this worker before the bus echoes the action
+            # back, so their next message cannot slip past the index
+            moderation_index.apply(action_type, room_id, target_user_id, expires_at)
+            
             # Broadcast moderation action
             await chat_manager.broadcast_to_room(room_id, {
                 "type": "moderation_action",
+                "room_id": room_id,
                 "action_type": action_type,
                 "target_user_id": target_user_id,
                 "moderator": user.username,
                 "reason": reason,
-                "duration_minutes": duration_minutes
+                "duration_minutes": duration_minutes,
+                "expires_at": expires_at.isoformat() if expires_at else None
             })
         
         logger.info(f"Moderation action: {action_type} by {user.username} on {target_user_id}")
@@ -368,77 +737,6 @@ async def handle_moderation_action(db: Any, user: User, room_id: str, message_da
     except Exception as e:
         logger.error(f"Error handling moderation action: {e}")
 
-async def process_tip_transaction(db: Any, user_id: str, room_id: str, tip_amount: int, message: str):
-    """Process tip transaction (similar to existing tip logic)"""
-    try:
-        from models import Transaction, TransactionType, TransactionStatus
-        
-        # Get model profile from room_id (assuming room_id is model_id for public rooms)
-        model_profile = await db.model_profiles.find_one({"_id": room_id})
-        if not model_profile:
-            return
-        
-        # Deduct tokens from viewer
-        await db.viewer_profiles.update_one(
-            {"user_id": user_id},
-            {
-                "$inc": {
-                    "token_balance": -tip_amount,
-                    "total_spent": tip_amount
-                },
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        # Add earnings to model (50% platform fee)
-        platform_fee = tip_amount * 0.5
-        model_earnings = tip_amount - platform_fee
-        
-        await db.model_profiles.update_one(
-            {"_id": room_id},
-            {
-                "$inc": {
-                    "total_earnings": model_earnings,
-                    "available_balance": model_earnings
-                },
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-        
-        # Create transaction records
-        viewer_transaction = Transaction(
-            user_id=user_id,
-            transaction_type=TransactionType.TIP,
-            amount=tip_amount,
-            tokens=tip_amount,
-            status=TransactionStatus.COMPLETED,
-            model_id=room_id,
-            description=f"Chat tip: {message[:50]}{'...' if len(message) > 50 else ''}",
-            metadata={"tip_message": message}
-        )
-        
-        model_transaction = Transaction(
-            user_id=model_profile["user_id"],
-            transaction_type=TransactionType.EARNING,
-            amount=model_earnings,
-            tokens=int(model_earnings),
-            status=TransactionStatus.COMPLETED,
-            description=f"Chat tip earnings: {message[:50]}{'...' if len(message) > 50 else ''}",
-            metadata={
-                "tip_message": message,
-                "original_amount": tip_amount,
-                "platform_fee": platform_fee
-            }
-        )
-        
-        await db.transactions.insert_many([
-            viewer_transaction.model_dump(by_alias=True),
-            model_transaction.model_dump(by_alias=True)
-        ])
-        
-    except Exception as e:
-        logger.error(f"Error processing tip transaction: {e}")
-
 # REST API Endpoints for Chat
 
 @router.get("/rooms", response_model=List[ChatRoomResponse])
@@ -458,7 +756,7 @@ async def get_chat_rooms(
         rooms = []
         for model in live_models:
             room_id = model["_id"]
-            online_count = chat_manager.get_online_users_count(room_id)
+            online_count = room_presence.count(room_id)
             
             rooms.append(ChatRoomResponse(
                 id=room_id,
@@ -500,6 +798,16 @@ async def get_chat_history(
         # Get messages
         messages = await db.chat_messages.find(query).sort("created_at", -1).limit(limit).to_list(length=None)
         
+        # Include the newest messages that have not been flushed to the database yet
+        if not before:
+            stored_ids = {msg["_id"] for msg in messages}
+            pending = [
+                msg for msg in chat_writer.pending_documents(room_id)
+                if not msg["is_deleted"] and msg["_id"] not in stored_ids
+            ]
+            if pending:
+                messages = sorted(messages + pending, key=lambda msg: msg["created_at"], reverse=True)[:limit]
+        
         # Convert to response format
         result = []
         for msg in reversed(messages):
@@ -525,19 +833,68 @@ async def get_chat_history(
             detail="Failed to get chat history"
         )
 
+@router.get("/conversations", response_model=InboxResponse)
+async def get_conversations(
+    limit: int = Query(default=50, le=100),
+    before: Optional[str] = Query(default=None),
+    current_user: User = Depends(get_current_user)
+):
+    """Get the current user's private conversations, most recent first, with unread counts"""
+    try:
+        before_dt = datetime.fromisoformat(before.replace('Z', '+00:00')) if before else None
+        conversations, unread_count = await chat_inbox.list_conversations(current_user.id, limit, before_dt)
+        
+        return InboxResponse(
+            unread_count=unread_count,
+            conversations=[ConversationResponse(**conversation) for conversation in conversations]
+        )
+    
+    except Exception as e:
+        logger.error(f"Error getting conversations: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get conversations"
+        )
+
+@router.post("/conversations/read")
+async def mark_conversations_read(
+    request: MarkReadRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Mark some or all of the current user's private conversations read"""
+    if request.conversation_ids is not None and len(request.conversation_ids) > MAX_MARK_READ_CONVERSATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_MARK_READ_CONVERSATIONS} conversations can be marked read at once"
+        )
+    
+    try:
+        marked, unread_count = await chat_inbox.mark_read(current_user.id, request.conversation_ids)
+        return {"marked": marked, "unread_count": unread_count}
+    
+    except Exception as e:
+        logger.error(f"Error marking conversations read: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to mark conversations read"
+        )
+
 @router.get("/rooms/{room_id}/users")
 async def get_room_users(
     room_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(PRESENCE_PAGE_SIZE, ge=1, le=MAX_PRESENCE_PAGE_SIZE),
     current_user: User = Depends(get_current_user)
 ):
-    """Get online users in a chat room"""
+    """Get one page of online users in a chat room"""
     try:
-        online_users = chat_manager.get_room_users(room_id)
+        online_users = room_presence.get_members(room_id, offset, limit)
         return {
             "success": True,
             "room_id": room_id,
             "online_users": online_users,
-            "count": len(online_users)
+            "offset": offset,
+            "count": room_presence.count(room_id)
         }
         
     except Exception as e:
@@ -547,6 +904,33 @@ async def get_room_users(
             detail="Failed to get room users"
         )
 
+@router.get("/rooms/{room_id}/shard")
+async def get_room_shard(
+    room_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the chat shard that serves a room, for clients that connect to it directly"""
+    return {
+        "success": True,
+        **shard_router.describe(room_id)
+    }
+
+@router.get("/rooms/{room_id}/leaderboard")
+async def get_room_leaderboard(
+    room_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: User = Depends(get_current_user)
+):
+    """Get a room's top tippers for the current session, today and all time"""
+    leaderboard = tip_leaderboard.snapshot(room_id, limit)
+    return {
+        "success": True,
+        "room_id": room_id,
+        "session": leaderboard["session"],
+        "day": leaderboard["day"],
+        "all_time": leaderboard["all_time"]
+    }
+
 @router.delete("/messages/{message_id}")
 async def delete_message(
     message_id: str,
@@ -556,8 +940,8 @@ async def delete_message(
     try:
         db = await get_database()
         
-        # Get message
-        message = await db.chat_messages.find_one({"_id": message_id})
+        # Get message (it may still be waiting to be written)
+        message = await db.chat_messages.find_one({"_id": message_id}) or chat_writer.find_pending(message_id)
         if not message:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -584,20 +968,18 @@ async def delete_message(
             )
         
         # Mark message as deleted
-        await db.chat_messages.update_one(
-            {"_id": message_id},
-            {
-                "$set": {
-                    "is_deleted": True,
-                    "deleted_by": current_user.id,
-                    "deleted_at": datetime.utcnow()
-                }
-            }
-        )
+        deletion = {
+            "is_deleted": True,
+            "deleted_by": current_user.id,
+            "deleted_at": datetime.utcnow()
+        }
+        chat_writer.update_pending(message_id, deletion)
+        await db.chat_messages.update_one({"_id": message_id}, {"$set": deletion})
         
         # Broadcast deletion
         await chat_manager.broadcast_to_room(message["room_id"], {
             "type": "message_deleted",
+            "room_id": message["room_id"],
             "message_id": message_id,
             "deleted_by": current_user.username
         })
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Room-affinity sharding for chat
+
+Rooms are spread over a fixed set of chat shard processes with a
+consistent-hash ring, so every connection to a room lands on the same
+process. That process is the only one handling the room's events and keeps
+its history, replay window and moderation state hot. Any process that gets
+a WebSocket for a room it does not own, such as the front process, proxies
+it to the owning shard. Clients that can reach the shards directly can ask
+/api/chat/rooms/{room_id}/shard and connect there instead.
+
+Shards run with CHAT_BUS_BACKEND=sharded, so room traffic stays inside the
+owning shard and only per-user events and presence cross between processes.
+
+Run a front process and N shards locally:
+
+    python chat_sharding.py --shards 4 --front-port 8001 --base-port 9001
+    python chat_sharding.py --shards 8 --pin-cpus
+"""
+
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import websockets
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+# Comma-separated base URLs of the chat shards, e.g. http://127.0.0.1:9001,http://127.0.0.1:9002
+CHAT_SHARDS = [url.strip().rstrip("/") for url in os.getenv("CHAT_SHARDS", "").split(",") if url.strip()]
+# Position of this process in CHAT_SHARDS; unset on a process that owns no rooms
+CHAT_SHARD_INDEX = os.getenv("CHAT_SHARD_INDEX")
+CHAT_SHARD_VNODES = int(os.getenv("CHAT_SHARD_VNODES", 160))
+CHAT_SHARD_CONNECT_TIMEOUT = float(os.getenv("CHAT_SHARD_CONNECT_TIMEOUT", 5))
+
+# Close codes sent to proxied clients
+SHARD_UNAVAILABLE_CLOSE_CODE = 1013
+SHARD_REJECTED_CLOSE_CODE = 4003
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes
+
+    Adding or removing a node only moves the keys next to its points on
+    the ring, about 1/N of them.
+    """
+    
+    def __init__(self, nodes: List[str], vnodes: int = CHAT_SHARD_VNODES):
+        self.nodes = list(nodes)
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for point, node in sorted(
+            (self._hash(f"{node}#{replica}"), node) for node in self.nodes for replica in range(vnodes)
+        ):
+            self._points.append(point)
+            self._owners.append(node)
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+    
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise ValueError("Hash ring has no nodes")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class ShardRouter:
+    """Maps rooms to shards and proxies WebSockets for rooms owned elsewhere"""
+    
+    def __init__(
+        self,
+        shards: List[str] = CHAT_SHARDS,
+        shard_index: Optional[str] = CHAT_SHARD_INDEX,
+        vnodes: int = CHAT_SHARD_VNODES,
+        connect_timeout: float = CHAT_SHARD_CONNECT_TIMEOUT
+    ):
+        self.shards = shards
+        self.index = int(shard_index) if shard_index not in (None, "") else None
+        self.connect_timeout = connect_timeout
+        self.ring = HashRing(shards, vnodes)
+        self._owner_index: Dict[str, int] = {url: index for index, url in enumerate(shards)}
+        
+        # Metrics
+        self.proxied = 0
+        self.active = 0
+        self.failed = 0
+        self.frames_to_shard = 0
+        self.frames_to_client = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.shards)
+    
+    def owner(self, room_id: str) -> int:
+        """Index of the shard that owns a room"""
+        return self._owner_index[self.ring.node_for(room_id)]
+    
+    def owns(self, room_id: str) -> bool:
+        """Whether this process serves a room's connections"""
+        return not self.enabled or self.owner(room_id) == self.index
+    
+    def describe(self, room_id: str) -> dict:
+        if not self.enabled:
+            return {"room_id": room_id, "sharded": False}
+        owner = self.owner(room_id)
+        return {
+            "room_id": room_id,
+            "sharded": True,
+            "shard_index": owner,
+            "shard_url": self.shards[owner],
+            "shards": len(self.shards)
+        }
+    
+    async def proxy(self, websocket: WebSocket, room_id: str):
+        """Relay a client WebSocket to the shard that owns its room until either side closes"""
+        owner_url = self.shards[self.owner(room_id)]
+        upstream_url = owner_url.replace("http", "ws", 1) + websocket.url.path
+        if websocket.url.query:
+            upstream_url += f"?{websocket.url.query}"
+        
+        try:
+            upstream = await websockets.connect(
+                upstream_url,
+                subprotocols=websocket.scope.get("subprotocols") or None,
+                open_timeout=self.connect_timeout,
+                ping_interval=None,
+                max_size=None
+            )
+        except websockets.InvalidStatus:
+            # The shard turned the handshake down, e.g. failed authentication
+            await websocket.close(code=SHARD_REJECTED_CLOSE_CODE, reason="Rejected by chat shard")
+            return
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error connecting to chat shard {owner_url} for room {room_id}: {e}")
+            await websocket.close(code=SHARD_UNAVAILABLE_CLOSE_CODE, reason="Chat shard unavailable")
+            return
+        
+        await websocket.accept(subprotocol=upstream.subprotocol)
+        self.proxied += 1
+        self.active += 1
+        to_shard = asyncio.create_task(self._client_to_shard(websocket, upstream))
+        to_client = asyncio.create_task(self._shard_to_client(websocket, upstream))
+        try:
+            await asyncio.wait((to_shard, to_client), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (to_shard, to_client):
+                task.cancel()
+            await asyncio.gather(to_shard, to_client, return_exceptions=True)
+            self.active -= 1
+            
+            if upstream.close_code is not None:
+                # The shard ended the session; pass its close code on (kick, ban, slow consumer...)
+                try:
+                    await websocket.close(code=upstream.close_code, reason=upstream.close_reason or "")
+                except Exception:
+                    pass
+            else:
+                await upstream.close()
+    
+    async def _client_to_shard(self, websocket: WebSocket, upstream):
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                return
+            await upstream.send(frame["text"] if frame.get("text") is not None else frame["bytes"])
+            self.frames_to_shard += 1
+    
+    async def _shard_to_client(self, websocket: WebSocket, upstream):
+        async for frame in upstream:
+            if isinstance(frame, bytes):
+                await websocket.send_bytes(frame)
+            else:
+                await websocket.send_text(frame)
+            self.frames_to_client += 1
+    
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "shards": len(self.shards),
+            "shard_index": self.index,
+            "proxied": self.proxied,
+            "active": self.active,
+            "failed": self.failed,
+            "frames_to_shard": self.frames_to_shard,
+            "frames_to_client": self.frames_to_client
+        }
+
+
+# Global shard router instance
+shard_router = ShardRouter()
+
+
+def launch(shards: int, host: str, front_port: int, base_port: int, pin_cpus: bool) -> List[subprocess.Popen]:
+    """Start one uvicorn process per shard plus a front process that owns no rooms"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    shard_urls = [f"http://{host}:{base_port + index}" for index in range(shards)]
+    env = dict(os.environ)
+    env["CHAT_SHARDS"] = ",".join(shard_urls)
+    env["CHAT_BUS_BACKEND"] = "sharded"
+    env.pop("CHAT_SHARD_INDEX", None)
+    
+    processes = []
+    cpus = sorted(os.sched_getaffinity(0)) if pin_cpus and hasattr(os, "sched_getaffinity") else []
+    for index in range(shards):
+        shard_env = dict(env, CHAT_SHARD_INDEX=str(index))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", host, "--port", str(base_port + index)],
+            cwd=backend_dir,
+            env=shard_env
+        )
+        if cpus:
+            # One hot process per core keeps each room's state in that core's caches
+            os.sched_setaffinity(process.pid, {cpus[index % len(cpus)]})
+        processes.append(process)
+        logger.info(f"Chat shard {index} on {shard_urls[index]} (pid {process.pid})")
+    
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", host, "--port", str(front_port)],
+        cwd=backend_dir,
+        env=env
+    ))
+    logger.info(f"Front process on http://{host}:{front_port} proxying to {shards} shards")
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API as a front process and N room-sharded chat processes")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--front-port", type=int, default=8001)
+    parser.add_argument("--base-port", type=int, default=9001, help="Shard i listens on base port + i")
+    parser.add_argument("--pin-cpus", action="store_true", help="Pin each shard to its own CPU (Linux)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    
+    processes = launch(args.shards, args.host, args.front_port, args.base_port, args.pin_cpus)
+    stopping = False
+    
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+    
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while not stopping:
+            exited = [process for process in processes if process.poll() is not None]
+            if exited:
+                logger.error(f"Process {exited[0].pid} exited with code {exited[0].returncode}, stopping all")
+                break
+            time.sleep(0.5)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
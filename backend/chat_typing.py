@@ -0,0 +1,181 @@
+from typing import Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+from websocket_manager import chat_manager
+from chat_presence import room_presence
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+TYPING_FLUSH_SECONDS = float(os.getenv("CHAT_TYPING_FLUSH_SECONDS", 0.3))
+# A user's "still typing" events are forwarded at most this often
+TYPING_USER_INTERVAL_SECONDS = float(os.getenv("CHAT_TYPING_USER_INTERVAL_SECONDS", 1.5))
+# Typing state lapses if the client stops refreshing it
+TYPING_TTL_SECONDS = float(os.getenv("CHAT_TYPING_TTL_SECONDS", 5))
+# Rooms with more members than this get no typing indicators at all
+TYPING_MAX_ROOM_SIZE = int(os.getenv("CHAT_TYPING_MAX_ROOM_SIZE", 500))
+TYPING_MAX_NAMES = 3
+
+
+class TypingAggregator:
+    """Per-room typing state sent as one throttled frame
+
+    Typing events are rate limited per user on the worker that receives
+    them and shared with the other workers over the room event bus. Every
+    worker keeps the typing state of each room and, at most once per flush
+    interval, sends its own connections a single frame with the number of
+    people typing and a few of their names, only when that has changed.
+    """
+    
+    def __init__(
+        self,
+        flush_interval: float = TYPING_FLUSH_SECONDS,
+        user_interval: float = TYPING_USER_INTERVAL_SECONDS,
+        ttl: float = TYPING_TTL_SECONDS,
+        max_room_size: int = TYPING_MAX_ROOM_SIZE
+    ):
+        self.flush_interval = flush_interval
+        self.user_interval = user_interval
+        self.ttl = ttl
+        self.max_room_size = max_room_size
+        # room_id -> user_id -> (username, expires at)
+        self.typing: Dict[str, Dict[str, Tuple[str, float]]] = {}
+        # (room_id, user_id) -> when "typing" was last forwarded, for this worker's users
+        self._last_forwarded: Dict[Tuple[str, str], float] = {}
+        # room_id -> last frame sent, to skip unchanged frames
+        self._last_sent: Dict[str, tuple] = {}
+        self._dirty = set()
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.received = 0
+        self.rate_limited = 0
+        self.skipped_large_rooms = 0
+        self.frames_sent = 0
+        
+        chat_manager.add_bus_handler("typing", self._on_typing_event)
+    
+    async def start(self):
+        """Start the periodic typing frame flush"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def update(self, room_id: str, user_id: str, username: str, is_typing: bool):
+        """Handle a typing event from a local connection"""
+        self.received += 1
+        if room_presence.count(room_id) > self.max_room_size:
+            self.skipped_large_rooms += 1
+            return
+        
+        key = (room_id, user_id)
+        now = time.monotonic()
+        forwarded_at = self._last_forwarded.get(key)
+        if is_typing:
+            if forwarded_at is not None and now - forwarded_at < self.user_interval:
+                # Still typing and not yet due for a refresh
+                self.rate_limited += 1
+                return
+            self._last_forwarded[key] = now
+        else:
+            if forwarded_at is None:
+                # Other workers never heard this user was typing
+                self.rate_limited += 1
+                return
+            del self._last_forwarded[key]
+        
+        await chat_manager.publish({
+            "kind": "typing",
+            "room_id": room_id,
+            "user_id": user_id,
+            "username": username,
+            "is_typing": is_typing
+        })
+    
+    async def _on_typing_event(self, event: dict):
+        room_id = event["room_id"]
+        room = self.typing.setdefault(room_id, {})
+        if event["is_typing"]:
+            room[event["user_id"]] = (event["username"], time.monotonic() + self.ttl)
+        else:
+            room.pop(event["user_id"], None)
+        if not room:
+            del self.typing[room_id]
+        self._dirty.add(room_id)
+    
+    def _expire(self):
+        now = time.monotonic()
+        for room_id in list(self.typing):
+            room = self.typing[room_id]
+            expired = [user_id for user_id, (_, expires_at) in room.items() if expires_at <= now]
+            for user_id in expired:
+                del room[user_id]
+            if expired:
+                self._dirty.add(room_id)
+            if not room:
+                del self.typing[room_id]
+        
+        stale = now - self.ttl
+        for key in [key for key, forwarded_at in self._last_forwarded.items() if forwarded_at <= stale]:
+            del self._last_forwarded[key]
+    
+    async def flush(self):
+        """Send a typing frame to each room whose typing state changed"""
+        self._expire()
+        dirty, self._dirty = self._dirty, set()
+        for room_id in dirty:
+            room = self.typing.get(room_id, {})
+            users = [
+                {"user_id": user_id, "username": username}
+                for user_id, (username, _) in list(room.items())[:TYPING_MAX_NAMES]
+            ]
+            state = (len(room), tuple(user["user_id"] for user in users))
+            if self._last_sent.get(room_id, (0, ())) == state:
+                continue
+            if room:
+                self._last_sent[room_id] = state
+            else:
+                self._last_sent.pop(room_id, None)
+            
+            if room_id not in chat_manager.room_connections or room_presence.count(room_id) > self.max_room_size:
+                continue
+            await chat_manager.send_to_local_room(room_id, {
+                "type": "typing",
+                "room_id": room_id,
+                "count": len(room),
+                "users": users
+            })
+            self.frames_sent += 1
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing typing indicators: {e}")
+    
+    def get_stats(self) -> dict:
+        return {
+            "rooms_typing": len(self.typing),
+            "users_typing": sum(len(room) for room in self.typing.values()),
+            "received": self.received,
+            "rate_limited": self.rate_limited,
+            "skipped_large_rooms": self.skipped_large_rooms,
+            "frames_sent": self.frames_sent
+        }
+
+
+# Global typing aggregator instance
+typing_aggregator = TypingAggregator()
@@ -25,6 +25,8 @@ system_settings_collection = database.system_settings
 chat_messages_collection = database.chat_messages
 chat_rooms_collection = database.chat_rooms
 chat_moderation_collection = database.chat_moderation_actions
+chat_conversations_collection = database.chat_conversations
+chat_unread_collection = database.chat_unread
 
 async def get_database():
     """Get database instance"""
@@ -1,12 +1,16 @@
 import asyncio
+import json
 from database import (
     users_collection, 
     viewer_profiles_collection, 
     model_profiles_collection,
+    transactions_collection,
     system_settings_collection,
+    chat_conversations_collection,
     client
 )
 from models import User, UserRole, ViewerProfile, ModelProfile, SystemSettings
+from rate_limit import DEFAULT_LIMITS, SETTINGS_PREFIX
 from auth import hash_password
 import logging
 from datetime import datetime
@@ -31,6 +35,12 @@ async def create_indexes():
         await model_profiles_collection.create_index([("is_live", 1)])
         await model_profiles_collection.create_index([("is_available", 1)])
         
+        # Transaction indexes; tips by model back the leaderboard rebuild
+        await transactions_collection.create_index([("model_id", 1), ("transaction_type", 1)])
+        
+        # Private conversation summaries; a user's inbox is read newest first
+        await chat_conversations_collection.create_index([("user_id", 1), ("last_message_at", -1)])
+        
         # System settings indexes
         await system_settings_collection.create_index([("key", 1)], unique=True)
         
@@ -77,6 +87,14 @@ async def init_system_settings():
             }
         ]
         
+        # Rate limits, as tokens refilled per second and bucket size
+        for name, limit in DEFAULT_LIMITS.items():
+            default_settings.append({
+                "key": f"{SETTINGS_PREFIX}{name}",
+                "value": json.dumps({"rate": limit["rate"], "burst": limit["burst"]}),
+                "description": limit["description"]
+            })
+        
         for setting_data in default_settings:
             existing = await system_settings_collection.find_one({"key": setting_data["key"]})
             
@@ -2,13 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, status
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
-import uuid
 import logging
 import os
 
 from auth import get_current_user
 from database import get_database
-from models import User, UserRole, Transaction, TransactionType, TransactionStatus, ModelProfile, Withdrawal, WithdrawalStatus
+from models import User, UserRole, ModelProfile, Withdrawal, WithdrawalStatus
+from rate_limit import rate_limited
+from tipping import tip_service, PLATFORM_REVENUE_SHARE, InsufficientTokens, InvalidTipAmount, ModelNotFound, ViewerProfileNotFound
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +17,6 @@ router = APIRouter()
 
 # Configuration from environment
 MIN_WITHDRAWAL_AMOUNT = float(os.getenv("MIN_WITHDRAWAL_AMOUNT", 20000))
-PLATFORM_REVENUE_SHARE = float(os.getenv("PLATFORM_REVENUE_SHARE", 50))
 
 # Request/Response Models
 class TipRequest(BaseModel):
@@ -56,104 +56,16 @@ class TipResponse(BaseModel):
 @router.post("/tip", response_model=TipResponse)
 async def send_tip(
     request: TipRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(rate_limited("tip"))
 ):
     """Send tip to a model"""
     try:
-        db = await get_database()
-        
-        # Verify user has viewer role and enough tokens
-        viewer_profile = await db.viewer_profiles.find_one({"user_id": current_user.id})
-        if not viewer_profile:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Viewer profile not found"
-            )
-        
-        current_balance = viewer_profile.get('token_balance', 0)
-        if current_balance < request.tokens:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Insufficient tokens. You have {current_balance} tokens, need {request.tokens}"
-            )
-        
-        # Verify model exists and is active
-        model_profile = await db.model_profiles.find_one({"_id": request.model_id})
-        if not model_profile:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Model not found"
-            )
-        
-        # Calculate earnings (model gets their share, platform takes commission)
-        model_earnings = request.tokens * (100 - PLATFORM_REVENUE_SHARE) / 100
-        platform_fee = request.tokens * PLATFORM_REVENUE_SHARE / 100
-        
-        # Create transaction records
-        transaction_id = str(uuid.uuid4())
-        
-        # Tip transaction (viewer perspective)
-        tip_transaction = Transaction(
-            id=transaction_id,
-            user_id=current_user.id,
-            transaction_type=TransactionType.TIP,
-            amount=request.tokens,  # Store as token amount
-            tokens=request.tokens,
-            status=TransactionStatus.COMPLETED,
-            model_id=request.model_id,
-            description=f"Tip to {model_profile.get('display_name', 'Model')}",
-            metadata={
-                "message": request.message,
-                "model_earnings": model_earnings,
-                "platform_fee": platform_fee
-            }
-        )
-        
-        # Earning transaction (model perspective)
-        earning_transaction = Transaction(
-            id=str(uuid.uuid4()),
-            user_id=model_profile["user_id"],
-            transaction_type=TransactionType.EARNING,
-            amount=model_earnings,  # Model's earnings in tokens
-            tokens=int(model_earnings),
-            status=TransactionStatus.COMPLETED,
-            description=f"Tip from {current_user.username}",
-            metadata={
-                "original_tip": request.tokens,
-                "platform_fee": platform_fee,
-                "tip_transaction_id": transaction_id
-            }
-        )
-        
-        # Start database transaction
-        await db.transactions.insert_many([
-            tip_transaction.model_dump(by_alias=True),
-            earning_transaction.model_dump(by_alias=True)
-        ])
-        
-        # Update viewer balance
-        new_balance = current_balance - request.tokens
-        await db.viewer_profiles.update_one(
-            {"user_id": current_user.id},
-            {
-                "$set": {
-                    "token_balance": new_balance,
-                    "updated_at": datetime.utcnow()
-                },
-                "$inc": {"total_spent": request.tokens}
-            }
-        )
-        
-        # Update model earnings
-        await db.model_profiles.update_one(
-            {"_id": request.model_id},
-            {
-                "$inc": {
-                    "total_earnings": model_earnings,
-                    "available_balance": model_earnings
-                },
-                "$set": {"updated_at": datetime.utcnow()}
-            }
+        result = await tip_service.tip(
+            current_user.id,
+            current_user.username,
+            request.model_id,
+            request.tokens,
+            request.message
         )
         
         logger.info(f"Tip successful: {request.tokens} tokens from {current_user.id} to {request.model_id}")
@@ -161,12 +73,20 @@ async def send_tip(
         return TipResponse(
             success=True,
             message=f"Successfully sent {request.tokens} tokens tip!",
-            transaction_id=transaction_id,
-            remaining_balance=new_balance
+            transaction_id=result.transaction_id,
+            remaining_balance=result.remaining_balance
         )
         
-    except HTTPException:
-        raise
+    except (ViewerProfileNotFound, ModelNotFound) as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except (InsufficientTokens, InvalidTipAmount) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error processing tip: {e}")
         raise HTTPException(
@@ -0,0 +1,195 @@
+from fastapi import HTTPException, status, Depends
+from typing import Dict, Optional
+from collections import defaultdict
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+
+from auth import get_current_user
+from database import get_database
+from models import User
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+RATE_LIMIT_REFRESH_SECONDS = float(os.getenv("RATE_LIMIT_REFRESH_SECONDS", 60))
+
+# System settings whose key starts with this override a limit, e.g.
+# key "rate_limit.chat_message", value '{"rate": 2, "burst": 10}'
+SETTINGS_PREFIX = "rate_limit."
+
+# Default limits: tokens refilled per second and bucket size
+DEFAULT_LIMITS = {
+    "chat_message": {"rate": 2, "burst": 10, "description": "Chat messages per user"},
+    "chat_room": {"rate": 50, "burst": 100, "description": "Viewer chat messages per room"},
+    "private_message": {"rate": 1, "burst": 5, "description": "Private messages per user"},
+    "ws_frame": {"rate": 20, "burst": 40, "description": "WebSocket frames of any type per user"},
+    "token_purchase": {"rate": 0.1, "burst": 3, "description": "Token purchase requests per user"},
+    "tip": {"rate": 2, "burst": 5, "description": "Tips per user"},
+    "webrtc_signal": {"rate": 20, "burst": 50, "description": "WebRTC signaling requests per user"}
+}
+
+
+class RateLimit:
+    """Refill rate in tokens per second and bucket capacity"""
+    
+    __slots__ = ("rate", "burst")
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+    
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """In-memory token-bucket rate limiter with named limits
+
+    Each limit keeps one bucket per key (a user or room id). Buckets are
+    created full and dropped again once they have refilled, so only
+    recently active keys cost memory. Limits default to DEFAULT_LIMITS and
+    can be overridden through system settings; they are re-read
+    periodically and whenever an admin changes a rate_limit setting.
+    Limits are per worker process.
+    """
+    
+    def __init__(self, refresh_interval: float = RATE_LIMIT_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.limits: Dict[str, RateLimit] = {
+            name: RateLimit(limit["rate"], limit["burst"]) for name, limit in DEFAULT_LIMITS.items()
+        }
+        self.buckets: Dict[str, Dict[str, TokenBucket]] = defaultdict(dict)
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metrics
+        self.allowed: Dict[str, int] = defaultdict(int)
+        self.throttled: Dict[str, int] = defaultdict(int)
+    
+    async def start(self):
+        """Load configured limits and start the refresh loop"""
+        await self.load_settings()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def load_settings(self):
+        """Apply rate_limit.* system settings over the defaults"""
+        try:
+            db = await get_database()
+            settings = await db.system_settings.find({
+                "key": {"$regex": f"^{re.escape(SETTINGS_PREFIX)}"}
+            }).to_list(length=None)
+        except Exception as e:
+            logger.error(f"Error loading rate limit settings: {e}")
+            return
+        
+        limits = {
+            name: RateLimit(limit["rate"], limit["burst"]) for name, limit in DEFAULT_LIMITS.items()
+        }
+        for setting in settings:
+            name = setting["key"][len(SETTINGS_PREFIX):]
+            try:
+                value = json.loads(setting["value"])
+                limits[name] = RateLimit(float(value["rate"]), float(value["burst"]))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Invalid rate limit setting {setting['key']}: {e}")
+        self.limits = limits
+    
+    def allow(self, name: str, key: str, cost: float = 1) -> bool:
+        """Take tokens from a key's bucket, returning False if it is throttled"""
+        limit = self.limits.get(name)
+        if limit is None:
+            return True
+        
+        now = time.monotonic()
+        bucket = self.buckets[name].get(key)
+        if bucket is None:
+            bucket = TokenBucket(limit.burst, now)
+            self.buckets[name][key] = bucket
+        else:
+            bucket.tokens = min(limit.burst, bucket.tokens + (now - bucket.updated) * limit.rate)
+            bucket.updated = now
+        
+        if bucket.tokens < cost:
+            self.throttled[name] += 1
+            return False
+        
+        bucket.tokens -= cost
+        self.allowed[name] += 1
+        return True
+    
+    def retry_after(self, name: str, key: str, cost: float = 1) -> int:
+        """Whole seconds until a throttled key has enough tokens again"""
+        limit = self.limits.get(name)
+        bucket = self.buckets[name].get(key)
+        if limit is None or bucket is None or limit.rate <= 0:
+            return 1
+        return max(1, math.ceil((cost - bucket.tokens) / limit.rate))
+    
+    def prune(self):
+        """Drop buckets that have refilled completely; a new bucket starts full anyway"""
+        now = time.monotonic()
+        for name, buckets in self.buckets.items():
+            limit = self.limits.get(name)
+            if limit is None:
+                buckets.clear()
+                continue
+            full = [
+                key for key, bucket in buckets.items()
+                if bucket.tokens + (now - bucket.updated) * limit.rate >= limit.burst
+            ]
+            for key in full:
+                del buckets[key]
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            self.prune()
+            await self.load_settings()
+    
+    def get_stats(self) -> dict:
+        return {
+            name: {
+                "rate": limit.rate,
+                "burst": limit.burst,
+                "active_buckets": len(self.buckets.get(name, {})),
+                "allowed": self.allowed.get(name, 0),
+                "throttled": self.throttled.get(name, 0)
+            }
+            for name, limit in self.limits.items()
+        }
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
+
+
+def rate_limited(name: str):
+    """Dependency that authenticates the user and applies a per-user limit"""
+    async def dependency(current_user: User = Depends(get_current_user)) -> User:
+        if not rate_limiter.allow(name, current_user.id):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(rate_limiter.retry_after(name, current_user.id))}
+            )
+        return current_user
+    return dependency
@@ -0,0 +1,97 @@
+from typing import Deque, Optional
+from collections import deque
+import asyncio
+import logging
+import os
+import resource
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", 0.1))
+# Samples kept for the percentiles, one per interval
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", 600))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of a list of numbers; 0 when empty"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return max_rss_bytes()
+
+
+def max_rss_bytes() -> int:
+    """Peak resident set size of this process"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class RuntimeMonitor:
+    """Event loop lag and memory of this worker process
+
+    A task sleeps for a fixed interval and records how much later than
+    asked it woke up. Anything that blocks the loop, such as a slow encode
+    or a synchronous call, shows up as lag, and delays every connection on
+    this worker by the same amount.
+    """
+    
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS, window: int = LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Start sampling event loop lag"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+    
+    def get_stats(self) -> dict:
+        samples = list(self.samples)
+        return {
+            "pid": os.getpid(),
+            "rss_bytes": rss_bytes(),
+            "max_rss_bytes": max_rss_bytes(),
+            "loop_lag_ms": {
+                "current": round(samples[-1] * 1000, 2) if samples else 0.0,
+                "p50": round(percentile(samples, 0.5) * 1000, 2),
+                "p99": round(percentile(samples, 0.99) * 1000, 2),
+                "window_max": round(max(samples, default=0.0) * 1000, 2),
+                "max": round(self.max_lag * 1000, 2)
+            }
+        }
+
+
+# Global runtime monitor instance
+runtime_monitor = RuntimeMonitor()
@@ -2,6 +2,18 @@ from fastapi import FastAPI, APIRouter
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from database import close_mongo_connection
+from websocket_manager import chat_manager
+from chat_persistence import chat_writer
+from chat_moderation import moderation_index
+from chat_presence import room_presence
+from chat_typing import typing_aggregator
+from rate_limit import rate_limiter
+from chat_heartbeat import heartbeat_monitor
+from runtime_monitor import runtime_monitor
+from chat_leaderboard import tip_leaderboard
+from chat_downsampling import chat_downsampler
+from chat_actors import room_actors
+from chat_dedupe import client_message_ids
 import os
 import logging
 from pathlib import Path
@@ -82,8 +94,33 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     logger.info("QuantumStrip API starting up...")
+    await runtime_monitor.start()
+    await chat_manager.start()
+    await chat_writer.start()
+    await moderation_index.start()
+    await room_presence.start()
+    await typing_aggregator.start()
+    await rate_limiter.start()
+    await heartbeat_monitor.start()
+    await tip_leaderboard.start()
+    await chat_downsampler.start()
+    await client_message_ids.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("QuantumStrip API shutting down...")
+    # Handle the messages rooms already accepted while the bus and writers are up
+    await room_actors.stop()
+    await heartbeat_monitor.stop()
+    await tip_leaderboard.stop()
+    await chat_downsampler.stop()
+    await client_message_ids.stop()
+    await chat_manager.stop()
+    await moderation_index.stop()
+    await room_presence.stop()
+    await typing_aggregator.stop()
+    await rate_limiter.stop()
+    # Drain buffered chat messages before the connection closes
+    await chat_writer.stop()
+    await runtime_monitor.stop()
     await close_mongo_connection()
@@ -9,6 +9,8 @@ import os
 from auth import get_current_user
 from database import get_database
 from models import User, UserRole, ModelProfile, PrivateShow, Transaction, TransactionType, TransactionStatus
+from rate_limit import rate_limited
+from chat_leaderboard import tip_leaderboard
 
 logger = logging.getLogger(__name__)
 
@@ -552,7 +554,7 @@ async def update_model_status(
         db = await get_database()
         
         # Update model profile
-        await db.model_profiles.update_one(
+        previous = await db.model_profiles.find_one_and_update(
             {"user_id": current_user.id},
             {
                 "$set": {
@@ -561,9 +563,14 @@ async def update_model_status(
                     "last_online": datetime.utcnow(),
                     "updated_at": datetime.utcnow()
                 }
-            }
+            },
+            projection={"is_live": 1}
         )
         
+        # Going live starts a new show, with its own tip leaderboard
+        if previous and is_live and not previous.get("is_live"):
+            await tip_leaderboard.start_session(previous["_id"])
+        
         status_text = "live" if is_live else "offline"
         return {
             "success": True,
@@ -585,7 +592,7 @@ async def update_model_status(
 @router.post("/webrtc/signal")
 async def webrtc_signal(
     request: WebRTCSignalRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(rate_limited("webrtc_signal"))
 ):
     """Handle WebRTC signaling (offer/answer/ice-candidate)"""
     try:
@@ -0,0 +1,304 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime
+from pymongo import ReturnDocument
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+from database import get_database
+from models import Transaction, TransactionType, TransactionStatus
+
+logger = logging.getLogger(__name__)
+
+# Configuration from environment
+PLATFORM_REVENUE_SHARE = float(os.getenv("PLATFORM_REVENUE_SHARE", 50))
+TIP_MODEL_CACHE_SECONDS = float(os.getenv("TIP_MODEL_CACHE_SECONDS", 60))
+# Unknown model ids are remembered for less time, so a new model can be tipped soon
+TIP_MODEL_MISS_CACHE_SECONDS = float(os.getenv("TIP_MODEL_MISS_CACHE_SECONDS", 5))
+TIP_MODEL_CACHE_SIZE = int(os.getenv("TIP_MODEL_CACHE_SIZE", 10000))
+
+
+class TipError(Exception):
+    """A tip that was refused; nothing was debited"""
+
+
+class InvalidTipAmount(TipError):
+    pass
+
+
+class ModelNotFound(TipError):
+    pass
+
+
+class ViewerProfileNotFound(TipError):
+    pass
+
+
+class InsufficientTokens(TipError):
+    def __init__(self, balance: float, amount: int):
+        super().__init__(f"Insufficient tokens. You have {balance} tokens, need {amount}")
+        self.balance = balance
+        self.amount = amount
+
+
+class TipResult:
+    __slots__ = ("transaction_id", "remaining_balance", "model_user_id", "model_earnings", "platform_fee")
+    
+    def __init__(self, transaction_id: str, remaining_balance: float, model_user_id: str, model_earnings: float, platform_fee: float):
+        self.transaction_id = transaction_id
+        self.remaining_balance = remaining_balance
+        self.model_user_id = model_user_id
+        self.model_earnings = model_earnings
+        self.platform_fee = platform_fee
+
+
+class TipService:
+    """Tips from viewers to models, shared by chat tip messages and the REST endpoint
+
+    The viewer's balance is checked and debited in a single conditional
+    find_one_and_update, so concurrent tips can never take it below zero.
+    Model profiles come from a small TTL cache. Once the debit succeeds,
+    both ledger entries go out in one insert_many alongside the model's
+    $inc credit, and the tip returns only after both were attempted.
+    Neither write is ever retried blindly: $inc is not idempotent, so a
+    write that fails after the debit is logged with everything needed to
+    reconcile it instead.
+    """
+    
+    def __init__(
+        self,
+        revenue_share: float = PLATFORM_REVENUE_SHARE,
+        cache_seconds: float = TIP_MODEL_CACHE_SECONDS,
+        miss_cache_seconds: float = TIP_MODEL_MISS_CACHE_SECONDS,
+        cache_size: int = TIP_MODEL_CACHE_SIZE
+    ):
+        self.revenue_share = revenue_share
+        self.cache_seconds = cache_seconds
+        self.miss_cache_seconds = miss_cache_seconds
+        self.cache_size = cache_size
+        # model profile id -> (profile fields or None, expires at)
+        self._models: Dict[str, Tuple[Optional[dict], float]] = {}
+        # Lookups in progress, shared by concurrent tips to the same model
+        self._loading: Dict[str, asyncio.Task] = {}
+        self.listeners: List[Callable[[dict], Awaitable[None]]] = []
+        
+        # Metrics
+        self.tips = 0
+        self.tokens = 0
+        self.refused: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.unrecorded = 0
+        self.total_tip_ms = 0.0
+        self.max_tip_ms = 0.0
+    
+    async def get_model(self, model_id: str) -> Optional[dict]:
+        """Model profile fields needed for a tip, from the cache when fresh"""
+        now = time.monotonic()
+        cached = self._models.get(model_id)
+        if cached is not None and cached[1] > now:
+            self.cache_hits += 1
+            return cached[0]
+        
+        loading = self._loading.get(model_id)
+        if loading is not None:
+            self.cache_hits += 1
+            return await asyncio.shield(loading)
+        
+        self.cache_misses += 1
+        loading = asyncio.create_task(self._load_model(model_id))
+        self._loading[model_id] = loading
+        try:
+            return await asyncio.shield(loading)
+        finally:
+            self._loading.pop(model_id, None)
+    
+    async def _load_model(self, model_id: str) -> Optional[dict]:
+        db = await get_database()
+        model = await db.model_profiles.find_one({"_id": model_id}, {"user_id": 1, "display_name": 1})
+        now = time.monotonic()
+        if len(self._models) >= self.cache_size:
+            self._models = {key: value for key, value in self._models.items() if value[1] > now}
+            if len(self._models) >= self.cache_size:
+                self._models.clear()
+        self._models[model_id] = (model, now + (self.cache_seconds if model else self.miss_cache_seconds))
+        return model
+    
+    def invalidate_model(self, model_id: str):
+        self._models.pop(model_id, None)
+    
+    def add_listener(self, listener: Callable[[dict], Awaitable[None]]):
+        """Register a coroutine run with the details of every completed tip"""
+        self.listeners.append(listener)
+    
+    async def tip(
+        self,
+        viewer_id: str,
+        viewer_username: str,
+        model_id: str,
+        amount: int,
+        message: Optional[str] = None,
+        source: str = "rest"
+    ) -> TipResult:
+        """Move tokens from a viewer to a model, raising TipError if refused"""
+        started = time.perf_counter()
+        try:
+            result = await self._tip(viewer_id, viewer_username, model_id, amount, message, source)
+        except TipError as e:
+            self.refused[type(e).__name__] = self.refused.get(type(e).__name__, 0) + 1
+            raise
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.tips += 1
+        self.tokens += amount
+        self.total_tip_ms += elapsed_ms
+        self.max_tip_ms = max(self.max_tip_ms, elapsed_ms)
+        
+        tip = {
+            "model_id": model_id,
+            "user_id": viewer_id,
+            "username": viewer_username,
+            "tokens": amount,
+            "transaction_id": result.transaction_id
+        }
+        for listener in self.listeners:
+            try:
+                await listener(tip)
+            except Exception as e:
+                logger.error(f"Error in tip listener: {e}")
+        return result
+    
+    async def _tip(self, viewer_id: str, viewer_username: str, model_id: str, amount: int, message: Optional[str], source: str) -> TipResult:
+        # A negative amount would pass the balance check and credit the viewer
+        if amount < 1:
+            raise InvalidTipAmount("Tip amount must be at least 1 token")
+        
+        model = await self.get_model(model_id)
+        if model is None:
+            raise ModelNotFound("Model not found")
+        
+        db = await get_database()
+        current_time = datetime.utcnow()
+        viewer = await db.viewer_profiles.find_one_and_update(
+            {"user_id": viewer_id, "token_balance": {"$gte": amount}},
+            {
+                "$inc": {"token_balance": -amount, "total_spent": amount},
+                "$set": {"updated_at": current_time}
+            },
+            projection={"token_balance": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if viewer is None:
+            # Refused; look at the profile only to say why
+            profile = await db.viewer_profiles.find_one({"user_id": viewer_id}, {"token_balance": 1})
+            if profile is None:
+                raise ViewerProfileNotFound("Viewer profile not found")
+            raise InsufficientTokens(profile.get("token_balance", 0), amount)
+        
+        platform_fee = amount * self.revenue_share / 100
+        model_earnings = amount - platform_fee
+        transaction_id = str(uuid.uuid4())
+        await self._record(transaction_id, viewer_id, viewer_username, model_id, model, amount, model_earnings, platform_fee, message, source)
+        return TipResult(transaction_id, viewer["token_balance"], model["user_id"], model_earnings, platform_fee)
+    
+    async def _record(
+        self,
+        transaction_id: str,
+        viewer_id: str,
+        viewer_username: str,
+        model_id: str,
+        model: dict,
+        amount: int,
+        model_earnings: float,
+        platform_fee: float,
+        message: Optional[str],
+        source: str
+    ):
+        """Write both ledger entries and credit the model, after the viewer was debited"""
+        if source == "chat":
+            summary = f"{message[:50]}{'...' if len(message) > 50 else ''}"
+            tip_description = f"Chat tip: {summary}"
+            earning_description = f"Chat tip earnings: {summary}"
+        else:
+            tip_description = f"Tip to {model.get('display_name', 'Model')}"
+            earning_description = f"Tip from {viewer_username}"
+        
+        tip_transaction = Transaction(
+            id=transaction_id,
+            user_id=viewer_id,
+            transaction_type=TransactionType.TIP,
+            amount=amount,
+            tokens=amount,
+            status=TransactionStatus.COMPLETED,
+            model_id=model_id,
+            description=tip_description,
+            metadata={
+                "message": message,
+                "source": source,
+                "model_earnings": model_earnings,
+                "platform_fee": platform_fee
+            }
+        )
+        earning_transaction = Transaction(
+            user_id=model["user_id"],
+            transaction_type=TransactionType.EARNING,
+            amount=model_earnings,
+            tokens=int(model_earnings),
+            status=TransactionStatus.COMPLETED,
+            description=earning_description,
+            metadata={
+                "original_tip": amount,
+                "platform_fee": platform_fee,
+                "tip_transaction_id": transaction_id
+            }
+        )
+        db = await get_database()
+        ledger, credit = await asyncio.gather(
+            db.transactions.insert_many([
+                tip_transaction.model_dump(by_alias=True),
+                earning_transaction.model_dump(by_alias=True)
+            ]),
+            db.model_profiles.update_one(
+                {"_id": model_id},
+                {
+                    "$inc": {"total_earnings": model_earnings, "available_balance": model_earnings},
+                    "$set": {"updated_at": datetime.utcnow()}
+                }
+            ),
+            return_exceptions=True
+        )
+        # The viewer has already paid, so the tip stands; a failed write is not
+        # retried (a timed out $inc may have been applied) but logged for reconciliation
+        if isinstance(ledger, Exception):
+            self.unrecorded += 1
+            logger.error(
+                f"Tip {transaction_id} debited {amount} tokens from viewer {viewer_id} "
+                f"but its ledger entries were not written: {ledger}"
+            )
+        if isinstance(credit, Exception):
+            self.unrecorded += 1
+            logger.error(
+                f"Tip {transaction_id} debited {amount} tokens from viewer {viewer_id} "
+                f"but model {model_id} was not credited {model_earnings}: {credit}"
+            )
+    
+    def get_stats(self) -> dict:
+        return {
+            "tips": self.tips,
+            "tokens": self.tokens,
+            "refused": dict(self.refused),
+            "avg_tip_ms": round(self.total_tip_ms / self.tips, 2) if self.tips else 0,
+            "max_tip_ms": round(self.max_tip_ms, 2),
+            "model_cache": {
+                "size": len(self._models),
+                "hits": self.cache_hits,
+                "misses": self.cache_misses
+            },
+            "unrecorded": self.unrecorded
+        }
+
+
+# Global tip service instance
+tip_service = TipService()
@@ -9,6 +9,7 @@ from auth import get_current_user
 from database import get_database
 from models import User, Transaction, TransactionType, TransactionStatus, ViewerProfile, ModelProfile
 from mpesa_service import mpesa_service, get_available_packages, get_token_price
+from rate_limit import rate_limited
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +68,7 @@ async def get_token_packages():
 @router.post("/purchase", response_model=TokenPurchaseResponse)
 async def purchase_tokens(
     request: TokenPurchaseRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(rate_limited("token_purchase"))
 ):
     """Initiate token purchase via M-Pesa STK push"""
     try:
@@ -1,141 +1,647 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List, Set
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+import asyncio
+import heapq
+import inspect
 import json
 import logging
-from datetime import datetime
+import os
+import time
 import uuid
 
+from chat_bus import create_bus
+from chat_fanout import fanout_engine, ConnectionWriter, SLOW_CONSUMER_CLOSE_CODE, SEND_FAILED_CLOSE_CODE, DROPPABLE_EVENT_TYPES, BATCH_WINDOW_SECONDS
+from chat_codec import wire_codec, JSON, MSGPACK, MSGPACK_SUBPROTOCOL
+
 logger = logging.getLogger(__name__)
 
+# Configuration from environment
+# Rooms one multiplexed connection may be subscribed to at once
+MAX_SUBSCRIPTIONS = int(os.getenv("CHAT_MAX_SUBSCRIPTIONS", 20))
+
+class Connection:
+    """A registered WebSocket connection and its outbound writer"""
+    
+    __slots__ = (
+        "websocket", "connection_id", "user_id", "username", "role", "room_id", "rooms",
+        "writer", "wire_format", "connected_at", "last_seen"
+    )
+    
+    def __init__(self, websocket: WebSocket, room_id: Optional[str], user_info: dict, writer: ConnectionWriter, wire_format: str = JSON):
+        self.websocket = websocket
+        self.connection_id = uuid.uuid4().hex
+        self.user_id = user_info["user_id"]
+        self.username = user_info["username"]
+        self.role = user_info["role"]
+        self.room_id = room_id
+        # Rooms whose events the connection receives; a multiplexed connection
+        # (no room_id) subscribes and unsubscribes over its lifetime
+        self.rooms: Set[str] = {room_id} if room_id is not None else set()
+        self.writer = writer
+        self.wire_format = wire_format
+        # Monotonic times; last_seen moves on every inbound frame
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+    
+    @property
+    def multiplexed(self) -> bool:
+        return self.room_id is None
+    
+    def public_info(self, room_id: Optional[str] = None) -> dict:
+        """User details shared with other workers and clients"""
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "role": self.role,
+            "room_id": room_id or self.room_id
+        }
+    
+    def membership_id(self, room_id: Optional[str]) -> str:
+        """Presence entry id of the connection's membership of a room"""
+        if not self.multiplexed or room_id is None:
+            return self.connection_id
+        return f"{self.connection_id}:{room_id}"
+    
+    def memberships(self) -> List[Tuple[str, dict]]:
+        """(presence entry id, user details) for each room, and for a multiplexed connection itself
+
+        The room-less entry of a multiplexed connection keeps its user online
+        for private messages while it is not subscribed to any room.
+        """
+        rooms = [self.room_id] if not self.multiplexed else [None, *self.rooms]
+        return [(self.membership_id(room_id), self.public_info(room_id)) for room_id in rooms]
+
 class ConnectionManager:
-    """Manages WebSocket connections for real-time chat"""
+    """Manages WebSocket connections for real-time chat
+
+    Connections are held locally, but every room event goes through the room
+    event bus so that workers in other processes deliver it to their own
+    connections too. Presence held by other workers is mirrored from the bus.
+    """
     
     def __init__(self):
+        # Store connection records by socket
+        self.connections: Dict[WebSocket, Connection] = {}
         # Store active connections by room
-        self.room_connections: Dict[str, List[WebSocket]] = {}
-        # Store user information by connection
-        self.connection_users: Dict[WebSocket, dict] = {}
-        # Store connections by user ID for private messaging
-        self.user_connections: Dict[str, WebSocket] = {}
+        self.room_connections: Dict[str, Set[Connection]] = {}
+        # Store every connection of a user (one per device or tab) for private messaging
+        self.user_connections: Dict[str, Set[Connection]] = {}
+        self.max_subscriptions = MAX_SUBSCRIPTIONS
+        # Connections whose writer failed, removed together on the next tick
+        self._failed_connections: Set[WebSocket] = set()
+        self._removal_task = None
+        
+        # Cross-worker event bus
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.bus = create_bus()
+        self.bus_handlers: Dict[str, Callable[[dict], Awaitable[None]]] = {
+            "room": self._on_room_event,
+            "user": self._on_user_event,
+            "all": self._on_all_event,
+            "presence": self._on_presence_event,
+            "presence_snapshot": self._on_presence_snapshot,
+            "presence_sync_request": self._on_presence_sync_request,
+            "peer_down": self._on_peer_down
+        }
+        
+        # Epoch of the sequence numbers on room events, learned from the bus
+        self.bus_epoch: Optional[str] = None
+        
+        # Callbacks that see every connection joining or leaving, local or remote
+        self.presence_listeners: List[Callable[[str, dict], None]] = []
+        # Callbacks that see every room event this worker receives
+        self.room_listeners: List[Callable[[str, dict], Optional[Awaitable[None]]]] = []
+        # Decides which room events wait for a digest instead of going out one by one
+        self.room_sampler = None
+        
+        # Connections held by other workers: worker_id -> connection_id -> user info
+        self.remote_connections: Dict[str, Dict[str, dict]] = {}
+        # Indexes over remote connections for presence queries
+        self.remote_rooms: Dict[str, Dict[str, dict]] = {}
+        self.remote_users: Dict[str, int] = {}
+    
+    async def start(self):
+        """Connect to the room event bus"""
+        await self.bus.start(self.worker_id, self._handle_bus_event, on_connected=self._on_bus_connected)
+    
+    async def stop(self):
+        """Disconnect from the room event bus"""
+        await self.bus.stop()
+    
+    def add_bus_handler(self, kind: str, handler: Callable[[dict], Awaitable[None]]):
+        """Register a handler for a custom kind of bus event"""
+        self.bus_handlers[kind] = handler
+    
+    def add_room_listener(self, listener: Callable[[str, dict], Optional[Awaitable[None]]]):
+        """Register a callback run for every room event, whether or not the room has local connections
+
+        Listeners may be plain functions or coroutine functions.
+        """
+        self.room_listeners.append(listener)
+    
+    def add_presence_listener(self, listener: Callable[[str, dict], None]):
+        """Register a callback run with ("join" | "leave", user details) for every connection change"""
+        self.presence_listeners.append(listener)
+    
+    def set_room_sampler(self, sampler):
+        """Install an object whose hold(room_id, message) returns True for room events to hold back"""
+        self.room_sampler = sampler
+    
+    def _notify_presence(self, op: str, user: dict):
+        if user["room_id"] is None:
+            # A multiplexed connection's own entry only marks its user online
+            return
+        for listener in self.presence_listeners:
+            try:
+                listener(op, user)
+            except Exception as e:
+                logger.error(f"Error in presence listener: {e}")
+    
+    async def publish(self, event: dict):
+        """Publish an event to every worker, handling it locally if the bus is down"""
+        event["origin"] = self.worker_id
+        if not await self.bus.publish(event):
+            await self._handle_bus_event(event)
+    
+    async def _handle_bus_event(self, event: dict):
+        handler = self.bus_handlers.get(event.get("kind"))
+        if handler:
+            await handler(event)
+    
+    async def connect(
+        self,
+        websocket: WebSocket,
+        room_id: Optional[str],
+        user_info: dict,
+        wire_format: str = JSON,
+        greeting: Optional[Callable[[], dict]] = None,
+        batch: bool = False
+    ):
+        """Accept WebSocket connection and add to room
+
+        greeting builds a frame that is queued at registration, ahead of any
+        room event. With batch, the client gets its events in array frames,
+        one per batch window. Rooms learn about the new user from the next
+        coalesced presence update. Without a room_id the connection is
+        multiplexed and joins rooms with subscribe.
+        """
+        await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if wire_format == MSGPACK else None)
+        connection = self.register(websocket, room_id, user_info, wire_format, greeting, batch)
+        
+        await self.publish({
+            "kind": "presence",
+            "op": "join",
+            "connection_id": connection.connection_id,
+            "user": connection.public_info()
+        })
+    
+    def register(
+        self,
+        websocket: WebSocket,
+        room_id: Optional[str],
+        user_info: dict,
+        wire_format: str = JSON,
+        greeting: Optional[Callable[[], dict]] = None,
+        batch: bool = False
+    ) -> Connection:
+        """Add an accepted connection to the registries"""
+        writer = ConnectionWriter(
+            websocket, fanout_engine, self._writer_failed,
+            batch_window=BATCH_WINDOW_SECONDS if batch else 0
+        )
+        connection = Connection(websocket, room_id, user_info, writer, wire_format)
+        self.connections[websocket] = connection
         
-    async def connect(self, websocket: WebSocket, room_id: str, user_info: dict):
-        """Accept WebSocket connection and add to room"""
-        await websocket.accept()
+        if wire_format == MSGPACK and room_id is not None:
+            # The room's intern table goes out before any frame that refers to it
+            writer.enqueue(wire_codec.intern_snapshot(room_id), "intern")
+        if greeting:
+            message = greeting()
+            writer.enqueue(wire_codec.encode(message, wire_format), message.get("type"))
         
         # Add to room connections
-        if room_id not in self.room_connections:
-            self.room_connections[room_id] = []
-        self.room_connections[room_id].append(websocket)
-        
-        # Store user info
-        self.connection_users[websocket] = {
-            "user_id": user_info["user_id"],
-            "username": user_info["username"],
-            "role": user_info["role"],
-            "room_id": room_id
-        }
+        if room_id is not None:
+            self.room_connections.setdefault(room_id, set()).add(connection)
         
         # Store user connection for private messaging
-        self.user_connections[user_info["user_id"]] = websocket
+        self.user_connections.setdefault(connection.user_id, set()).add(connection)
+        
+        self._notify_presence("join", connection.public_info())
+        logger.info(f"User {connection.username} connected to {f'room {room_id}' if room_id else 'multiplexed chat'}")
+        return connection
+    
+    async def subscribe(self, websocket: WebSocket, room_id: str, greeting: Optional[Callable[[], dict]] = None) -> bool:
+        """Add a multiplexed connection to a room
+
+        As on connect, greeting builds a frame queued ahead of any of the
+        room's events. Returns False if the connection is not multiplexed
+        or already has max_subscriptions rooms.
+        """
+        connection = self.connections.get(websocket)
+        if connection is None or not connection.multiplexed:
+            return False
+        if room_id in connection.rooms:
+            return True
+        if len(connection.rooms) >= self.max_subscriptions:
+            return False
         
-        logger.info(f"User {user_info['username']} connected to room {room_id}")
+        # Build the greeting before touching any index, so one that raises
+        # leaves the connection exactly as it was
+        frame = None
+        if greeting:
+            message = greeting()
+            frame = (wire_codec.encode(message, connection.wire_format), message.get("type"))
+        connection.rooms.add(room_id)
+        if frame:
+            connection.writer.enqueue(*frame)
+        self.room_connections.setdefault(room_id, set()).add(connection)
         
-        # Notify room of new user
-        await self.broadcast_to_room(room_id, {
-            "type": "user_connected",
-            "user_id": user_info["user_id"],
-            "username": user_info["username"],
-            "timestamp": datetime.utcnow().isoformat()
-        }, exclude_websocket=websocket)
+        user = connection.public_info(room_id)
+        self._notify_presence("join", user)
+        await self.publish({
+            "kind": "presence",
+            "op": "join",
+            "connection_id": connection.membership_id(room_id),
+            "user": user
+        })
+        return True
+    
+    async def unsubscribe(self, websocket: WebSocket, room_id: str) -> bool:
+        """Remove a multiplexed connection from a room, returning False if it was not in it"""
+        connection = self.connections.get(websocket)
+        if connection is None or not connection.multiplexed or room_id not in connection.rooms:
+            return False
         
+        connection.rooms.discard(room_id)
+        self._leave_room(connection, room_id)
+        await self.publish({
+            "kind": "presence",
+            "op": "leave",
+            "connection_id": connection.membership_id(room_id)
+        })
+        return True
+    
+    def touch(self, websocket: WebSocket):
+        """Note that a frame arrived from a connection, so it is alive"""
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+    
     async def disconnect(self, websocket: WebSocket):
         """Remove WebSocket connection"""
-        if websocket in self.connection_users:
-            user_info = self.connection_users[websocket]
-            room_id = user_info["room_id"]
-            user_id = user_info["user_id"]
-            username = user_info["username"]
-            
-            # Remove from room connections
-            if room_id in self.room_connections:
-                if websocket in self.room_connections[room_id]:
-                    self.room_connections[room_id].remove(websocket)
-                    
-                # Clean up empty rooms
-                if not self.room_connections[room_id]:
-                    del self.room_connections[room_id]
-            
-            # Remove user info
-            del self.connection_users[websocket]
-            
-            # Remove user connection
-            if user_id in self.user_connections:
-                del self.user_connections[user_id]
-            
-            logger.info(f"User {username} disconnected from room {room_id}")
-            
-            # Notify room of user disconnect
-            await self.broadcast_to_room(room_id, {
-                "type": "user_disconnected",
-                "user_id": user_id,
-                "username": username,
-                "timestamp": datetime.utcnow().isoformat()
-            })
+        await self.disconnect_many([websocket])
+    
+    async def disconnect_many(self, websockets: List[WebSocket]):
+        """Remove several WebSocket connections at once and tell the other workers"""
+        removed = [connection for connection in map(self._unregister, websockets) if connection]
+        
+        for connection in removed:
+            for membership_id, _ in connection.memberships():
+                await self.publish({
+                    "kind": "presence",
+                    "op": "leave",
+                    "connection_id": membership_id
+                })
+    
+    def _unregister(self, websocket: WebSocket) -> Optional[Connection]:
+        """Drop a connection from every registry without notifying anyone"""
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return None
+        
+        # Remove from room connections, cleaning up empty rooms
+        for room_id in connection.rooms:
+            self._leave_room(connection, room_id)
+        
+        # Remove user connection
+        devices = self.user_connections.get(connection.user_id)
+        if devices is not None:
+            devices.discard(connection)
+            if not devices:
+                del self.user_connections[connection.user_id]
+        
+        # Stop outbound writer
+        connection.writer.close()
+        
+        logger.info(f"User {connection.username} disconnected from {f'room {connection.room_id}' if connection.room_id else 'multiplexed chat'}")
+        return connection
+    
+    def _leave_room(self, connection: Connection, room_id: str):
+        """Drop a connection from one room's registry, cleaning up the room if it was the last"""
+        room = self.room_connections.get(room_id)
+        if room is not None:
+            room.discard(connection)
+            if not room:
+                del self.room_connections[room_id]
+                wire_codec.forget_room(room_id)
+        self._notify_presence("leave", connection.public_info(room_id))
+    
+    def _writer_failed(self, websocket: WebSocket):
+        """Called by a writer whose socket is dead; removal is batched"""
+        if not self._failed_connections:
+            self._removal_task = asyncio.create_task(self._remove_failed_connections())
+        self._failed_connections.add(websocket)
+    
+    async def _remove_failed_connections(self):
+        failed = list(self._failed_connections)
+        self._failed_connections.clear()
+        await self.disconnect_many(failed)
+        # Close them too: an event stream only ends its response once closed,
+        # and the socket may be half open rather than gone
+        await asyncio.gather(*(self._close_failed(websocket) for websocket in failed))
+    
+    async def _close_failed(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=SEND_FAILED_CLOSE_CODE, reason="Send failed"),
+                timeout=fanout_engine.send_timeout
+            )
+        except Exception:
+            pass
+    
+    async def _drop_slow_consumers(self, websockets: List[WebSocket]):
+        """Disconnect clients whose outbound queue stayed full for too long"""
+        logger.warning(f"Disconnecting {len(websockets)} slow consumers")
+        await self.disconnect_many(websockets)
+        for websocket in websockets:
+            try:
+                await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Slow consumer")
+            except Exception:
+                pass
+    
+    async def close_user_connections(self, room_id: str, user_id: str, code: int, reason: str):
+        """Disconnect and close this worker's connections of a user in a room
+
+        Multiplexed connections are only unsubscribed from the room, and told
+        why with an unsubscribed frame.
+        """
+        connections = [connection for connection in self.user_connections.get(user_id, ()) if room_id in connection.rooms]
+        for connection in connections:
+            if connection.multiplexed:
+                await self.unsubscribe(connection.websocket, room_id)
+                await self._enqueue([connection], {"type": "unsubscribed", "room_id": room_id, "code": code, "reason": reason})
+        
+        websockets = [connection.websocket for connection in connections if not connection.multiplexed]
+        if not websockets:
+            return
+        
+        await self.disconnect_many(websockets)
+        for websocket in websockets:
+            try:
+                await websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+    
+    async def _enqueue(self, connections: Iterable[Connection], message: dict, room_id: Optional[str] = None):
+        """Serialize once per wire format and queue on every connection's writer
+
+        room_id is given when the message reaches every connection of that
+        room on this worker, which lets MessagePack frames use the room's
+        intern table. Droppable events never add to it, since a client
+        that misses one would also miss the new entries. Multiplexed
+        connections never use intern tables, as they see many rooms' frames.
+        """
+        event_type = message.get("type")
+        if event_type in DROPPABLE_EVENT_TYPES:
+            room_id = None
+        
+        writers_by_format: Dict[Tuple[str, bool], List[ConnectionWriter]] = {}
+        for connection in connections:
+            interned = room_id is not None and not connection.multiplexed
+            writers_by_format.setdefault((connection.wire_format, interned), []).append(connection.writer)
+        
+        slow_consumers = []
+        for (wire_format, interned), writers in writers_by_format.items():
+            payload = wire_codec.encode(message, wire_format, room_id if interned else None, self.bus_epoch)
+            slow_consumers.extend(fanout_engine.fan_out(writers, payload, event_type))
+        if slow_consumers:
+            await self._drop_slow_consumers(slow_consumers)
     
     async def send_personal_message(self, message: dict, websocket: WebSocket):
         """Send message to specific WebSocket connection"""
-        try:
-            await websocket.send_text(json.dumps(message))
-        except Exception as e:
-            logger.error(f"Error sending personal message: {e}")
-            await self.disconnect(websocket)
+        connection = self.connections.get(websocket)
+        if connection is None:
+            # Not registered yet (or already gone), write straight to the socket
+            await fanout_engine.send(websocket, wire_codec.encode(message))
+            return
+        
+        await self._enqueue([connection], message)
+    
+    async def send_personal_payload(self, payload: Union[str, bytes], websocket: WebSocket, event_type: str = None):
+        """Send an already serialized frame to a specific WebSocket connection"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            await fanout_engine.send(websocket, payload)
+            return
+        
+        slow_consumers = fanout_engine.fan_out([connection.writer], payload, event_type)
+        if slow_consumers:
+            await self._drop_slow_consumers(slow_consumers)
+    
+    async def send_to_connections(self, connections: Iterable[Connection], message: dict):
+        """Send one message to the given local connections, serialized once per wire format"""
+        await self._enqueue(connections, message)
     
     async def send_private_message(self, target_user_id: str, message: dict):
-        """Send private message to specific user"""
-        if target_user_id in self.user_connections:
-            websocket = self.user_connections[target_user_id]
-            await self.send_personal_message(message, websocket)
-            return True
-        return False
+        """Send private message to every connection of a user, on whichever workers hold them"""
+        if not self.is_user_online(target_user_id):
+            return False
+        
+        await self.publish({"kind": "user", "user_id": target_user_id, "message": message})
+        return True
     
     async def broadcast_to_room(self, room_id: str, message: dict, exclude_websocket: WebSocket = None):
-        """Broadcast message to all connections in a room"""
+        """Broadcast message to all connections in a room on every worker"""
+        exclude = self.connections.get(exclude_websocket) if exclude_websocket else None
+        await self.publish({
+            "kind": "room",
+            "room_id": room_id,
+            "message": message,
+            "exclude": exclude.connection_id if exclude else None
+        })
+    
+    async def send_to_local_room(self, room_id: str, message: dict):
+        """Deliver a message to this worker's connections in a room only"""
+        await self._enqueue(list(self.room_connections.get(room_id, ())), message, room_id)
+    
+    async def broadcast_to_all(self, message: dict):
+        """Broadcast message to all connected users"""
+        await self.publish({"kind": "all", "message": message})
+    
+    # Bus event handlers
+    
+    async def _on_room_event(self, event: dict):
+        """Deliver a room event to this worker's connections"""
+        room_id = event["room_id"]
+        message = event["message"]
+        if "seq" in event:
+            # Clients see the sequence number so they can resume after a reconnect
+            message = dict(message, seq=event["seq"])
+            self.bus_epoch = event["epoch"]
+        
+        for listener in self.room_listeners:
+            try:
+                result = listener(room_id, message)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error in room listener: {e}")
+        
         if room_id not in self.room_connections:
             return
         
-        # Create a copy of connections to avoid modification during iteration
-        connections = self.room_connections[room_id].copy()
+        if self.room_sampler is not None and self.room_sampler.hold(room_id, message):
+            # Held for the room's next digest; only the sender's own devices see it now
+            devices = self.user_connections.get(message["message"]["sender_id"], ())
+            await self._enqueue([connection for connection in devices if room_id in connection.rooms], message)
+            return
         
-        for connection in connections:
-            if connection != exclude_websocket:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to room {room_id}: {e}")
-                    await self.disconnect(connection)
+        exclude = event.get("exclude")
+        if exclude:
+            targets = [
+                connection for connection in self.room_connections[room_id]
+                if connection.connection_id != exclude
+            ]
+            await self._enqueue(targets, message)
+        else:
+            await self._enqueue(list(self.room_connections[room_id]), message, room_id)
     
-    async def broadcast_to_all(self, message: dict):
-        """Broadcast message to all connected users"""
-        for room_id in self.room_connections:
-            await self.broadcast_to_room(room_id, message)
+    async def _on_user_event(self, event: dict):
+        devices = self.user_connections.get(event["user_id"])
+        if devices:
+            await self._enqueue(list(devices), event["message"])
+    
+    async def _on_all_event(self, event: dict):
+        await self._enqueue(list(self.connections.values()), event["message"])
+    
+    async def _on_bus_connected(self):
+        """Rebuild the view of other workers after (re)joining the bus"""
+        for worker_id in list(self.remote_connections):
+            self._forget_worker(worker_id)
+        await self.bus.publish({"kind": "presence_sync_request", "origin": self.worker_id})
+        await self.bus.publish(self._presence_snapshot())
+    
+    async def _on_presence_event(self, event: dict):
+        origin = event["origin"]
+        if origin == self.worker_id:
+            return
+        
+        if event["op"] == "join":
+            self._add_remote(origin, event["connection_id"], event["user"])
+        else:
+            self._remove_remote(origin, event["connection_id"])
+    
+    async def _on_presence_snapshot(self, event: dict):
+        origin = event["origin"]
+        if origin == self.worker_id:
+            return
+        
+        self._forget_worker(origin)
+        for connection_id, user in event["connections"].items():
+            self._add_remote(origin, connection_id, user)
+    
+    async def _on_presence_sync_request(self, event: dict):
+        if event["origin"] != self.worker_id:
+            await self.bus.publish(self._presence_snapshot())
+    
+    async def _on_peer_down(self, event: dict):
+        logger.info(f"Chat worker {event['origin']} left the bus")
+        self._forget_worker(event["origin"])
+    
+    # Presence
+    
+    def _presence_snapshot(self) -> dict:
+        return {
+            "kind": "presence_snapshot",
+            "origin": self.worker_id,
+            "connections": {
+                membership_id: user
+                for connection in self.connections.values()
+                for membership_id, user in connection.memberships()
+            }
+        }
+    
+    def _add_remote(self, worker_id: str, connection_id: str, user: dict):
+        worker_connections = self.remote_connections.setdefault(worker_id, {})
+        if connection_id in worker_connections:
+            return
+        worker_connections[connection_id] = user
+        if user["room_id"] is not None:
+            self.remote_rooms.setdefault(user["room_id"], {})[connection_id] = user
+        self.remote_users[user["user_id"]] = self.remote_users.get(user["user_id"], 0) + 1
+        self._notify_presence("join", user)
+    
+    def _remove_remote(self, worker_id: str, connection_id: str):
+        user = self.remote_connections.get(worker_id, {}).pop(connection_id, None)
+        if user is None:
+            return
+        
+        if user["room_id"] is not None:
+            room = self.remote_rooms.get(user["room_id"], {})
+            room.pop(connection_id, None)
+            if not room:
+                self.remote_rooms.pop(user["room_id"], None)
+        
+        remaining = self.remote_users.get(user["user_id"], 0) - 1
+        if remaining > 0:
+            self.remote_users[user["user_id"]] = remaining
+        else:
+            self.remote_users.pop(user["user_id"], None)
+        self._notify_presence("leave", user)
+    
+    def _forget_worker(self, worker_id: str):
+        for connection_id in list(self.remote_connections.get(worker_id, {})):
+            self._remove_remote(worker_id, connection_id)
+        self.remote_connections.pop(worker_id, None)
+    
+    def is_user_online(self, user_id: str) -> bool:
+        """Check whether a user has a connection on any worker"""
+        return user_id in self.user_connections or user_id in self.remote_users
     
     def get_room_users(self, room_id: str) -> List[dict]:
-        """Get list of users in a room"""
+        """Get list of users in a room across all workers"""
         users = []
-        if room_id in self.room_connections:
-            for connection in self.room_connections[room_id]:
-                if connection in self.connection_users:
-                    user_info = self.connection_users[connection]
-                    users.append({
-                        "user_id": user_info["user_id"],
-                        "username": user_info["username"],
-                        "role": user_info["role"]
-                    })
+        for connection in self.room_connections.get(room_id, ()):
+            users.append({
+                "user_id": connection.user_id,
+                "username": connection.username,
+                "role": connection.role
+            })
+        for user_info in self.remote_rooms.get(room_id, {}).values():
+            users.append({
+                "user_id": user_info["user_id"],
+                "username": user_info["username"],
+                "role": user_info["role"]
+            })
         return users
     
     def get_online_users_count(self, room_id: str) -> int:
-        """Get count of online users in a room"""
-        return len(self.room_connections.get(room_id, []))
+        """Get count of online users in a room across all workers"""
+        return len(self.room_connections.get(room_id, [])) + len(self.remote_rooms.get(room_id, {}))
+    
+    def get_stats(self) -> dict:
+        """Connection, queue depth and drop counters for monitoring"""
+        stats = fanout_engine.get_stats(connection.writer for connection in self.connections.values())
+        stats["rooms"] = len(self.room_connections)
+        stats["multiplexed"] = sum(1 for connection in self.connections.values() if connection.multiplexed)
+        stats["subscriptions"] = sum(len(connection.rooms) for connection in self.connections.values() if connection.multiplexed)
+        stats["worker_id"] = self.worker_id
+        stats["bus"] = self.bus.get_stats()
+        stats["remote_workers"] = len(self.remote_connections)
+        stats["remote_connections"] = sum(len(connections) for connections in self.remote_connections.values())
+        stats["deepest_queues"] = [
+            {
+                "user_id": connection.user_id,
+                "room_id": connection.room_id,
+                "depth": connection.writer.depth,
+                "dropped": connection.writer.dropped
+            }
+            for connection in heapq.nlargest(
+                10, self.connections.values(), key=lambda connection: connection.writer.depth
+            )
+            if connection.writer.depth
+        ]
+        return stats
 
 # Global connection manager instance
-chat_manager = ConnectionManager()
\ No newline at end of file
+chat_manager = ConnectionManager()
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+QuantumStrip chat load test
+
+Seeds synthetic viewers, one model per room and an admin into MongoDB,
+mints their JWTs with auth.create_access_token, starts the API with
+uvicorn (or targets --url), and opens many concurrent
+/api/chat/ws/chat/{room_id} connections. It then drives a mix of chat
+messages, tips and typing events for a fixed duration and reports the
+following:
+
+- Throughput.
+- End-to-end fan-out latency: from a chat message being sent to each
+  member of the room receiving it.
+- Event loop lag on both sides.
+- Server RSS.
+- Connection errors.
+
+Results are written as one JSON document so runs can be compared. The
+server's own rate limits still apply. Keep per-user rates below the
+chat_message and chat_room limits, or raise them through the rate_limit.*
+system settings, otherwise throttled messages show up as missing
+deliveries.
+
+    python chat_load_test.py --users 2000 --rooms 20 --duration 30
+    python chat_load_test.py --connections 5000 --chat-rate 50 --tip-rate 2 --typing-rate 100 --output run.json
+    python chat_load_test.py --url http://localhost:8001 --keep-users
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import requests
+import websockets
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.append(BACKEND_DIR)
+
+from auth import create_access_token, hash_password
+from database import database, close_mongo_connection
+from models import User, UserRole, ViewerProfile, ModelProfile
+from runtime_monitor import RuntimeMonitor, percentile
+
+# Marks the chat messages this harness sends so receivers can time them
+LATENCY_MARKER = "lt:"
+# Seeded accounts use this email domain so they can be found and removed
+EMAIL_DOMAIN = "loadtest.invalid"
+
+
+def summarize(values: List[float], scale: float = 1000) -> dict:
+    """Percentiles of a list of seconds, in milliseconds by default"""
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.5) * scale, 3),
+        "p90": round(percentile(values, 0.9) * scale, 3),
+        "p99": round(percentile(values, 0.99) * scale, 3),
+        "p999": round(percentile(values, 0.999) * scale, 3),
+        "max": round(max(values, default=0.0) * scale, 3)
+    }
+
+
+class SeededAccounts:
+    """Synthetic users, profiles and tokens for one run"""
+    
+    def __init__(self, run_id: str, users: int, rooms: int, token_balance: int):
+        self.run_id = run_id
+        self.user_count = users
+        self.room_count = rooms
+        self.token_balance = token_balance
+        self.viewer_tokens: List[str] = []
+        self.room_ids: List[str] = []
+        self.admin_token: Optional[str] = None
+    
+    async def create(self):
+        # Hashing is slow and nobody logs in with these, so one hash serves all
+        password_hash = hash_password(uuid.uuid4().hex)
+        users = []
+        viewer_profiles = []
+        model_profiles = []
+        
+        for index in range(self.user_count):
+            user = User(
+                username=f"lt_{self.run_id}_v{index}",
+                email=f"lt_{self.run_id}_v{index}@{EMAIL_DOMAIN}",
+                password_hash=password_hash,
+                role=UserRole.VIEWER
+            )
+            users.append(user)
+            viewer_profiles.append(ViewerProfile(user_id=user.id, token_balance=self.token_balance))
+            self.viewer_tokens.append(create_access_token(data={"sub": user.id}))
+        
+        for index in range(self.room_count):
+            user = User(
+                username=f"lt_{self.run_id}_m{index}",
+                email=f"lt_{self.run_id}_m{index}@{EMAIL_DOMAIN}",
+                password_hash=password_hash,
+                role=UserRole.MODEL
+            )
+            users.append(user)
+            # Public chat rooms are keyed by model profile id
+            profile = ModelProfile(user_id=user.id, display_name=user.username)
+            model_profiles.append(profile)
+            self.room_ids.append(profile.id)
+        
+        admin = User(
+            username=f"lt_{self.run_id}_admin",
+            email=f"lt_{self.run_id}_admin@{EMAIL_DOMAIN}",
+            password_hash=password_hash,
+            role=UserRole.ADMIN
+        )
+        users.append(admin)
+        self.admin_token = create_access_token(data={"sub": admin.id})
+        
+        await database.users.insert_many([user.model_dump(by_alias=True) for user in users])
+        await database.viewer_profiles.insert_many([profile.model_dump(by_alias=True) for profile in viewer_profiles])
+        await database.model_profiles.insert_many([profile.model_dump(by_alias=True) for profile in model_profiles])
+    
+    async def remove(self):
+        """Delete everything this run created, including the messages it sent"""
+        users = await database.users.find(
+            {"email": {"$regex": f"^lt_{self.run_id}_.*@{EMAIL_DOMAIN}$"}}, {"_id": 1}
+        ).to_list(length=None)
+        user_ids = [user["_id"] for user in users]
+        await database.viewer_profiles.delete_many({"user_id": {"$in": user_ids}})
+        await database.model_profiles.delete_many({"_id": {"$in": self.room_ids}})
+        await database.chat_messages.delete_many({"room_id": {"$in": self.room_ids}})
+        await database.chat_rooms.delete_many({"_id": {"$in": self.room_ids}})
+        await database.transactions.delete_many({"user_id": {"$in": user_ids}})
+        await database.users.delete_many({"_id": {"$in": user_ids}})
+
+
+class LoadStats:
+    """Counters shared by every client of a run"""
+    
+    def __init__(self):
+        self.connect_times: List[float] = []
+        self.connect_errors: Dict[str, int] = defaultdict(int)
+        self.disconnects: Dict[str, int] = defaultdict(int)
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.frames_received: Dict[str, int] = defaultdict(int)
+        self.bytes_received = 0
+        self.latencies: List[float] = []
+        self.expected_deliveries = 0
+        self.errors_received: Dict[str, int] = defaultdict(int)
+
+
+class ChatClient:
+    """One WebSocket chat connection; records fan-out latency of marked messages"""
+    
+    def __init__(self, url: str, room_id: str, stats: LoadStats):
+        self.url = url
+        self.room_id = room_id
+        self.stats = stats
+        self.websocket = None
+        self.reader: Optional[asyncio.Task] = None
+    
+    async def connect(self, timeout: float) -> bool:
+        started = time.perf_counter()
+        try:
+            self.websocket = await asyncio.wait_for(
+                websockets.connect(self.url, max_size=None, ping_interval=None, open_timeout=timeout),
+                timeout
+            )
+        except Exception as e:
+            self.stats.connect_errors[type(e).__name__] += 1
+            return False
+        self.stats.connect_times.append(time.perf_counter() - started)
+        self.reader = asyncio.create_task(self._read())
+        return True
+    
+    @property
+    def is_open(self) -> bool:
+        return self.reader is not None and not self.reader.done()
+    
+    async def _read(self):
+        stats = self.stats
+        try:
+            async for frame in self.websocket:
+                received_at = time.perf_counter()
+                stats.bytes_received += len(frame)
+                data = json.loads(frame)
+                event_type = data.get("type")
+                stats.frames_received[event_type] += 1
+                
+                if event_type == "chat_message":
+                    content = data["message"].get("content", "")
+                    if content.startswith(LATENCY_MARKER):
+                        stats.latencies.append(received_at - float(content.split(":")[1]))
+                elif event_type == "ping":
+                    await self.websocket.send(json.dumps({"type": "pong", "ts": data.get("ts")}))
+                elif event_type == "error":
+                    stats.errors_received[data.get("code") or data.get("message", "unknown")] += 1
+        except websockets.ConnectionClosed as e:
+            stats.disconnects[str(e.rcvd.code if e.rcvd else "no_close_frame")] += 1
+        except Exception as e:
+            stats.disconnects[type(e).__name__] += 1
+    
+    async def send(self, message: dict) -> bool:
+        try:
+            await self.websocket.send(json.dumps(message))
+            return True
+        except Exception:
+            return False
+    
+    async def close(self):
+        if self.websocket is not None:
+            try:
+                await asyncio.wait_for(self.websocket.close(), 2)
+            except Exception:
+                pass
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+class ServerProcess:
+    """uvicorn serving backend/server.py on a local port"""
+    
+    def __init__(self, port: int, workers: int):
+        self.port = port
+        self.workers = workers
+        self.process: Optional[subprocess.Popen] = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+    
+    def start(self, startup_timeout: float = 30):
+        command = [
+            sys.executable, "-m", "uvicorn", "server:app",
+            "--host", "127.0.0.1", "--port", str(self.port),
+            "--log-level", "warning"
+        ]
+        if self.workers > 1:
+            command += ["--workers", str(self.workers)]
+        env = dict(os.environ)
+        if self.workers > 1:
+            # Workers must share a bus for rooms to span them
+            env.setdefault("CHAT_BUS_BACKEND", "unix")
+        self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+        
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}")
+            try:
+                if requests.get(f"{self.url}/api/health", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("Server did not become healthy in time")
+    
+    def rss_bytes(self) -> Optional[int]:
+        """Resident memory of the server and its worker processes, Linux only"""
+        if self.process is None:
+            return None
+        total = 0
+        for pid in [self.process.pid] + self._children(self.process.pid):
+            try:
+                with open(f"/proc/{pid}/statm") as statm:
+                    total += int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except (OSError, ValueError):
+                pass
+        return total or None
+    
+    @staticmethod
+    def _children(pid: int) -> List[int]:
+        try:
+            with open(f"/proc/{pid}/task/{pid}/children") as children:
+                return [int(child) for child in children.read().split()]
+        except OSError:
+            return []
+    
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadTest:
+    """Connects the clients, drives the traffic mix and gathers the results"""
+    
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.run_id = args.run_id or uuid.uuid4().hex[:8]
+        self.accounts = SeededAccounts(self.run_id, args.users, args.rooms, args.token_balance)
+        self.server = ServerProcess(args.port, args.workers) if not args.url else None
+        self.base_url = args.url.rstrip("/") if args.url else None
+        self.stats = LoadStats()
+        self.clients: List[ChatClient] = []
+        self.room_sizes: Dict[str, int] = defaultdict(int)
+        self.client_monitor = RuntimeMonitor(interval=0.05, window=100000)
+        self.server_samples: List[dict] = []
+    
+    def _stats_url(self) -> str:
+        return f"{self.base_url}/api/admin/chat/stats"
+    
+    def _server_stats(self) -> Optional[dict]:
+        try:
+            response = requests.get(
+                self._stats_url(),
+                headers={"Authorization": f"Bearer {self.accounts.admin_token}"},
+                timeout=5
+            )
+            return response.json() if response.ok else None
+        except requests.RequestException:
+            return None
+    
+    async def _sample_server(self, interval: float = 1):
+        while True:
+            stats = await asyncio.to_thread(self._server_stats)
+            sample = {"t": time.monotonic(), "rss_bytes": self.server.rss_bytes() if self.server else None}
+            if stats and "runtime" in stats:
+                sample["loop_lag_ms"] = stats["runtime"]["loop_lag_ms"]["window_max"]
+                if sample["rss_bytes"] is None:
+                    sample["rss_bytes"] = stats["runtime"]["rss_bytes"]
+            self.server_samples.append(sample)
+            await asyncio.sleep(interval)
+    
+    async def _open_connections(self):
+        """Open connections at the ramp rate, spreading them round-robin over rooms"""
+        ws_base = self.base_url.replace("http", "ws", 1)
+        tokens = self.accounts.viewer_tokens
+        rooms = self.accounts.room_ids
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+        
+        async def open_one(index: int):
+            room_id = rooms[index % len(rooms)]
+            url = f"{ws_base}/api/chat/ws/chat/{room_id}?token={tokens[index % len(tokens)]}"
+            client = ChatClient(url, room_id, self.stats)
+            async with semaphore:
+                if await client.connect(self.args.connect_timeout):
+                    self.clients.append(client)
+                    self.room_sizes[room_id] += 1
+        
+        tasks = []
+        for index in range(self.args.connections):
+            tasks.append(asyncio.create_task(open_one(index)))
+            if self.args.ramp_rate:
+                await asyncio.sleep(1 / self.args.ramp_rate)
+        await asyncio.gather(*tasks)
+    
+    def _pick_client(self) -> Optional[ChatClient]:
+        for _ in range(10):
+            client = random.choice(self.clients)
+            if client.is_open:
+                return client
+        return None
+    
+    async def _drive(self, kind: str, rate: float, deadline: float):
+        """Send one kind of event at a fixed overall rate from random clients"""
+        if rate <= 0 or not self.clients:
+            return
+        interval = 1 / rate
+        next_send = time.perf_counter()
+        sequence = 0
+        while time.perf_counter() < deadline:
+            client = self._pick_client()
+            if client is not None:
+                sequence += 1
+                if kind == "chat":
+                    message = {"type": "chat_message", "content": f"{LATENCY_MARKER}{time.perf_counter()}:{sequence}"}
+                elif kind == "tip":
+                    message = {
+                        "type": "chat_message",
+                        "message_type": "tip",
+                        "tip_amount": self.args.tip_amount,
+                        "content": f"{LATENCY_MARKER}{time.perf_counter()}:tip{sequence}"
+                    }
+                else:
+                    message = {"type": "typing", "is_typing": True}
+                
+                if await client.send(message):
+                    self.stats.sent[kind] += 1
+                    if kind in ("chat", "tip"):
+                        self.stats.expected_deliveries += self.room_sizes[client.room_id]
+            
+            # Fixed schedule, so a slow send does not lower the offered rate
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    
+    async def run(self) -> dict:
+        await self.accounts.create()
+        if self.server:
+            await asyncio.to_thread(self.server.start)
+            self.base_url = self.server.url
+        
+        await self.client_monitor.start()
+        sampler = asyncio.create_task(self._sample_server())
+        try:
+            ramp_started = time.perf_counter()
+            await self._open_connections()
+            ramp_seconds = time.perf_counter() - ramp_started
+            # Let history and presence frames settle before measuring
+            await asyncio.sleep(self.args.settle)
+            
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(
+                self._drive("chat", self.args.chat_rate, deadline),
+                self._drive("tip", self.args.tip_rate, deadline),
+                self._drive("typing", self.args.typing_rate, deadline)
+            )
+            await asyncio.sleep(self.args.drain)
+            elapsed = time.perf_counter() - started
+            
+            final_stats = await asyncio.to_thread(self._server_stats)
+            return self._report(ramp_seconds, elapsed, final_stats)
+        finally:
+            sampler.cancel()
+            await self.client_monitor.stop()
+            await asyncio.gather(*(client.close() for client in self.clients))
+            if self.server:
+                self.server.stop()
+            if not self.args.keep_users:
+                await self.accounts.remove()
+            await close_mongo_connection()
+    
+    def _report(self, ramp_seconds: float, elapsed: float, final_stats: Optional[dict]) -> dict:
+        stats = self.stats
+        deliveries = len(stats.latencies)
+        rss = [sample["rss_bytes"] for sample in self.server_samples if sample.get("rss_bytes")]
+        server_lag = [sample["loop_lag_ms"] for sample in self.server_samples if "loop_lag_ms" in sample]
+        return {
+            "run_id": self.run_id,
+            "config": {key: value for key, value in vars(self.args).items() if key != "output"},
+            "connections": {
+                "requested": self.args.connections,
+                "opened": len(stats.connect_times),
+                "failed": dict(stats.connect_errors),
+                "open_at_end": sum(1 for client in self.clients if client.is_open),
+                "closed_by_server": dict(stats.disconnects),
+                "ramp_seconds": round(ramp_seconds, 3),
+                "connect_ms": summarize(stats.connect_times)
+            },
+            "sent": dict(stats.sent),
+            "received": {
+                "frames": dict(stats.frames_received),
+                "bytes": stats.bytes_received,
+                "errors": dict(stats.errors_received)
+            },
+            "throughput": {
+                "elapsed_seconds": round(elapsed, 3),
+                "sent_per_second": round(sum(stats.sent.values()) / elapsed, 2),
+                "deliveries_per_second": round(deliveries / elapsed, 2),
+                "frames_per_second": round(sum(stats.frames_received.values()) / elapsed, 2)
+            },
+            "fanout": {
+                "expected_deliveries": stats.expected_deliveries,
+                "deliveries": deliveries,
+                "delivery_ratio": round(deliveries / stats.expected_deliveries, 4) if stats.expected_deliveries else None,
+                "latency_ms": summarize(stats.latencies)
+            },
+            "client": {
+                "loop_lag_ms": summarize(list(self.client_monitor.samples))
+            },
+            "server": {
+                "rss_bytes": {
+                    "start": rss[0] if rss else None,
+                    "peak": max(rss) if rss else None,
+                    "end": rss[-1] if rss else None
+                },
+                "loop_lag_ms": {
+                    "peak": max(server_lag, default=None),
+                    "samples": len(server_lag)
+                },
+                "chat_stats": final_stats
+            }
+        }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the QuantumStrip chat WebSocket")
+    parser.add_argument("--url", help="Target an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when starting the server")
+    parser.add_argument("--users", type=int, default=1000, help="Synthetic viewers to create")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--connections", type=int, default=None, help="Defaults to one per user")
+    parser.add_argument("--ramp-rate", type=float, default=500, help="New connections per second, 0 for all at once")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--connect-timeout", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds between the ramp and the traffic")
+    parser.add_argument("--drain", type=float, default=3, help="Seconds to wait for in-flight deliveries")
+    parser.add_argument("--chat-rate", type=float, default=20, help="Chat messages per second, all rooms")
+    parser.add_argument("--tip-rate", type=float, default=1, help="Tip messages per second, all rooms")
+    parser.add_argument("--typing-rate", type=float, default=20, help="Typing events per second, all rooms")
+    parser.add_argument("--tip-amount", type=int, default=1)
+    parser.add_argument("--token-balance", type=int, default=100000, help="Starting balance of each viewer")
+    parser.add_argument("--run-id", help="Tag for seeded accounts; random by default")
+    parser.add_argument("--keep-users", action="store_true", help="Leave seeded accounts and messages in place")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.connections is None:
+        args.connections = args.users
+    return args
+
+
+async def main():
+    args = parse_args()
+    report = await LoadTest(args).run()
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -251,8 +251,12 @@ export const chatAPI = {
     return response.data;
   },
   
-  getRoomUsers: async (roomId) => {
-    const response = await api.get(`/chat/rooms/${roomId}/users`);
+  getRoomUsers: async (roomId, offset = 0, limit = 100) => {
+    const params = new URLSearchParams();
+    params.append('offset', offset.toString());
+    params.append('limit', limit.toString());
+    
+    const response = await api.get(`/chat/rooms/${roomId}/users?${params.toString()}`);
     return response.data;
   },
   
@@ -261,14 +265,37 @@ export const chatAPI = {
     return response.data;
   },
   
+  getConversations: async (limit = 50, before = null) => {
+    const params = new URLSearchParams();
+    params.append('limit', limit.toString());
+    if (before) params.append('before', before);
+    
+    const response = await api.get(`/chat/conversations?${params.toString()}`);
+    return response.data;
+  },
+  
+  // Without conversation ids, every conversation is marked read
+  markConversationsRead: async (conversationIds = null) => {
+    const response = await api.post('/chat/conversations/read', { conversation_ids: conversationIds });
+    return response.data;
+  },
+  
   // WebSocket connection helper
-  createWebSocketConnection: (roomId, onMessage, onError) => {
+  createWebSocketConnection: (roomId, onMessage, onError, resume = null) => {
     const token = localStorage.getItem('quantumstrip_token');
     if (!token) {
       throw new Error('No authentication token found');
     }
     
-    const wsUrl = `${API_BASE_URL.replace('http', 'ws')}/api/chat/ws/chat/${roomId}?token=${token}`;
+    // batch=1: busy rooms arrive as array frames of several events
+    let wsUrl = `${API_BASE_URL.replace('http', 'ws')}/api/chat/ws/chat/${roomId}?token=${token}&batch=1`;
+    if (resume && resume.since != null) {
+      // Resume the room stream after the last sequence number we saw
+      wsUrl += `&since=${resume.since}`;
+      if (resume.epoch) {
+        wsUrl += `&epoch=${encodeURIComponent(resume.epoch)}`;
+      }
+    }
     const ws = new WebSocket(wsUrl);
     
     ws.onopen = () => {
@@ -278,7 +305,11 @@ export const chatAPI = {
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        onMessage(data);
+        if (Array.isArray(data)) {
+          data.forEach(onMessage);
+        } else {
+          onMessage(data);
+        }
       } catch (error) {
         console.error('Error parsing WebSocket message:', error);
       }
@@ -293,6 +324,84 @@ export const chatAPI = {
       console.log(`Disconnected from chat room: ${roomId}`, event.code, event.reason);
     };
     
+    return ws;
+  },
+  
+  // Read-only stream of a room's events; the browser resumes it with Last-Event-ID
+  createRoomEventStream: (roomId, onMessage, onError, resume = null) => {
+    const token = localStorage.getItem('quantumstrip_token');
+    if (!token) {
+      throw new Error('No authentication token found');
+    }
+    
+    let url = `${API_BASE_URL}/api/chat/rooms/${roomId}/events?token=${token}`;
+    if (resume && resume.since != null) {
+      url += `&since=${resume.since}`;
+      if (resume.epoch) {
+        url += `&epoch=${encodeURIComponent(resume.epoch)}`;
+      }
+    }
+    const stream = new EventSource(url);
+    
+    stream.onmessage = (event) => {
+      try {
+        onMessage(JSON.parse(event.data));
+      } catch (error) {
+        console.error('Error parsing chat event:', error);
+      }
+    };
+    
+    stream.onerror = (error) => {
+      if (onError) onError(error);
+    };
+    
+    return stream;
+  },
+  
+  // One connection for private messages and any number of rooms
+  createMultiplexedConnection: (onMessage, onError) => {
+    const token = localStorage.getItem('quantumstrip_token');
+    if (!token) {
+      throw new Error('No authentication token found');
+    }
+    
+    const ws = new WebSocket(`${API_BASE_URL.replace('http', 'ws')}/api/chat/ws?token=${token}&batch=1`);
+    
+    // Answer heartbeats here, so an idle connection is not reaped by the server
+    const handleFrame = (data) => {
+      if (data.type === 'ping') {
+        ws.send(JSON.stringify({ type: 'pong', ts: data.ts }));
+        return;
+      }
+      onMessage(data);
+    };
+    
+    ws.onmessage = (event) => {
+      try {
+        const data = JSON.parse(event.data);
+        if (Array.isArray(data)) {
+          data.forEach(handleFrame);
+        } else {
+          handleFrame(data);
+        }
+      } catch (error) {
+        console.error('Error parsing WebSocket message:', error);
+      }
+    };
+    
+    ws.onerror = (error) => {
+      console.error('WebSocket error:', error);
+      if (onError) onError(error);
+    };
+    
+    // Room events carry their room_id; resume works as on a room connection
+    ws.subscribe = (roomId, resume = null) => {
+      ws.send(JSON.stringify({ type: 'subscribe', room_id: roomId, ...(resume || {}) }));
+    };
+    ws.unsubscribe = (roomId) => {
+      ws.send(JSON.stringify({ type: 'unsubscribe', room_id: roomId }));
+    };
+    
     return ws;
   }
 };
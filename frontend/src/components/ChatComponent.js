@@ -70,12 +70,20 @@ const ChatMessage = memo(({ message, onDeleteMessage, canDelete }) => {
 });
 
 // Typing Indicator Component
-const TypingIndicator = memo(({ typingUsers }) => {
-  if (typingUsers.length === 0) return null;
-
-  const typingText = typingUsers.length === 1 
-    ? `${typingUsers[0]} is typing...`
-    : `${typingUsers.slice(0, -1).join(', ')} and ${typingUsers[typingUsers.length - 1]} are typing...`;
+const TypingIndicator = memo(({ typingUsers, typingCount }) => {
+  if (typingCount <= 0) return null;
+
+  const others = typingCount - typingUsers.length;
+  let typingText;
+  if (typingUsers.length === 0) {
+    typingText = `${typingCount} ${typingCount === 1 ? 'person is' : 'people are'} typing...`;
+  } else if (others > 0) {
+    typingText = `${typingUsers.join(', ')} and ${others} other${others === 1 ? '' : 's'} are typing...`;
+  } else if (typingUsers.length === 1) {
+    typingText = `${typingUsers[0]} is typing...`;
+  } else {
+    typingText = `${typingUsers.slice(0, -1).join(', ')} and ${typingUsers[typingUsers.length - 1]} are typing...`;
+  }
 
   return (
     <div className="flex items-center space-x-2 px-3 py-2 text-gray-400 text-sm">
@@ -89,8 +97,29 @@ const TypingIndicator = memo(({ typingUsers }) => {
   );
 });
 
+// Top Tippers Component
+const TopTippers = memo(({ leaderboard }) => {
+  // The current show's board, or today's before anyone has tipped in it
+  const entries = leaderboard && (leaderboard.session.length ? leaderboard.session : leaderboard.day);
+  if (!entries || entries.length === 0) return null;
+
+  return (
+    <div className="bg-gray-800 rounded-lg p-3 mt-3">
+      <span className="font-semibold text-white text-sm">Top tippers</span>
+      <div className="mt-2 space-y-1">
+        {entries.slice(0, 3).map((entry, index) => (
+          <div key={entry.user_id} className="flex items-center justify-between text-xs">
+            <span className="text-gray-300 truncate">{index + 1}. {entry.username}</span>
+            <span className="text-yellow-400">{entry.tokens}</span>
+          </div>
+        ))}
+      </div>
+    </div>
+  );
+});
+
 // Online Users Component
-const OnlineUsers = memo(({ users, isCollapsed, onToggle }) => {
+const OnlineUsers = memo(({ users, count, isCollapsed, onToggle, onLoadMore }) => {
   const getRoleIcon = (role) => {
     switch (role) {
       case 'admin': return '👑';
@@ -105,7 +134,7 @@ const OnlineUsers = memo(({ users, isCollapsed, onToggle }) => {
         onClick={onToggle}
         className="flex items-center justify-between w-full text-left"
       >
-        <span className="font-semibold text-white">Online ({users.length})</span>
+        <span className="font-semibold text-white">Online ({count})</span>
         <span className="text-gray-400">
           {isCollapsed ? '▶️' : '▼'}
         </span>
@@ -119,6 +148,14 @@ const OnlineUsers = memo(({ users, isCollapsed, onToggle }) => {
               <span className="text-gray-300">{user.username}</span>
             </div>
           ))}
+          {users.length < count && (
+            <button
+              onClick={onLoadMore}
+              className="text-xs text-purple-400 hover:text-purple-300"
+            >
+              Show more
+            </button>
+          )}
         </div>
       )}
     </div>
@@ -132,7 +169,11 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
   const [newMessage, setNewMessage] = useState('');
   const [isConnected, setIsConnected] = useState(false);
   const [onlineUsers, setOnlineUsers] = useState([]);
+  const [onlineCount, setOnlineCount] = useState(0);
   const [typingUsers, setTypingUsers] = useState([]);
+  const [typingCount, setTypingCount] = useState(0);
+  const [leaderboard, setLeaderboard] = useState(null);
+  const [digestCount, setDigestCount] = useState(0);
   const [isLoading, setIsLoading] = useState(true);
   const [showTipModal, setShowTipModal] = useState(false);
   const [tipAmount, setTipAmount] = useState('');
@@ -140,9 +181,18 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
   const [isUsersCollapsed, setIsUsersCollapsed] = useState(false);
   
   const wsRef = useRef(null);
+  // Read-only event stream used until the user starts typing
+  const streamRef = useRef(null);
+  // Messages not yet acked by the server, by client message id; resent
+  // when the WebSocket (re)opens, and the server drops the duplicates
+  const unackedRef = useRef(new Map());
   const messagesEndRef = useRef(null);
   const typingTimeoutRef = useRef(null);
+  const digestTimeoutRef = useRef(null);
   const messageInputRef = useRef(null);
+  // Position in the room's event stream, for resuming after a reconnect
+  const lastSeqRef = useRef(null);
+  const epochRef = useRef(null);
 
   // Scroll to bottom of messages
   const scrollToBottom = useCallback(() => {
@@ -151,12 +201,55 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
 
   // Handle WebSocket messages
   const handleWebSocketMessage = useCallback((data) => {
+    if (data.seq != null && data.type !== 'sync' && data.type !== 'replay' && data.type !== 'reset') {
+      // While upgrading, the event stream and the new WebSocket deliver the same events
+      if (lastSeqRef.current != null && data.seq <= lastSeqRef.current) return;
+      lastSeqRef.current = data.seq;
+    }
+    
     switch (data.type) {
+      case 'sync':
+        epochRef.current = data.epoch;
+        lastSeqRef.current = data.seq;
+        break;
+        
+      case 'replay':
+        // Only the events missed while disconnected; no history frame follows
+        epochRef.current = data.epoch;
+        data.events.forEach(event => handleWebSocketMessage(event));
+        lastSeqRef.current = Math.max(lastSeqRef.current || 0, data.seq);
+        break;
+        
+      case 'reset':
+        // Too far behind to resume; the history frame that follows starts over
+        epochRef.current = data.epoch;
+        lastSeqRef.current = data.seq;
+        setMessages([]);
+        break;
+        
+
       case 'chat_message':
         setMessages(prev => [...prev, data.message]);
         scrollToBottom();
         break;
         
+      case 'chat_digest':
+        // Busy room: a sample of the last interval's viewer messages, which may include our own
+        setMessages(prev => {
+          const seen = new Set(prev.map(msg => msg.id));
+          return [...prev, ...data.messages.filter(msg => !seen.has(msg.id))];
+        });
+        setDigestCount(data.count);
+        clearTimeout(digestTimeoutRef.current);
+        digestTimeoutRef.current = setTimeout(() => setDigestCount(0), 3000);
+        scrollToBottom();
+        break;
+        
+      case 'history':
+        setMessages(data.messages);
+        scrollToBottom();
+        break;
+        
       case 'private_message':
         // Handle private messages (could show in separate modal)
         console.log('Private message received:', data.message);
@@ -164,34 +257,43 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
         
       case 'online_users':
         setOnlineUsers(data.users);
+        setOnlineCount(data.count);
         break;
         
-      case 'user_connected':
+      case 'room_users':
+        // A page of the member list requested with get_users
         setOnlineUsers(prev => {
-          const exists = prev.find(u => u.user_id === data.user_id);
-          if (!exists) {
-            return [...prev, { user_id: data.user_id, username: data.username, role: 'viewer' }];
-          }
-          return prev;
+          const known = new Set(prev.map(u => u.user_id));
+          return [...prev, ...data.users.filter(u => !known.has(u.user_id))];
         });
+        setOnlineCount(data.count);
         break;
         
-      case 'user_disconnected':
-        setOnlineUsers(prev => prev.filter(u => u.user_id !== data.user_id));
-        break;
-        
-      case 'typing':
-        if (data.user_id !== user?.id) {
-          setTypingUsers(prev => {
-            if (data.is_typing) {
-              return [...prev.filter(u => u !== data.username), data.username];
-            } else {
-              return prev.filter(u => u !== data.username);
-            }
+      case 'presence_delta':
+        // Large rooms only send the count; the list is fetched on demand
+        setOnlineCount(data.count);
+        if (data.joined || data.left) {
+          setOnlineUsers(prev => {
+            const left = new Set(data.left || []);
+            const remaining = prev.filter(u => !left.has(u.user_id));
+            const known = new Set(remaining.map(u => u.user_id));
+            return [...remaining, ...(data.joined || []).filter(u => !known.has(u.user_id))];
           });
         }
         break;
         
+      case 'typing': {
+        // Aggregated per room: how many are typing and a few of their names
+        const includesSelf = data.users.some(u => u.user_id === user?.id);
+        setTypingUsers(data.users.filter(u => u.user_id !== user?.id).map(u => u.username));
+        setTypingCount(data.count - (includesSelf ? 1 : 0));
+        break;
+      }
+        
+      case 'leaderboard':
+        setLeaderboard(data);
+        break;
+        
       case 'message_deleted':
         setMessages(prev => prev.filter(msg => msg.id !== data.message_id));
         break;
@@ -201,6 +303,23 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
         console.log('Moderation action:', data);
         break;
         
+      case 'ping':
+        // Heartbeat; a connection that stops answering is dropped by the server
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+          wsRef.current.send(JSON.stringify({ type: 'pong', ts: data.ts }));
+        }
+        break;
+        
+      case 'ack':
+        // Pending means an earlier copy is still being handled
+        if (data.status !== 'pending') {
+          unackedRef.current.delete(data.client_msg_id);
+        }
+        if (data.status === 'rejected' || data.status === 'failed') {
+          console.warn('Message not sent:', data.reason || data.status);
+        }
+        break;
+        
       case 'error':
         console.error('Chat error:', data.message);
         break;
@@ -225,12 +344,19 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
               connectWebSocket();
             }
           }, 3000);
-        }
+        },
+        { since: lastSeqRef.current, epoch: epochRef.current }
       );
 
       wsRef.current.onopen = () => {
         setIsConnected(true);
         setIsLoading(false);
+        // The WebSocket carries the room from now on
+        if (streamRef.current) {
+          streamRef.current.close();
+          streamRef.current = null;
+        }
+        unackedRef.current.forEach(frame => wsRef.current.send(frame));
       };
 
       wsRef.current.onclose = () => {
@@ -242,6 +368,38 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
     }
   }, [roomId, token, handleWebSocketMessage, isVisible]);
 
+  // Follow the room over a read-only event stream; most viewers never type
+  const connectEventStream = useCallback(() => {
+    if (!roomId || !token) return;
+
+    try {
+      streamRef.current = chatAPI.createRoomEventStream(
+        roomId,
+        handleWebSocketMessage,
+        () => {
+          // EventSource reconnects by itself, resuming after the last event id
+          setIsConnected(false);
+        },
+        { since: lastSeqRef.current, epoch: epochRef.current }
+      );
+
+      streamRef.current.onopen = () => {
+        setIsConnected(true);
+        setIsLoading(false);
+      };
+    } catch (error) {
+      console.error('Error creating chat event stream:', error);
+      setIsLoading(false);
+    }
+  }, [roomId, token, handleWebSocketMessage]);
+
+  // Switch to a WebSocket once the user is about to send something
+  const upgradeToWebSocket = useCallback(() => {
+    if (!wsRef.current) {
+      connectWebSocket();
+    }
+  }, [connectWebSocket]);
+
   // Load chat history
   const loadChatHistory = useCallback(async () => {
     try {
@@ -256,18 +414,45 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
   // Initialize chat
   useEffect(() => {
     if (isVisible && roomId) {
+      // A new room starts a new stream
+      lastSeqRef.current = null;
+      epochRef.current = null;
       setIsLoading(true);
       loadChatHistory();
-      connectWebSocket();
+      connectEventStream();
     }
 
     return () => {
+      if (streamRef.current) {
+        streamRef.current.close();
+        streamRef.current = null;
+      }
       if (wsRef.current) {
         wsRef.current.close();
         wsRef.current = null;
       }
+      unackedRef.current.clear();
     };
-  }, [isVisible, roomId, loadChatHistory, connectWebSocket]);
+  }, [isVisible, roomId, loadChatHistory, connectEventStream]);
+
+  // Request the next page of the member list
+  const loadMoreUsers = useCallback(() => {
+    if (!isConnected) return;
+
+    if (!wsRef.current || wsRef.current.readyState !== WebSocket.OPEN) {
+      // Still on the read-only event stream
+      chatAPI.getRoomUsers(roomId, onlineUsers.length, 100)
+        .then(page => handleWebSocketMessage({ type: 'room_users', users: page.online_users, count: page.count }))
+        .catch(error => console.error('Error loading room users:', error));
+      return;
+    }
+
+    wsRef.current.send(JSON.stringify({
+      type: 'get_users',
+      offset: onlineUsers.length,
+      limit: 100
+    }));
+  }, [isConnected, onlineUsers.length, roomId, handleWebSocketMessage]);
 
   // Handle typing indicator
   const handleTyping = useCallback(() => {
@@ -296,15 +481,24 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
 
   // Send message
   const sendMessage = useCallback((messageContent, messageType = 'chat_message', tipAmount = null) => {
-    if (!wsRef.current || !isConnected || !messageContent.trim()) return;
+    if (!isConnected || !messageContent.trim()) return;
 
-    wsRef.current.send(JSON.stringify({
+    const clientMsgId = crypto.randomUUID();
+    const frame = JSON.stringify({
       type: messageType,
       content: messageContent.trim(),
       message_type: tipAmount ? 'tip' : 'text',
-      tip_amount: tipAmount
-    }));
-  }, [isConnected]);
+      tip_amount: tipAmount,
+      client_msg_id: clientMsgId
+    });
+    unackedRef.current.set(clientMsgId, frame);
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      wsRef.current.send(frame);
+    } else {
+      // Sent as soon as the WebSocket opens
+      upgradeToWebSocket();
+    }
+  }, [isConnected, upgradeToWebSocket]);
 
   // Handle message submit
   const handleSubmit = (e) => {
@@ -360,7 +554,10 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
         </div>
         <div className="flex items-center space-x-2">
           <button
-            onClick={() => setShowTipModal(true)}
+            onClick={() => {
+              upgradeToWebSocket();
+              setShowTipModal(true);
+            }}
             className="text-yellow-400 hover:text-yellow-300 transition-colors"
             title="Send Tip"
           >
@@ -395,7 +592,12 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
                     canDelete={canDeleteMessage(message)}
                   />
                 ))}
-                <TypingIndicator typingUsers={typingUsers} />
+                {digestCount > 0 && (
+                  <div className="px-3 py-1 text-xs text-gray-500">
+                    Chat is busy, showing a sample of the last {digestCount} messages
+                  </div>
+                )}
+                <TypingIndicator typingUsers={typingUsers} typingCount={typingCount} />
                 <div ref={messagesEndRef} />
               </>
             )}
@@ -408,6 +610,7 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
                 ref={messageInputRef}
                 type="text"
                 value={newMessage}
+                onFocus={upgradeToWebSocket}
                 onChange={(e) => {
                   setNewMessage(e.target.value);
                   handleTyping();
@@ -432,9 +635,12 @@ const ChatComponent = ({ roomId, modelName, isVisible, onClose }) => {
         <div className="w-24 p-2 border-l border-gray-700">
           <OnlineUsers
             users={onlineUsers}
+            count={onlineCount}
             isCollapsed={isUsersCollapsed}
             onToggle={() => setIsUsersCollapsed(!isUsersCollapsed)}
+            onLoadMore={loadMoreUsers}
           />
+          <TopTippers leaderboard={leaderboard} />
         </div>
       </div>
 
@@ -53,45 +53,52 @@ const PrivateChatComponent = ({ recipientId, recipientName, isVisible, onClose }
   const handleWebSocketMessage = useCallback((data) => {
     switch (data.type) {
       case 'private_message':
+        // The connection also gets messages from other conversations
+        if (data.conversation_id && data.conversation_id !== roomId) break;
         setMessages(prev => [...prev, data.message]);
         scrollToBottom();
+        if (data.message.sender_id !== user?.id) {
+          chatAPI.markConversationsRead([roomId]).catch(error => {
+            console.error('Error marking private chat read:', error);
+          });
+        }
         break;
         
       case 'error':
         console.error('Private chat error:', data.message);
         break;
     }
-  }, [scrollToBottom]);
+  }, [roomId, user, scrollToBottom]);
 
-  // Connect to WebSocket (using regular chat connection but filtering for private messages)
+  // Connect to WebSocket (a multiplexed connection, which gets private messages without joining a room)
   const connectWebSocket = useCallback(() => {
     if (!recipientId || !token) return;
 
     try {
-      // For private chat, we'll use a dummy room and handle private messages
-      wsRef.current = chatAPI.createWebSocketConnection(
-        'private_chat',
+      const ws = chatAPI.createMultiplexedConnection(
         handleWebSocketMessage,
         (error) => {
           console.error('Private chat WebSocket error:', error);
           setIsConnected(false);
-          
-          // Attempt to reconnect after 3 seconds
-          setTimeout(() => {
-            if (isVisible) {
-              connectWebSocket();
-            }
-          }, 3000);
         }
       );
+      wsRef.current = ws;
 
-      wsRef.current.onopen = () => {
+      ws.onopen = () => {
         setIsConnected(true);
         setIsLoading(false);
       };
 
-      wsRef.current.onclose = () => {
+      ws.onclose = () => {
         setIsConnected(false);
+        
+        // Closed by an error or by the server, not by leaving the chat:
+        // attempt to reconnect after 3 seconds
+        setTimeout(() => {
+          if (isVisible && wsRef.current === ws) {
+            connectWebSocket();
+          }
+        }, 3000);
       };
     } catch (error) {
       console.error('Error creating private chat WebSocket:', error);
@@ -111,6 +118,7 @@ const PrivateChatComponent = ({ recipientId, recipientName, isVisible, onClose }
       );
       setMessages(privateMessages);
       setTimeout(scrollToBottom, 100);
+      await chatAPI.markConversationsRead([roomId]);
     } catch (error) {
       console.error('Error loading private chat history:', error);
     }
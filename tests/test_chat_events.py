@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from chat_events import event_streams
+from chat_fanout import fanout_engine
+from websocket_manager import chat_manager
+
+
+def test_stalled_event_stream_ends_when_its_send_times_out():
+    async def run():
+        await chat_manager.start()
+        send_timeout = fanout_engine.send_timeout
+        fanout_engine.send_timeout = 0.05
+        try:
+            stream = await event_streams.open("room-stalled", {
+                "user_id": "viewer-1",
+                "username": "viewer",
+                "role": "viewer"
+            })
+            body = stream.body(event_streams.retry_ms)
+            assert (await body.__anext__()).startswith("retry:")
+
+            # The client stops reading while the room keeps talking
+            for index in range(5):
+                await chat_manager.broadcast_to_room("room-stalled", {"type": "chat_message", "message": {"content": str(index)}})
+                await asyncio.sleep(0.1)
+            assert stream not in chat_manager.connections
+
+            # Whatever was queued drains, then the response ends so the browser reconnects
+            async def drain():
+                return [record async for record in body]
+
+            await asyncio.wait_for(drain(), timeout=1)
+            assert stream.closed
+        finally:
+            fanout_engine.send_timeout = send_timeout
+            await chat_manager.stop()
+
+    asyncio.run(run())